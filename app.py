@@ -1,9 +1,25 @@
-from flask import Flask, render_template, request, jsonify
-import requests
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, send_file
 import os
 from datetime import datetime
+from concurrent.futures import wait, FIRST_COMPLETED, TimeoutError as FuturesTimeoutError
+from maps_cache import ResponseCache, SqliteCache, TieredCache, TileCache, PhotoCache, SingleFlight, FlightWaitTimeout
+from shared_state import open_store
+from maps_client import MapsClient
+from city_index import CityIndex, load_city_list
+from city_resolver import CityResolver, normalize_place_name
+from geo import decode_polyline, cumulative_distances, resample, plan_search_points, RouteIndex
+from ranking import PROFILES, top_places
+from places import parse_places, filter_corridor, serialize_places
+from itinerary import plan_order
+import tracing
+import rate_limit
+import deadline
+from array import array
+import functools
 import json
-import math
+import queue
+import threading
+import time
 
 app = Flask(__name__)
 
@@ -11,6 +27,257 @@ app = Flask(__name__)
 # or replace this with your actual API key
 GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
 
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# With several worker processes, SHARED_STATE_URL (a SQLite file or a redis://
+# URL) gives them one response cache and one Maps quota budget that also
+# survive restarts (see shared_state.py)
+shared_store = open_store(os.getenv('SHARED_STATE_URL'))
+
+# Independent Places searches are fanned out over a bounded thread pool that
+# is shared by all requests, so a burst of traffic can't open unlimited sockets.
+# Tasks inherit the submitting request's trace (see tracing.py)
+PLACES_MAX_WORKERS = int(os.getenv('PLACES_MAX_WORKERS', 8))
+PLACES_REQUEST_TIMEOUT = float(os.getenv('PLACES_REQUEST_TIMEOUT', 10))  # seconds per upstream call
+places_executor = tracing.ContextThreadPoolExecutor(max_workers=PLACES_MAX_WORKERS, thread_name_prefix='places')
+# Travel-time lookups (directions, distance matrix, itineraries) are small and
+# interactive; their own pool keeps them from queueing behind city and route fan-out
+TRAVEL_MAX_WORKERS = int(os.getenv('TRAVEL_MAX_WORKERS', 4))
+travel_executor = tracing.ContextThreadPoolExecutor(max_workers=TRAVEL_MAX_WORKERS, thread_name_prefix='travel')
+
+PLACES_NEARBY_URL = 'https://maps.googleapis.com/maps/api/place/nearbysearch/json'
+GEOCODE_URL = 'https://maps.googleapis.com/maps/api/geocode/json'
+NEXT_PAGE_TOKEN_DELAY = 2  # seconds before Google accepts a next_page_token
+NEARBY_PLACE_TYPES = 'tourist_attraction|amusement_park|museum|park|zoo|aquarium'
+CITY_SEARCH_RADIUS = 50000  # 50km around the city centre
+# Searched next to the paginated tourist_attraction results, in this order
+# Most valuable first: when a request's deadline is short the tail is dropped
+CITY_ADDITIONAL_TYPES = ['amusement_park', 'museum', 'park', 'zoo', 'aquarium', 'art_gallery', 'church', 'mosque', 'synagogue']
+ROUTE_SAMPLE_SPACING = 5000  # meters between candidate search points along a route
+MAX_ROUTE_SEARCH_POINTS = 8  # nearbysearch calls allowed per route search
+ROUTE_SEARCH_CONCURRENCY = int(os.getenv('ROUTE_SEARCH_CONCURRENCY', 4))  # in-flight calls per route search
+MAX_ROUTE_DISTANCE_KM = 200  # widest corridor a route search accepts, as on the search form
+
+# City and route searches get REQUEST_DEADLINE seconds (0 = unlimited). When the
+# budget runs low they skip the least valuable remaining upstream calls and
+# return the best ranking so far, flagged "partial" (see deadline.py)
+REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', 8))
+UPSTREAM_CALL_BUDGET = float(os.getenv('UPSTREAM_CALL_BUDGET', 1.0))  # least time worth starting a call with
+
+def ran_out_of_time(budget):
+    """Whether a search stopped short for its deadline, so an empty result proves nothing"""
+    return budget is not None and (budget.partial or budget.remaining() <= 0)
+
+# Shown instead of "not found" when the deadline, not the search, came up empty
+OUT_OF_TIME_MESSAGE = 'The search ran out of time before finding attractions. Please try again.'
+
+# Running totals for the route search planner, reported under /stats
+route_plan_stats = {'routes': 0, 'search_calls': 0, 'stride_calls': 0, 'calls_saved': 0}
+route_plan_lock = threading.Lock()
+
+def record_route_plan(search_calls, stride_calls):
+    """Track how many nearbysearch calls the coverage planner saved over index striding"""
+    with route_plan_lock:
+        route_plan_stats['routes'] += 1
+        route_plan_stats['search_calls'] += search_calls
+        route_plan_stats['stride_calls'] += stride_calls
+        route_plan_stats['calls_saved'] += stride_calls - search_calls
+
+# Travel modes /get_travel_time can look up, with a time limit per mode
+TRAVEL_MODE_TIMEOUTS = {
+    'driving': float(os.getenv('DRIVING_TIMEOUT', 8)),
+    'walking': float(os.getenv('WALKING_TIMEOUT', 8)),
+    'bicycling': float(os.getenv('BICYCLING_TIMEOUT', 8)),
+    'transit': float(os.getenv('TRANSIT_TIMEOUT', 8)),
+}
+DEFAULT_TRAVEL_MODES = ['driving', 'transit']
+
+def travel_modes(data):
+    """A travel time request's ``modes`` as a list (a single mode may be sent bare), or None unless they're strings"""
+    modes = data.get('modes') or DEFAULT_TRAVEL_MODES
+    if isinstance(modes, str):
+        modes = [modes]
+    if not isinstance(modes, list) or not all(isinstance(mode, str) for mode in modes):
+        return None
+    return modes
+
+INVALID_MODES_MESSAGE = 'modes must be a travel mode name or a list of them'
+
+# Distance Matrix limits: 25 origins or destinations and 100 elements per call
+MATRIX_MAX_PER_SIDE = 25
+MATRIX_MAX_ELEMENTS_PER_CALL = 100
+MATRIX_CONCURRENCY = int(os.getenv('MATRIX_CONCURRENCY', 4))  # in-flight blocks per request
+MAX_MATRIX_ELEMENTS = 625  # pairs accepted by /get_travel_times
+MAX_ITINERARY_STOPS = MATRIX_MAX_PER_SIDE  # stops accepted by /plan_itinerary
+
+# Travel times per (mode, origin, destination) pair, so itineraries that share
+# stops only fetch the pairs they haven't seen yet
+travel_pairs = TieredCache(max_entries=int(os.getenv('TRAVEL_PAIR_CACHE_SIZE', 20000)), backend=shared_store,
+                           namespace='pairs:')
+
+# Parts of each Maps response the helpers actually read; everything else is
+# dropped while parsing (see maps_client.select_fields for the notation)
+PLACES_FIELDS = {
+    'status': True,
+    'next_page_token': True,
+    'results': [{
+        'name': True,
+        'vicinity': True,
+        'rating': True,
+        'user_ratings_total': True,
+        'types': True,
+        'place_id': True,
+        'photos': [{'photo_reference': True}],
+        'geometry': {'location': True},
+    }],
+}
+GEOCODE_FIELDS = {
+    'status': True,
+    'results': [{'formatted_address': True, 'place_id': True, 'geometry': {'location': True}}],
+}
+ROUTE_GEOMETRY_FIELDS = {
+    'status': True,
+    'routes': [{
+        'overview_polyline': True,
+        'legs': [{'steps': [{'start_location': True, 'end_location': True}]}],
+    }],
+}
+DIRECTIONS_FIELDS = {
+    'status': True,
+    'routes': [{'legs': [{'duration': True, 'distance': True, 'departure_time': True, 'arrival_time': True}]}],
+}
+
+# Shared response cache in front of every outbound Maps call. Set
+# MAPS_CACHE_PATH to a file to also keep responses on disk across restarts.
+MAPS_CACHE_PATH = os.getenv('MAPS_CACHE_PATH')
+maps_cache = ResponseCache(
+    max_entries=int(os.getenv('MAPS_CACHE_SIZE', 2048)),
+    backend=shared_store or (SqliteCache(MAPS_CACHE_PATH) if MAPS_CACHE_PATH else None)
+)
+
+# Nearby results bucketed by geohash so overlapping searches are answered locally
+places_tiles = TileCache(ttl=int(os.getenv('PLACES_TILE_TTL', 24 * 3600)), backend=shared_store)
+PLACES_MAX_RADIUS = 50000  # Google caps nearbysearch radius at 50km
+PLACES_PAGE_SIZE = 20  # results per nearbysearch page
+
+# Place photos are proxied and kept on disk so repeat page loads don't hit Google
+PHOTO_URL = 'https://maps.googleapis.com/maps/api/place/photo'
+PHOTO_WIDTHS = (100, 200, 400, 800)  # variants we store; requests snap up to one of these
+PHOTO_MAX_AGE = 30 * 24 * 3600  # browser cache lifetime, seconds
+photo_cache = PhotoCache(
+    os.getenv('PHOTO_CACHE_DIR', os.path.join(APP_DIR, 'photo_cache')),
+    max_bytes=int(os.getenv('PHOTO_CACHE_MAX_MB', 256)) * 1024 * 1024
+)
+
+# Identical concurrent lookups share one upstream computation
+single_flight = SingleFlight()
+
+def flight_key(key):
+    """``key`` for the single-flight layer, split by whether the caller has a deadline
+    
+    A run started under a request's deadline may skip work, so callers without
+    one (background index rebuilds) never share it and never get a partial result.
+    """
+    return key, deadline.current() is None
+
+def coalesced(make_key):
+    """Decorator: concurrent calls whose ``make_key(*args)`` match run the helper only once
+    
+    Work the shared run skipped for its deadline marks every caller's response partial.
+    A caller waits for someone else's run only until its own deadline.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                key = flight_key(make_key(*args, **kwargs))
+            except (TypeError, ValueError):
+                # Arguments no key can be built from (e.g. coordinates that aren't
+                # numbers): the helper handles those itself, so run it unshared
+                return fn(*args, **kwargs)
+            try:
+                result, skipped = single_flight.do_within(deadline.remaining(), key,
+                                                          deadline.capture, fn, *args, **kwargs)
+            except FlightWaitTimeout:
+                # The shared run outlasted our budget: run it ourselves with what is
+                # left, which skips the upstream calls and keeps what the caches have
+                deadline.skip('shared_wait')
+                return fn(*args, **kwargs)
+            deadline.skip_all(skipped)
+            return result
+        return wrapper
+    return decorator
+
+# Top attractions for the most requested cities, built ahead of time so those
+# searches are answered without calling Google (see city_index.py)
+def build_city_index_entry(city_name):
+    """Fresh top attractions for the city index, at background quota priority
+    
+    A search that left work out for a deadline returns None, so the index keeps
+    its old entry rather than storing a partial ranking as a full one.
+    """
+    with rate_limit.priority(rate_limit.BACKGROUND):
+        attractions, skipped = deadline.capture(get_city_attractions, city_name)
+    if skipped:
+        print(f"Not indexing a partial search for {city_name} (skipped {', '.join(sorted(skipped))})")
+        return None
+    return serialize_places(attractions or [])
+
+city_index = CityIndex(
+    os.getenv('CITY_INDEX_PATH', os.path.join(APP_DIR, 'city_index.json')),
+    build=build_city_index_entry,
+    cities=load_city_list(os.getenv('CITY_INDEX_CITIES', os.path.join(APP_DIR, 'popular_cities.txt'))),
+    fresh_for=int(os.getenv('CITY_INDEX_TTL', 24 * 3600)),
+    max_stale=int(os.getenv('CITY_INDEX_MAX_STALE', 7 * 24 * 3600))
+)
+
+# City names that were geocoded once resolve locally from then on, and feed
+# /autocomplete_city (see city_resolver.py)
+def geocode_city(city_name):
+    return maps_client.get_json('geocode', GEOCODE_URL, {'address': city_name, 'key': GOOGLE_MAPS_API_KEY},
+                                fields=GEOCODE_FIELDS)
+
+city_resolver = CityResolver(
+    os.getenv('CITY_RESOLVER_PATH', os.path.join(APP_DIR, 'city_names.json')),
+    geocode=geocode_city,
+    max_entries=int(os.getenv('CITY_RESOLVER_MAX_ENTRIES', 50000))
+)
+
+def indexed_attractions(city_name):
+    """City index entry for ``city_name`` or for the indexed city it's another spelling of"""
+    indexed = city_index.get(city_name)
+    if indexed:
+        return indexed
+    # 'Paris, France' is served from the 'Paris' entry, but only if 'Paris'
+    # resolves to the same place (not for 'Paris, TX')
+    place = city_resolver.lookup(city_name)
+    if place is None or normalize_place_name(place['name']) == normalize_place_name(city_name):
+        return None
+    canonical = city_resolver.lookup(place['name'])
+    if canonical is None or canonical['place_id'] != place['place_id']:
+        return None
+    return city_index.get(place['name'])
+
+# Outbound calls are paced per API to stay under Google's QPS quotas. MAPS_QPS
+# sets the default rate, MAPS_QPS_<API> overrides one API; 0 means unpaced
+MAPS_DEFAULT_QPS = float(os.getenv('MAPS_QPS', 50))
+rate_limiter = rate_limit.RateLimiter(
+    {api: float(os.getenv(f'MAPS_QPS_{api.upper()}', MAPS_DEFAULT_QPS))
+     for api in ('geocode', 'places', 'directions', 'distancematrix', 'photo')},
+    burst_seconds=float(os.getenv('MAPS_QPS_BURST', 1.0)),  # seconds of quota that may go out at once
+    max_wait=float(os.getenv('MAPS_QUOTA_MAX_WAIT', 30)),
+    store=shared_store
+)
+
+# One pooled, keep-alive client for all Maps web service traffic
+maps_client = MapsClient(
+    cache=maps_cache,
+    pool_size=int(os.getenv('MAPS_POOL_SIZE', (PLACES_MAX_WORKERS + TRAVEL_MAX_WORKERS) * 2)),
+    timeout=PLACES_REQUEST_TIMEOUT,
+    max_retries=int(os.getenv('MAPS_MAX_RETRIES', 3)),
+    limiter=rate_limiter
+)
+
 # Famous locations fallback when user denies location
 FAMOUS_LOCATIONS = [
     {
@@ -85,10 +352,103 @@ FAMOUS_LOCATIONS = [
     }
 ]
 
+# Request tracing: Server-Timing header (opt-in) and a log line for slow requests
+SERVER_TIMING = os.getenv('SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_SECONDS', 5))
+
+@app.before_request
+def start_request_trace():
+    # Route pattern rather than path, so /photo/<ref> is one metric series
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    request.environ['maps.trace_token'] = tracing.start_trace(endpoint)
+
+@app.after_request
+def finish_request_trace(response):
+    trace = tracing.current_trace()
+    if trace is None:
+        return response
+    tracing.record_request(trace, request.method, response.status_code)
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = trace.server_timing()
+    if trace.elapsed() >= SLOW_REQUEST_SECONDS:
+        print(f"Slow request {request.method} {request.path}: {trace.elapsed():.2f}s, "
+              f"{trace.upstream_calls()} Maps calls ({trace.describe()})")
+    return response
+
+@app.teardown_request
+def end_request_trace(error=None):
+    token = request.environ.pop('maps.trace_token', None)
+    if token is not None:
+        tracing.end_trace(token)
+
 @app.route('/')
 def index():
     return render_template('index.html', api_key=GOOGLE_MAPS_API_KEY)
 
+@app.route('/stats')
+def stats():
+    return jsonify({
+        'cache': maps_cache.stats(),
+        'upstream': maps_client.stats.snapshot(),
+        'tiles': places_tiles.stats(),
+        'single_flight': single_flight.stats(),
+        'city_index': city_index.stats(),
+        'city_resolver': city_resolver.stats(),
+        'rate_limit': rate_limiter.stats(),
+        'shared_state': shared_store.stats() if shared_store is not None else None,
+        'route_planner': dict(route_plan_stats)
+    })
+
+@app.route('/autocomplete_city')
+def autocomplete_city():
+    """City name suggestions from previously resolved names; never calls Google"""
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 8, type=int), 20))
+    return jsonify({'query': query, 'suggestions': city_resolver.suggest(query, limit)})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(tracing.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/photo/<path:photo_reference>')
+def photo(photo_reference):
+    """Serve a place photo from the local thumbnail cache, fetching it once from Google"""
+    requested_width = request.args.get('maxwidth', 400, type=int)
+    width = next((w for w in PHOTO_WIDTHS if w >= requested_width), PHOTO_WIDTHS[-1])
+    
+    path = photo_cache.get(photo_reference, width)
+    if path is None:
+        try:
+            content, _ = maps_client.get_content('photo', PHOTO_URL, {
+                'maxwidth': width,
+                'photo_reference': photo_reference,
+                'key': GOOGLE_MAPS_API_KEY
+            })
+        except Exception as e:
+            print(f"Error fetching photo {photo_reference[:20]}...: {e}")
+            return jsonify({'error': 'Photo temporarily unavailable'}), 502
+        
+        if not content:
+            return jsonify({'error': 'Photo not found'}), 404
+        path = photo_cache.put(photo_reference, width, content)
+    
+    with open(path, 'rb') as f:
+        is_png = f.read(4) == b'\x89PNG'
+    
+    # A photo reference + width always names the same image, so the variant
+    # name is a strong ETag and browsers may keep it for a long time
+    response = send_file(
+        path,
+        mimetype='image/png' if is_png else 'image/jpeg',
+        etag=PhotoCache.variant_name(photo_reference, width),
+        conditional=True,
+        max_age=PHOTO_MAX_AGE
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/get_recommendations', methods=['POST'])
 def get_recommendations():
     try:
@@ -104,11 +464,12 @@ def get_recommendations():
             })
         
         # Get nearby places using Google Places API
-        nearby_places = get_nearby_places(lat, lng)
+        with deadline.budget(REQUEST_DEADLINE):
+            nearby_places = get_nearby_places(lat, lng)
         
         if nearby_places:
             return jsonify({
-                'recommendations': nearby_places,
+                'recommendations': serialize_places(nearby_places),
                 'source': 'nearby'
             })
         else:
@@ -130,15 +491,35 @@ def search_city_attractions():
         if not city_name:
             return jsonify({'error': 'City name is required'}), 400
         
+        # Popular cities come straight from the precomputed index
+        indexed = indexed_attractions(city_name)
+        if indexed:
+            return jsonify({
+                'attractions': indexed,
+                'city': city_name,
+                'count': len(indexed),
+                'partial': False
+            })
+        
         # Get city attractions using Google Places API
-        attractions = get_city_attractions(city_name)
+        with deadline.budget(REQUEST_DEADLINE) as budget:
+            attractions = get_city_attractions(city_name, early_return=bool(data.get('early_return', False)))
         
         if attractions:
             return jsonify({
-                'attractions': attractions,
+                'attractions': serialize_places(attractions),
                 'city': city_name,
-                'count': len(attractions)
+                'count': len(attractions),
+                'partial': bool(budget and budget.partial)
             })
+        elif ran_out_of_time(budget):
+            return jsonify({
+                'error': OUT_OF_TIME_MESSAGE,
+                'attractions': [],
+                'city': city_name,
+                'count': 0,
+                'partial': True
+            }), 503, {'Retry-After': '1'}
         else:
             return jsonify({
                 'error': f'No attractions found for "{city_name}". Please check the spelling or try a different city.',
@@ -150,37 +531,77 @@ def search_city_attractions():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def route_distance_km(data):
+    """A route search's ``distance_km`` (default 50), or None unless it's a number in (0, MAX_ROUTE_DISTANCE_KM]"""
+    distance_km = data.get('distance_km', 50)
+    if isinstance(distance_km, bool) or not isinstance(distance_km, (int, float)):
+        return None
+    # Also false for NaN
+    return distance_km if 0 < distance_km <= MAX_ROUTE_DISTANCE_KM else None
+
+INVALID_DISTANCE_MESSAGE = f'distance_km must be a number greater than 0 and at most {MAX_ROUTE_DISTANCE_KM}'
+
 @app.route('/get_route_attractions', methods=['POST'])
 def get_route_attractions():
     try:
         data = request.json
         origin = data.get('origin')
         destination = data.get('destination')
-        distance_km = data.get('distance_km', 50)  # Default 50km
+        distance_km = route_distance_km(data)
         
         if not origin or not destination:
             return jsonify({'error': 'Origin and destination are required'}), 400
+        if distance_km is None:
+            return jsonify({'error': INVALID_DISTANCE_MESSAGE}), 400
         
         # Get route attractions using Google Places API
-        attractions = get_attractions_along_route(origin, destination, distance_km)
+        with deadline.budget(REQUEST_DEADLINE) as budget:
+            attractions = get_attractions_along_route(origin, destination, distance_km)
+        partial = bool(budget and budget.partial)
         
         if attractions:
             return jsonify({
-                'attractions': attractions,
+                'attractions': serialize_places(attractions),
                 'count': len(attractions),
-                'distance_filter': distance_km
+                'distance_filter': distance_km,
+                'partial': partial
             })
         else:
+            out_of_time = ran_out_of_time(budget)
             return jsonify({
                 'attractions': [],
                 'count': 0,
                 'distance_filter': distance_km,
-                'message': 'No popular attractions found along this route'
+                'partial': out_of_time,
+                'message': OUT_OF_TIME_MESSAGE if out_of_time else 'No popular attractions found along this route'
             })
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/get_route_attractions/stream', methods=['POST'])
+def get_route_attractions_stream():
+    """Same search as /get_route_attractions, streamed as NDJSON events"""
+    data = request.json or {}
+    origin = data.get('origin')
+    destination = data.get('destination')
+    distance_km = route_distance_km(data)
+    
+    if not origin or not destination:
+        return jsonify({'error': 'Origin and destination are required'}), 400
+    if distance_km is None:
+        return jsonify({'error': INVALID_DISTANCE_MESSAGE}), 400
+    
+    def generate():
+        try:
+            with deadline.budget(REQUEST_DEADLINE):
+                for event in stream_attractions_along_route(origin, destination, distance_km):
+                    yield json.dumps(event) + '\n'
+        except Exception as e:
+            yield json.dumps({'event': 'error', 'error': str(e)}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/get_travel_time', methods=['POST'])
 def get_travel_time():
     try:
@@ -191,401 +612,710 @@ def get_travel_time():
         if not origin or not destination:
             return jsonify({'error': 'Origin and destination are required'}), 400
         
-        # Get travel time for driving
-        driving_time = get_directions(origin, destination, 'driving')
+        modes = travel_modes(data)
+        if modes is None:
+            return jsonify({'error': INVALID_MODES_MESSAGE}), 400
+        invalid_modes = [mode for mode in modes if mode not in TRAVEL_MODE_TIMEOUTS]
+        if invalid_modes:
+            return jsonify({'error': f'Unsupported travel modes: {", ".join(map(str, invalid_modes))}'}), 400
+        
+        # Look up every mode in parallel; each one has its own time limit. A user
+        # is waiting on these, so they go ahead of searches in the quota queue
+        with rate_limit.priority(rate_limit.INTERACTIVE):
+            return jsonify(get_directions_for_modes(origin, destination, modes))
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/get_travel_times', methods=['POST'])
+def get_travel_times():
+    try:
+        data = request.json
+        origins = data.get('origins')
+        destinations = data.get('destinations')
+        mode = data.get('mode', 'driving')
+        
+        if not origins or not destinations or not isinstance(origins, list) or not isinstance(destinations, list):
+            return jsonify({'error': 'Origins and destinations must be non-empty lists'}), 400
         
-        # Get travel time for transit
-        transit_time = get_directions(origin, destination, 'transit')
+        if mode not in TRAVEL_MODE_TIMEOUTS:
+            return jsonify({'error': f'Unsupported travel mode: {mode}'}), 400
         
+        if len(origins) * len(destinations) > MAX_MATRIX_ELEMENTS:
+            return jsonify({'error': f'At most {MAX_MATRIX_ELEMENTS} origin/destination pairs per request'}), 400
+        
+        with rate_limit.priority(rate_limit.INTERACTIVE):
+            rows = get_travel_time_matrix(origins, destinations, mode)
         return jsonify({
-            'driving': driving_time,
-            'transit': transit_time
+            'origins': origins,
+            'destinations': destinations,
+            'mode': mode,
+            'rows': rows
         })
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/plan_itinerary', methods=['POST'])
+def plan_itinerary():
+    try:
+        data = request.json
+        place_ids = data.get('place_ids')
+        mode = data.get('mode', 'driving')
+        round_trip = bool(data.get('round_trip', False))
+        
+        if not isinstance(place_ids, list) or not all(isinstance(place_id, str) and place_id for place_id in place_ids):
+            return jsonify({'error': 'place_ids must be a list of place IDs'}), 400
+        
+        place_ids = list(dict.fromkeys(place_ids))
+        if not 2 <= len(place_ids) <= MAX_ITINERARY_STOPS:
+            return jsonify({'error': f'An itinerary needs between 2 and {MAX_ITINERARY_STOPS} distinct places'}), 400
+        
+        if mode not in TRAVEL_MODE_TIMEOUTS:
+            return jsonify({'error': f'Unsupported travel mode: {mode}'}), 400
+        
+        start_place_id = data.get('start_place_id') or place_ids[0]
+        if start_place_id not in place_ids:
+            return jsonify({'error': 'start_place_id must be one of place_ids'}), 400
+        
+        with rate_limit.priority(rate_limit.INTERACTIVE):
+            return jsonify(build_itinerary(place_ids, mode, start_place_id, round_trip))
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@coalesced(lambda lat, lng, radius=500000: ('nearby', round(float(lat), 5), round(float(lng), 5), radius))
 def get_nearby_places(lat, lng, radius=500000):  # 500km radius
     """Get nearby popular places using Google Places API"""
-    base_url = 'https://maps.googleapis.com/maps/api/place/nearbysearch/json'
-    
-    params = {
-        'location': f'{lat},{lng}',
-        'radius': radius,
-        'type': 'tourist_attraction|amusement_park|museum|park|zoo|aquarium',
-        'key': GOOGLE_MAPS_API_KEY
-    }
-    
     try:
-        response = requests.get(base_url, params=params)
-        data = response.json()
+        # Goes through the tile cache, so nearby users share one upstream search
+        results = search_places_by_type(lat, lng, NEARBY_PLACE_TYPES, radius)
         
-        if data['status'] == 'OK':
-            places = []
-            
-            # Filter and prepare places with professional scoring
-            filtered_places = []
-            for place in data['results']:
-                rating = place.get('rating', 0)
-                user_ratings_total = place.get('user_ratings_total', 0)
-                
-                # Only include places with good ratings and some reviews
-                if rating >= 4.0 and user_ratings_total >= 5:
-                    place_info = {
-                        'name': place['name'],
-                        'location': place['vicinity'],
-                        'rating': rating,
-                        'user_ratings_total': user_ratings_total,
-                        'types': place.get('types', []),
-                        'photo_reference': place.get('photos', [{}])[0].get('photo_reference') if place.get('photos') else None,
-                        'place_id': place.get('place_id')
-                    }
-                    filtered_places.append(place_info)
-            
-            # Professional sorting: combine rating and review count with weighted scoring
-            def calculate_professional_score(place):
-                rating = place['rating']
-                review_count = place['user_ratings_total']
-                
-                # Weighted scoring system:
-                # - Rating weight: 70% (rating normalized to 0-1 scale)
-                # - Review count weight: 30% (logarithmic scale to prevent overwhelming by review count)
-                rating_score = (rating - 1) / 4  # Normalize 1-5 rating to 0-1
-                
-                # Logarithmic scaling for review count (prevents places with 10k reviews from always winning)
-                review_score = min(math.log10(review_count + 1) / 4, 1.0)  # Cap at 1.0
-                
-                # Combined weighted score
-                professional_score = (rating_score * 0.7) + (review_score * 0.3)
-                
-                # Bonus for very high ratings with substantial reviews
-                if rating >= 4.5 and review_count >= 100:
-                    professional_score += 0.1
-                
-                return professional_score
-            
-            # Sort by professional score
-            sorted_places = sorted(filtered_places, key=calculate_professional_score, reverse=True)
-            
-            # Take top 10
-            places = sorted_places[:10]
-            
-            return places
+        if results:
+            return rank_nearby_places(results)
         else:
-            print(f"Places API error: {data['status']}")
+            print(f"No nearby places found around {lat},{lng}")
             return None
     
     except Exception as e:
         print(f"Error fetching nearby places: {e}")
         return None
 
-def get_city_attractions(city_name):
-    """Get top attractions in a specific city using Google Places API"""
-    # First, geocode the city to get its coordinates
-    geocode_url = 'https://maps.googleapis.com/maps/api/geocode/json'
-    geocode_params = {
-        'address': city_name,
-        'key': GOOGLE_MAPS_API_KEY
-    }
+@tracing.timed('rank')
+def rank_nearby_places(results):
+    """Filter raw nearby results into Place records and return the top 10"""
+    # Professional ranking (70% rating, 30% reviews)
+    filtered_places = parse_places(results, PROFILES['nearby'], default_location='')
+    return top_places(filtered_places, PROFILES['nearby'])
+
+@tracing.timed('rank')
+def rank_city_attractions(attractions, city_name):
+    """Deduplicate, filter and rank raw city search results, returning the top 20"""
+    # Dedup by place_id and filter straight into compact Place records
+    filtered_attractions = parse_places(attractions, PROFILES['city'], default_location=city_name,
+                                        seen_place_ids=set())
+    
+    # Professional ranking (65% rating, 35% reviews, popularity bonuses), top 20
+    return top_places(filtered_attractions, PROFILES['city'])
+
+@coalesced(lambda city_name, early_return=False: ('city', normalize_place_name(city_name), early_return))
+def get_city_attractions(city_name, early_return=False):
+    """Get top attractions in a specific city using Google Places API
     
+    With ``early_return`` the search stops paging as soon as the results fetched
+    so far already fill the top 20, trading pages 2-3 for ~2-4s of latency.
+    """
     try:
-        # Get city coordinates
-        geocode_response = requests.get(geocode_url, params=geocode_params)
-        geocode_data = geocode_response.json()
-        
-        if geocode_data['status'] != 'OK' or not geocode_data['results']:
-            print(f"Geocoding failed for {city_name}: {geocode_data['status']}")
+        # First, resolve the city to its coordinates (geocoding only names not seen before)
+        place = city_resolver.resolve(city_name)
+        if place is None:
             return None
+        lat, lng = place['lat'], place['lng']
         
-        # Get the first result (most relevant)
-        location = geocode_data['results'][0]['geometry']['location']
-        lat, lng = location['lat'], location['lng']
+        # Start paging through tourist attractions in the background. The 2s wait
+        # before each next_page_token becomes valid is a timer, not a sleeping
+        # worker, so the per-type searches below overlap with it
+        pager = PaginatedPlacesSearch(lat, lng, 'tourist_attraction', radius=CITY_SEARCH_RADIUS, max_pages=3)
+        pager.start()
         
-        # Search for attractions using Places API
-        places_url = 'https://maps.googleapis.com/maps/api/place/nearbysearch/json'
-        attractions = []
-        next_page_token = None
-        
-        # We'll make multiple requests to get more results
-        for page in range(3):  # Get up to 60 results (20 per page)
-            params = {
-                'location': f'{lat},{lng}',
-                'radius': 50000,  # 50km radius
-                'type': 'tourist_attraction',
-                'key': GOOGLE_MAPS_API_KEY
-            }
-            
-            if next_page_token:
-                params['pagetoken'] = next_page_token
-            
-            response = requests.get(places_url, params=params)
-            data = response.json()
-            
-            if data['status'] == 'OK':
-                attractions.extend(data['results'])
-                next_page_token = data.get('next_page_token')
-                
-                if not next_page_token:
-                    break
-                    
-                # Wait for next page token to become valid
-                import time
-                time.sleep(2)
-            else:
-                break
-        
-        # Also search for other types of attractions
-        additional_types = ['amusement_park', 'museum', 'park', 'zoo', 'aquarium', 'art_gallery', 'church', 'mosque', 'synagogue']
+        # Also search for other types of attractions (concurrently, one call per type),
+        # only as many waves of them as the remaining budget has room for
+        additional_types = affordable_types(CITY_ADDITIONAL_TYPES)
+        type_futures = submit_places_by_types(lat, lng, additional_types, radius=CITY_SEARCH_RADIUS)
         
-        for attraction_type in additional_types:
-            params = {
-                'location': f'{lat},{lng}',
-                'radius': 50000,
-                'type': attraction_type,
-                'key': GOOGLE_MAPS_API_KEY
-            }
-            
-            response = requests.get(places_url, params=params)
-            data = response.json()
-            
-            if data['status'] == 'OK':
-                attractions.extend(data['results'])
-        
-        # Remove duplicates based on place_id
-        unique_attractions = {}
-        for place in attractions:
-            place_id = place.get('place_id')
-            if place_id and place_id not in unique_attractions:
-                unique_attractions[place_id] = place
-        
-        # Filter and prepare attractions with professional scoring
-        filtered_attractions = []
-        for place in unique_attractions.values():
-            rating = place.get('rating', 0)
-            user_ratings_total = place.get('user_ratings_total', 0)
-            
-            # Only include places with good ratings and enough reviews
-            if rating >= 4.0 and user_ratings_total >= 10:
-                place_info = {
-                    'name': place['name'],
-                    'location': place.get('vicinity', city_name),
-                    'rating': rating,
-                    'user_ratings_total': user_ratings_total,
-                    'types': place.get('types', []),
-                    'photo_reference': place.get('photos', [{}])[0].get('photo_reference') if place.get('photos') else None,
-                    'place_id': place.get('place_id')
-                }
-                filtered_attractions.append(place_info)
-        
-        # Professional sorting: combine rating and review count with weighted scoring
-        def calculate_professional_score(place):
-            rating = place['rating']
-            review_count = place['user_ratings_total']
-            
-            # Weighted scoring system:
-            # - Rating weight: 65% (slightly lower for city search as we want popular places)
-            # - Review count weight: 35% (higher weight for city attractions)
-            rating_score = (rating - 1) / 4  # Normalize 1-5 rating to 0-1
-            
-            # Logarithmic scaling for review count with higher emphasis for city attractions
-            review_score = min(math.log10(review_count + 1) / 4.5, 1.0)  # Slightly different scaling
-            
-            # Combined weighted score
-            professional_score = (rating_score * 0.65) + (review_score * 0.35)
-            
-            # Bonus for very high ratings with substantial reviews
-            if rating >= 4.5 and review_count >= 500:
-                professional_score += 0.15  # Higher bonus for city attractions
-            elif rating >= 4.3 and review_count >= 1000:
-                professional_score += 0.1   # Bonus for very popular places
-            
-            # Additional bonus for tourist attractions (main category)
-            if 'tourist_attraction' in place.get('types', []):
-                professional_score += 0.05
+        # Pages come first so dedup keeps the same winner as before
+        attractions = []
+        type_results = None
+        for page_results in pager.iter_pages():
+            attractions.extend(page_results)
             
-            return professional_score
+            # Early termination: once the pages fetched so far already yield a
+            # full top 20, don't wait another 2s+ for the remaining pages
+            if early_return and pager.has_more():
+                if type_results is None:
+                    type_results = collect_places_by_types(additional_types, type_futures)
+                candidates = attractions + [place for results in type_results for place in results]
+                ranked = rank_city_attractions(candidates, city_name)
+                if len(ranked) >= PROFILES['city'].limit:
+                    pager.cancel()
+                    return ranked
         
-        # Sort by professional score
-        sorted_attractions = sorted(filtered_attractions, key=calculate_professional_score, reverse=True)
+        if type_results is None:
+            type_results = collect_places_by_types(additional_types, type_futures)
+        for results in type_results:
+            attractions.extend(results)
         
         # Return top 20
-        return sorted_attractions[:20]
+        return rank_city_attractions(attractions, city_name)
         
     except Exception as e:
         print(f"Error fetching city attractions for {city_name}: {e}")
         return None
 
-def get_attractions_along_route(origin, destination, distance_km):
-    """Get attractions along a travel route with route-specific scoring (40% reviews, 60% stars)"""
-    try:
-        # First, get the route from Google Directions API
-        directions_url = 'https://maps.googleapis.com/maps/api/directions/json'
-        directions_params = {
-            'origin': origin,
-            'destination': destination,
-            'mode': 'driving',
-            'key': GOOGLE_MAPS_API_KEY
-        }
-        
-        directions_response = requests.get(directions_url, params=directions_params)
-        directions_data = directions_response.json()
-        
-        if directions_data['status'] != 'OK' or not directions_data['routes']:
-            return None
+def affordable_types(place_types):
+    """The leading ``place_types`` whose searches fit in the request's remaining budget"""
+    left = deadline.remaining()
+    if left is None or UPSTREAM_CALL_BUDGET <= 0:
+        # No deadline (background rebuilds, the CLI): every type is affordable
+        return place_types
+    waves = int(left // UPSTREAM_CALL_BUDGET)
+    affordable = place_types[:waves * PLACES_MAX_WORKERS]
+    if len(affordable) < len(place_types):
+        deadline.skip('additional_types')
+    return affordable
+
+def nearby_params(lat, lng, place_type, radius):
+    """Query parameters for a single-page Places nearbysearch"""
+    return {
+        'location': f'{lat},{lng}',
+        'radius': radius,
+        'type': place_type,
+        'key': GOOGLE_MAPS_API_KEY
+    }
+
+def store_nearby_results(lat, lng, place_type, radius, data):
+    """File a nearbysearch response in the tile cache and return its results"""
+    effective_radius = min(radius, PLACES_MAX_RADIUS)
+    if data['status'] == 'OK':
+        # A full page (or one with more behind it) holds only the circle's top
+        # results, which can't stand in for a smaller search inside it
+        if len(data['results']) < PLACES_PAGE_SIZE and not data.get('next_page_token'):
+            places_tiles.put(place_type, lat, lng, effective_radius, data['results'])
+        return data['results']
+    if data['status'] == 'ZERO_RESULTS':
+        places_tiles.put(place_type, lat, lng, effective_radius, [])
+    return []
+
+def search_places_by_type(lat, lng, place_type, radius):
+    """Run a single Places nearbysearch for one type and return its raw results"""
+    # Answer from an already fetched circle that contains this one, if any
+    cached = places_tiles.get(place_type, lat, lng, min(radius, PLACES_MAX_RADIUS))
+    if cached is not None:
+        return cached
+    
+    data = maps_client.get_json('places', PLACES_NEARBY_URL, nearby_params(lat, lng, place_type, radius),
+                                fields=PLACES_FIELDS)
+    return store_nearby_results(lat, lng, place_type, radius, data)
+
+def search_places_by_types(lat, lng, place_types, radius):
+    """Search several place types concurrently and return their results in request order"""
+    return collect_places_by_types(place_types, submit_places_by_types(lat, lng, place_types, radius))
+
+def submit_places_by_types(lat, lng, place_types, radius):
+    """Start one background nearbysearch per type and return the futures"""
+    return [places_executor.submit(search_places_by_type, lat, lng, place_type, radius)
+            for place_type in place_types]
+
+def collect_places_by_types(place_types, futures):
+    """Wait for per-type searches and return their results in request order
+    
+    A failed or timed out type is logged and skipped so the remaining types still
+    contribute. Results come back in the order of ``place_types`` (not completion
+    order) so that dedup-by-place_id keeps the same winner as a sequential loop.
+    """
+    # The whole batch is bounded by one per-call timeout plus a little slack,
+    # so latency is that of the slowest call rather than the sum of all of them,
+    # and never runs past the request deadline
+    done, not_done = wait(futures, timeout=deadline.wait_time(PLACES_REQUEST_TIMEOUT + 1))
+    
+    results = []
+    for place_type, future in zip(place_types, futures):
+        if future in not_done:
+            future.cancel()
+            print(f"Places search for {place_type} timed out")
+            deadline.skip('additional_types')
+            continue
+        try:
+            results.append(future.result())
+        except Exception as e:
+            print(f"Places search for {place_type} failed: {e}")
+            if isinstance(e, TimeoutError):
+                deadline.skip('additional_types')
+    
+    return results
+
+def run_bounded(fn, items, limit, executor=None):
+    """Run ``fn(item)`` on a pool (the shared Places pool by default) with at most ``limit`` calls in flight
+    
+    Yields (index, result, error) in completion order. A call that doesn't
+    finish within the per-request timeout, or that the request deadline leaves
+    no room to start, is reported as a TimeoutError.
+    """
+    executor = executor or places_executor
+    items = list(items)
+    pending = {}
+    next_index = 0
+    
+    while next_index < len(items) or pending:
+        while next_index < len(items) and len(pending) < limit:
+            if not deadline.allows(UPSTREAM_CALL_BUDGET):
+                # Too little time left to start another call; finish what is in flight
+                for index in range(next_index, len(items)):
+                    yield index, None, deadline.DeadlineExceeded('skipped to meet the request deadline')
+                next_index = len(items)
+                break
+            pending[executor.submit(fn, items[next_index])] = next_index
+            next_index += 1
+        if not pending:
+            return
         
-        # Get route polyline points
-        route = directions_data['routes'][0]
-        
-        # Sample points along the route, excluding first and last 20%
-        all_route_points = []
-        total_distance = 0
-        
-        # First pass: collect all route points with their cumulative distances
-        for leg in route['legs']:
-            for step in leg['steps']:
-                start_location = step['start_location']
-                end_location = step['end_location']
-                step_distance = step['distance']['value']  # in meters
-                
-                # Add start point with current distance
-                all_route_points.append({
-                    'lat': start_location['lat'],
-                    'lng': start_location['lng'],
-                    'distance': total_distance
-                })
-                
-                # If step is long, add intermediate points
-                if step_distance > 20000:  # 20km
-                    # Simple interpolation for long steps
-                    lat_diff = end_location['lat'] - start_location['lat']
-                    lng_diff = end_location['lng'] - start_location['lng']
-                    
-                    num_points = int(step_distance / 20000)
-                    for i in range(1, num_points):
-                        ratio = i / num_points
-                        inter_lat = start_location['lat'] + (lat_diff * ratio)
-                        inter_lng = start_location['lng'] + (lng_diff * ratio)
-                        inter_distance = total_distance + (step_distance * ratio)
-                        
-                        all_route_points.append({
-                            'lat': inter_lat,
-                            'lng': inter_lng,
-                            'distance': inter_distance
-                        })
-                
-                total_distance += step_distance
-        
-        # Add final destination
-        final_leg = route['legs'][-1]
-        final_step = final_leg['steps'][-1]
-        end_location = final_step['end_location']
-        all_route_points.append({
-            'lat': end_location['lat'],
-            'lng': end_location['lng'],
-            'distance': total_distance
-        })
+        done, _ = wait(pending, timeout=deadline.wait_time(PLACES_REQUEST_TIMEOUT + 1), return_when=FIRST_COMPLETED)
+        if not done:
+            # Nothing finished in time: give up on everything still outstanding
+            for future, index in pending.items():
+                future.cancel()
+                yield index, None, TimeoutError('upstream call timed out')
+            for index in range(next_index, len(items)):
+                yield index, None, TimeoutError('skipped after upstream timeout')
+            return
         
-        # Filter points to middle 60% of the route (exclude first and last 20%)
-        start_distance = total_distance * 0.2  # 20% of total distance
-        end_distance = total_distance * 0.8    # 80% of total distance
+        for future in done:
+            index = pending.pop(future)
+            try:
+                yield index, future.result(), None
+            except Exception as e:
+                yield index, None, e
+
+class PaginatedPlacesSearch:
+    """Fetch the pages of a nearbysearch in the background
+    
+    Google only accepts a next_page_token a couple of seconds after issuing it.
+    Instead of sleeping in the request thread, each follow-up page is scheduled
+    on a timer and fetched on the shared pool; pages are handed back in order
+    through a queue as soon as they arrive.
+    """
+    
+    def __init__(self, lat, lng, place_type, radius, max_pages=3):
+        self.params = {
+            'location': f'{lat},{lng}',
+            'radius': radius,
+            'type': place_type,
+            'key': GOOGLE_MAPS_API_KEY
+        }
+        self.max_pages = max_pages
+        self._pages = queue.Queue()
+        self._timer = None
+        self._cancelled = False
+        self._more = True
+    
+    def start(self):
+        places_executor.submit(self._fetch_page, 0, None)
+    
+    def has_more(self):
+        """Whether another page is still scheduled or in flight"""
+        return self._more and not self._cancelled
+    
+    def cancel(self):
+        """Stop scheduling further pages"""
+        self._cancelled = True
+        if self._timer:
+            self._timer.cancel()
+    
+    def iter_pages(self):
+        """Yield each page's raw results in order until the search is exhausted"""
+        # Every page gets the token delay plus its own request timeout
+        page_timeout = NEXT_PAGE_TOKEN_DELAY + PLACES_REQUEST_TIMEOUT + 1
+        while True:
+            try:
+                page = self._pages.get(timeout=deadline.wait_time(page_timeout))
+            except queue.Empty:
+                print(f"Places page for {self.params['type']} timed out")
+                deadline.skip('extra_pages')
+                self.cancel()
+                return
+            if page is None:
+                return
+            yield page
+    
+    def _fetch_page(self, page, next_page_token):
+        if self._cancelled:
+            self._pages.put(None)
+            return
         
-        route_points = []
-        for point in all_route_points:
-            if start_distance <= point['distance'] <= end_distance:
-                route_points.append((point['lat'], point['lng']))
+        params = dict(self.params)
+        if next_page_token:
+            params['pagetoken'] = next_page_token
         
-        # Search for attractions near middle route points (excluding first/last 20%)
-        all_attractions = []
-        distance_meters = distance_km * 1000
+        try:
+            data = maps_client.get_json('places', PLACES_NEARBY_URL, params, fields=PLACES_FIELDS)
+        except Exception as e:
+            print(f"Places page {page + 1} for {self.params['type']} failed: {e}")
+            data = {'status': 'ERROR'}
         
-        # Limit search points to avoid too many API calls (focus on middle section)
-        search_points = route_points[::max(1, len(route_points) // 8)]  # Max 8 search points from middle section
+        if data['status'] != 'OK':
+            self._more = False
+            self._pages.put(None)
+            return
         
-        for lat, lng in search_points:
-            places_url = 'https://maps.googleapis.com/maps/api/place/nearbysearch/json'
-            params = {
-                'location': f'{lat},{lng}',
-                'radius': min(distance_meters, 50000),  # Max 50km radius per API limits
-                'type': 'tourist_attraction',
-                'key': GOOGLE_MAPS_API_KEY
-            }
-            
-            response = requests.get(places_url, params=params)
-            data = response.json()
-            
-            if data['status'] == 'OK':
-                all_attractions.extend(data['results'])
-        
-        # Remove duplicates based on place_id
-        unique_attractions = {}
-        for place in all_attractions:
-            place_id = place.get('place_id')
-            if place_id and place_id not in unique_attractions:
-                unique_attractions[place_id] = place
-        
-        # Filter and score attractions with route-specific algorithm
-        filtered_attractions = []
-        for place in unique_attractions.values():
-            rating = place.get('rating', 0)
-            user_ratings_total = place.get('user_ratings_total', 0)
-            
-            # Route-specific filtering (slightly more lenient)
-            if rating >= 3.8 and user_ratings_total >= 10:
-                # Get exact coordinates from the place data
-                geometry = place.get('geometry', {})
-                location_coords = geometry.get('location', {})
-                
-                place_info = {
-                    'name': place['name'],
-                    'location': place.get('vicinity', 'Along route'),
-                    'rating': rating,
-                    'user_ratings_total': user_ratings_total,
-                    'types': place.get('types', []),
-                    'photo_reference': place.get('photos', [{}])[0].get('photo_reference') if place.get('photos') else None,
-                    'place_id': place.get('place_id'),
-                    'lat': location_coords.get('lat'),
-                    'lng': location_coords.get('lng')
-                }
-                
-                # Only include if we have valid coordinates
-                if place_info['lat'] and place_info['lng']:
-                    filtered_attractions.append(place_info)
-        
-        # Route-specific scoring: 60% stars, 40% reviews
-        def calculate_route_score(place):
-            rating = place['rating']
-            review_count = place['user_ratings_total']
-            
-            # Route scoring system: 60% rating, 40% reviews
-            rating_score = (rating - 1) / 4  # Normalize 1-5 rating to 0-1
-            review_score = min(math.log10(review_count + 1) / 4, 1.0)
-            
-            # Combined weighted score (60% rating, 40% reviews)
-            route_score = (rating_score * 0.6) + (review_score * 0.4)
-            
-            # Bonus for very high ratings
-            if rating >= 4.5 and review_count >= 100:
-                route_score += 0.1
-            
-            return route_score
+        next_page_token = data.get('next_page_token')
+        if next_page_token and page + 1 < self.max_pages and not self._cancelled:
+            # Wait for next page token to become valid without holding a worker
+            # (no wait at all when that page is already cached)
+            next_params = dict(self.params, pagetoken=next_page_token)
+            delay = 0 if maps_client.is_cached('places', next_params, PLACES_FIELDS) else NEXT_PAGE_TOKEN_DELAY
+            if not deadline.allows(delay + UPSTREAM_CALL_BUDGET):
+                # Not worth the token wait this close to the deadline
+                deadline.skip('extra_pages')
+                self._more = False
+                self._pages.put(data['results'])
+                self._pages.put(None)
+                return
+            # Queue this page first: with a cached next page the timer fires at
+            # once, and that page must not overtake this one (or its end marker
+            # would cut this one off)
+            self._pages.put(data['results'])
+            self._timer = threading.Timer(
+                delay,
+                tracing.bind(lambda: places_executor.submit(self._fetch_page, page + 1, next_page_token))
+            )
+            self._timer.daemon = True
+            self._timer.start()
+        else:
+            self._more = False
+            self._pages.put(data['results'])
+            self._pages.put(None)
+
+def route_geometry(route):
+    """Return (lats, lngs) arrays for a Directions route, preferring its overview polyline"""
+    encoded = route.get('overview_polyline', {}).get('points')
+    if encoded:
+        return decode_polyline(encoded)
+    
+    # Fall back to the step endpoints when no polyline was returned
+    lats, lngs = array('d'), array('d')
+    for leg in route['legs']:
+        for step in leg['steps']:
+            lats.append(step['start_location']['lat'])
+            lngs.append(step['start_location']['lng'])
+    end_location = route['legs'][-1]['steps'][-1]['end_location']
+    lats.append(end_location['lat'])
+    lngs.append(end_location['lng'])
+    return lats, lngs
+
+def plan_route_search(origin, destination, distance_km):
+    """Fetch the driving route and pick nearbysearch centres along its middle 60%
+    
+    Returns (search_points, search_radius, corridor), or None when no route was found.
+    """
+    # First, get the route from Google Directions API
+    directions_data = maps_client.get_json('directions', DIRECTIONS_URL,
+                                           route_directions_params(origin, destination),
+                                           fields=ROUTE_GEOMETRY_FIELDS)
+    return route_search_points(directions_data, distance_km)
+
+def route_directions_params(origin, destination):
+    """Query parameters for the driving route that attraction searches follow"""
+    return {
+        'origin': origin,
+        'destination': destination,
+        'mode': 'driving',
+        'key': GOOGLE_MAPS_API_KEY
+    }
+
+@tracing.timed('route_plan')
+def route_search_points(directions_data, distance_km):
+    """Pick nearbysearch centres along the middle 60% of a Directions response's first route
+    
+    Also returns a RouteIndex over the whole route, used to keep only places
+    that really are within ``distance_km`` of the road.
+    """
+    if directions_data['status'] != 'OK' or not directions_data['routes']:
+        return None
+    
+    # Decode the route geometry into compact coordinate arrays
+    route = directions_data['routes'][0]
+    route_lats, route_lngs = route_geometry(route)
+    distances = cumulative_distances(route_lats, route_lngs)
+    total_distance = distances[-1] if len(distances) else 0
+    
+    # Evenly spaced points over the middle 60% of the route (exclude first and last 20%)
+    start_distance = total_distance * 0.2  # 20% of total distance
+    end_distance = total_distance * 0.8    # 80% of total distance
+    
+    distance_meters = distance_km * 1000
+    search_radius = min(distance_meters, 50000)  # Max 50km radius per API limits
+    
+    # Samples must be no further apart than the search radius so gaps between them stay covered
+    spacing = max(1000, min(ROUTE_SAMPLE_SPACING, search_radius))
+    sample_lats, sample_lngs, _ = resample(route_lats, route_lngs, spacing,
+                                           start_distance, end_distance, distances)
+    
+    # Fewest search circles that cover the middle section, capped to limit API calls
+    centers = plan_search_points(sample_lats, sample_lngs, search_radius, MAX_ROUTE_SEARCH_POINTS)
+    search_points = [(sample_lats[i], sample_lngs[i]) for i in centers]
+    
+    # Compare against the old fixed index stride over the same samples
+    stride_calls = len(range(0, len(sample_lats), max(1, len(sample_lats) // 8)))
+    record_route_plan(len(search_points), stride_calls)
+    
+    corridor = RouteIndex(route_lats, route_lngs, distance_meters, distances)
+    return search_points, search_radius, corridor
+
+def iter_route_searches(search_points, search_radius):
+    """Yield (index, raw results) for each search point as soon as its nearbysearch finishes
+    
+    Searches run on the shared pool with at most ROUTE_SEARCH_CONCURRENCY in
+    flight for this request. Failed points are logged and skipped. Points are
+    started from the middle of the route outwards, so the ones a tight
+    deadline leaves out are those furthest from the middle.
+    """
+    def search(point):
+        lat, lng = point
+        return search_places_by_type(lat, lng, 'tourist_attraction', search_radius)
+    
+    order = route_search_order(len(search_points))
+    for position, results, error in run_bounded(search, [search_points[i] for i in order],
+                                                ROUTE_SEARCH_CONCURRENCY):
+        index = order[position]
+        if error is not None:
+            print(f"Route search at {search_points[index]} failed: {error}")
+            if isinstance(error, TimeoutError):
+                deadline.skip('route_points')
+            continue
+        yield index, results
+
+def route_search_order(count):
+    """Search point indexes from the middle of the route outwards"""
+    middle = (count - 1) / 2
+    return sorted(range(count), key=lambda i: abs(i - middle))
+
+@tracing.timed('dedup')
+def filter_route_places(raw_places, seen_place_ids, corridor):
+    """Filter raw route search results to the corridor, skipping place_ids already in ``seen_place_ids``"""
+    # Route-specific filtering (slightly more lenient); markers need exact coordinates
+    places = parse_places(raw_places, PROFILES['route'], default_location='Along route',
+                          seen_place_ids=seen_place_ids, require_coords=True)
+    # A search circle reaches further from the road than distance_km in places;
+    # keep only what is truly within distance_km of the route
+    return filter_corridor(places, corridor)
+
+def merge_route_results(results_by_point, corridor):
+    """Filter per-point search results in route order, so the dedup winner
+    doesn't depend on which response arrived first"""
+    seen_place_ids = set()
+    filtered_attractions = []
+    for results in results_by_point:
+        filtered_attractions.extend(filter_route_places(results, seen_place_ids, corridor))
+    return filtered_attractions
+
+@tracing.timed('rank')
+def rank_route_attractions(attractions, k=None):
+    """Best route attractions by route score (60% stars, 40% reviews), top 15 by default"""
+    return top_places(attractions, PROFILES['route'], k)
+
+@coalesced(lambda origin, destination, distance_km: (
+    'route', normalize_place_name(origin), normalize_place_name(destination), distance_km))
+def get_attractions_along_route(origin, destination, distance_km):
+    """Get attractions along a travel route with route-specific scoring (40% reviews, 60% stars)"""
+    try:
+        plan = plan_route_search(origin, destination, distance_km)
+        if plan is None:
+            return None
+        search_points, search_radius, corridor = plan
         
-        # Sort by route score
-        sorted_attractions = sorted(filtered_attractions, key=calculate_route_score, reverse=True)
+        # Search all points concurrently, then merge in route order
+        results_by_point = [[] for _ in search_points]
+        for index, results in iter_route_searches(search_points, search_radius):
+            results_by_point[index] = results
         
         # Return top 15 attractions along the route
-        return sorted_attractions[:15]
+        return rank_route_attractions(merge_route_results(results_by_point, corridor))
         
     except Exception as e:
         print(f"Error fetching route attractions: {e}")
         return None
 
-def get_directions(origin, destination, mode):
-    """Get directions from Google Maps Directions API"""
-    base_url = 'https://maps.googleapis.com/maps/api/directions/json'
+def stream_attractions_along_route(origin, destination, distance_km):
+    """Yield route attractions event by event as each search point completes
+    
+    Each ``attractions`` event carries only places not sent before, already
+    filtered and ranked. The final ``done`` event has the same top 15 that
+    get_attractions_along_route would return.
+    """
+    try:
+        plan = plan_route_search(origin, destination, distance_km)
+    except Exception as e:
+        print(f"Error fetching route attractions: {e}")
+        plan = None
+    
+    if plan is None:
+        yield {'event': 'done', 'attractions': [], 'count': 0, 'distance_filter': distance_km,
+               'message': 'No popular attractions found along this route'}
+        return
+    search_points, search_radius, corridor = plan
+    
+    seen_place_ids = set()
+    results_by_point = [[] for _ in search_points]
+    completed = 0
+    for index, results in iter_route_searches(search_points, search_radius):
+        completed += 1
+        results_by_point[index] = results
+        batch = filter_route_places(results, seen_place_ids, corridor)
+        new_attractions = rank_route_attractions(batch, k=len(batch))
+        yield {'event': 'attractions', 'attractions': serialize_places(new_attractions),
+               'completed': completed, 'total': len(search_points)}
+    
+    # Events went out in completion order; rank the final list from the
+    # route-ordered merge, exactly as get_attractions_along_route does
+    top_attractions = rank_route_attractions(merge_route_results(results_by_point, corridor))
+    budget = deadline.current()
+    yield {'event': 'done', 'attractions': serialize_places(top_attractions), 'count': len(top_attractions),
+           'distance_filter': distance_km, 'partial': bool(budget and budget.partial)}
+
+def get_directions_for_modes(origin, destination, modes):
+    """Run get_directions for several travel modes concurrently, keyed by mode
+    
+    Each mode gets its own timeout, so a slow transit backend only turns the
+    transit entry into an error instead of delaying the other modes.
+    """
+    started = time.monotonic()
+    futures = {mode: travel_executor.submit(get_directions, origin, destination, mode,
+                                             TRAVEL_MODE_TIMEOUTS[mode])
+               for mode in dict.fromkeys(modes)}
+    
+    results = {}
+    for mode, future in futures.items():
+        remaining = TRAVEL_MODE_TIMEOUTS[mode] - (time.monotonic() - started)
+        try:
+            results[mode] = future.result(timeout=max(0, remaining))
+        except FuturesTimeoutError:
+            future.cancel()
+            results[mode] = {
+                'status': 'error',
+                'message': f'Timed out looking up {mode} directions'
+            }
+    
+    return results
+
+def get_travel_time_matrix(origins, destinations, mode='driving'):
+    """Travel times for every origin/destination pair via the Distance Matrix API
+    
+    Returns rows[i][j] for origins[i] -> destinations[j], each element shaped
+    like a get_directions result. The pairs are split into blocks within
+    Google's per-request limits and the blocks are fetched concurrently.
+    """
+    # Widest destination block first, then as many origins as the element limit allows
+    destination_chunk = min(MATRIX_MAX_PER_SIDE, len(destinations))
+    origin_chunk = min(MATRIX_MAX_PER_SIDE, max(1, MATRIX_MAX_ELEMENTS_PER_CALL // destination_chunk))
+    
+    blocks = [(o, d)
+              for o in range(0, len(origins), origin_chunk)
+              for d in range(0, len(destinations), destination_chunk)]
+    
+    def fetch_block(block):
+        o, d = block
+        return get_distance_matrix(origins[o:o + origin_chunk], destinations[d:d + destination_chunk], mode)
+    
+    rows = [[None] * len(destinations) for _ in origins]
+    for index, block_rows, error in run_bounded(fetch_block, blocks, MATRIX_CONCURRENCY, travel_executor):
+        o, d = blocks[index]
+        for i in range(o, min(o + origin_chunk, len(origins))):
+            for j in range(d, min(d + destination_chunk, len(destinations))):
+                if error is not None:
+                    rows[i][j] = {'status': 'error', 'message': str(error)}
+                else:
+                    rows[i][j] = block_rows[i - o][j - d]
+    
+    return rows
+
+def get_pair_matrix(locations, mode):
+    """Travel times between every ordered pair of ``locations``, reusing cached pairs
+    
+    Returns rows[i][j] shaped like get_travel_time_matrix; only the origins and
+    destinations that have uncached pairs go to the Distance Matrix API.
+    """
+    rows = [[None] * len(locations) for _ in locations]
+    missing_origins, missing_destinations = set(), set()
+    for i, origin in enumerate(locations):
+        for j, destination in enumerate(locations):
+            if i == j:
+                rows[i][j] = {'duration': '0 mins', 'distance': '0 km', 'duration_seconds': 0,
+                              'distance_meters': 0, 'status': 'success'}
+                continue
+            element = travel_pairs.get((mode, origin, destination))
+            if element is None:
+                missing_origins.add(i)
+                missing_destinations.add(j)
+            else:
+                rows[i][j] = element
+    
+    if missing_origins:
+        origin_indexes, destination_indexes = sorted(missing_origins), sorted(missing_destinations)
+        fetched = get_travel_time_matrix([locations[i] for i in origin_indexes],
+                                         [locations[j] for j in destination_indexes], mode)
+        ttl = maps_cache.ttl_for('distancematrix', {'departure_time': 'now'} if mode == 'transit' else {})
+        for a, i in enumerate(origin_indexes):
+            for b, j in enumerate(destination_indexes):
+                if i == j:
+                    continue
+                element = fetched[a][b]
+                if rows[i][j] is None:
+                    rows[i][j] = element
+                if element['status'] == 'success':
+                    travel_pairs.set((mode, locations[i], locations[j]), element, ttl)
+    
+    return rows
+
+def build_itinerary(place_ids, mode, start_place_id, round_trip=False):
+    """Visiting order for ``place_ids`` starting at ``start_place_id``, with every leg's travel time"""
+    rows = get_pair_matrix([f'place_id:{place_id}' for place_id in place_ids], mode)
+    durations = [[element['duration_seconds'] if element['status'] == 'success' else None for element in row]
+                 for row in rows]
+    
+    with tracing.stage('itinerary'):
+        order = plan_order(durations, place_ids.index(start_place_id), round_trip)
+    
+    stops = order + [order[0]] if round_trip else order
+    legs = [dict(rows[a][b], **{'from': place_ids[a], 'to': place_ids[b]}) for a, b in zip(stops, stops[1:])]
+    reachable = [leg for leg in legs if leg['status'] == 'success']
+    total_seconds = sum(leg['duration_seconds'] for leg in reachable)
+    
+    return {
+        'order': [place_ids[i] for i in order],
+        'legs': legs,
+        'mode': mode,
+        'round_trip': round_trip,
+        'total_duration': format_duration(total_seconds),
+        'total_duration_seconds': total_seconds,
+        'total_distance_meters': sum(leg['distance_meters'] for leg in reachable),
+        'unreachable_legs': len(legs) - len(reachable)
+    }
+
+def format_duration(seconds):
+    """Google-style duration text, e.g. '2 hours 5 mins'"""
+    hours, minutes = divmod(int(round(seconds / 60)), 60)
+    if not hours:
+        return f'{minutes} min' if minutes == 1 else f'{minutes} mins'
+    hour_text = '1 hour' if hours == 1 else f'{hours} hours'
+    return f'{hour_text} {minutes} mins' if minutes else hour_text
+
+def get_distance_matrix(origins, destinations, mode):
+    """Fetch one Distance Matrix block and convert it to get_directions-style elements"""
+    base_url = 'https://maps.googleapis.com/maps/api/distancematrix/json'
     
     params = {
-        'origin': origin,
-        'destination': destination,
+        'origins': '|'.join(origins),
+        'destinations': '|'.join(destinations),
         'mode': mode,
         'key': GOOGLE_MAPS_API_KEY,
         'departure_time': 'now' if mode == 'transit' else None
@@ -594,40 +1324,89 @@ def get_directions(origin, destination, mode):
     # Remove None values
     params = {k: v for k, v in params.items() if v is not None}
     
-    try:
-        response = requests.get(base_url, params=params)
-        data = response.json()
-        
-        if data['status'] == 'OK' and data['routes']:
-            route = data['routes'][0]
-            leg = route['legs'][0]
-            
-            duration = leg['duration']['text']
-            distance = leg['distance']['text']
-            
-            # For transit, also get departure and arrival times if available
-            if mode == 'transit' and 'departure_time' in leg:
-                departure_time = datetime.fromtimestamp(leg['departure_time']['value']).strftime('%H:%M')
-                arrival_time = datetime.fromtimestamp(leg['arrival_time']['value']).strftime('%H:%M')
-                
-                return {
-                    'duration': duration,
-                    'distance': distance,
-                    'departure_time': departure_time,
-                    'arrival_time': arrival_time,
+    data = maps_client.get_json('distancematrix', base_url, params, timeout=TRAVEL_MODE_TIMEOUTS[mode])
+    
+    if data['status'] != 'OK':
+        error = {'status': 'error', 'message': f'Distance Matrix error: {data["status"]}'}
+        return [[dict(error) for _ in destinations] for _ in origins]
+    
+    rows = []
+    for row in data['rows']:
+        elements = []
+        for element in row['elements']:
+            if element.get('status') == 'OK':
+                elements.append({
+                    'duration': element['duration']['text'],
+                    'distance': element['distance']['text'],
+                    'duration_seconds': element['duration']['value'],
+                    'distance_meters': element['distance']['value'],
                     'status': 'success'
-                }
+                })
             else:
-                return {
-                    'duration': duration,
-                    'distance': distance,
-                    'status': 'success'
-                }
+                elements.append({
+                    'status': 'error',
+                    'message': f'No routes found for {mode} mode'
+                })
+        rows.append(elements)
+    
+    return rows
+
+DIRECTIONS_URL = 'https://maps.googleapis.com/maps/api/directions/json'
+
+def directions_params(origin, destination, mode):
+    """Query parameters for a Directions API lookup"""
+    params = {
+        'origin': origin,
+        'destination': destination,
+        'mode': mode,
+        'key': GOOGLE_MAPS_API_KEY,
+        'departure_time': 'now' if mode == 'transit' else None
+    }
+    
+    # Remove None values
+    return {k: v for k, v in params.items() if v is not None}
+
+def format_directions(data, mode):
+    """Turn a Directions API response into the duration/distance/status shape the frontend uses"""
+    if data['status'] == 'OK' and data['routes']:
+        route = data['routes'][0]
+        leg = route['legs'][0]
+        
+        duration = leg['duration']['text']
+        distance = leg['distance']['text']
+        
+        # For transit, also get departure and arrival times if available
+        if mode == 'transit' and 'departure_time' in leg:
+            departure_time = datetime.fromtimestamp(leg['departure_time']['value']).strftime('%H:%M')
+            arrival_time = datetime.fromtimestamp(leg['arrival_time']['value']).strftime('%H:%M')
+            
+            return {
+                'duration': duration,
+                'distance': distance,
+                'departure_time': departure_time,
+                'arrival_time': arrival_time,
+                'status': 'success'
+            }
         else:
             return {
-                'status': 'error',
-                'message': f'No routes found for {mode} mode'
+                'duration': duration,
+                'distance': distance,
+                'status': 'success'
             }
+    else:
+        return {
+            'status': 'error',
+            'message': f'No routes found for {mode} mode'
+        }
+
+@coalesced(lambda origin, destination, mode, timeout=None: (
+    'directions', normalize_place_name(origin), normalize_place_name(destination), mode))
+def get_directions(origin, destination, mode, timeout=None):
+    """Get directions from Google Maps Directions API"""
+    try:
+        data = maps_client.get_json('directions', DIRECTIONS_URL, directions_params(origin, destination, mode),
+                                    timeout=timeout, fields=DIRECTIONS_FIELDS)
+        return format_directions(data, mode)
     
     except Exception as e:
         return {
@@ -635,5 +1414,24 @@ def get_directions(origin, destination, mode):
             'message': str(e)
         }
 
+def start_city_index_sweep():
+    """Background sweep that rebuilds index entries as they go stale
+    
+    Started by the server entry points (below, and the ASGI lifespan) rather
+    than on import, so the CLIs and tools that import this module don't sweep
+    too. CITY_INDEX_REFRESH_INTERVAL=0 disables it.
+    """
+    if GOOGLE_MAPS_API_KEY:
+        city_index.start_background_refresh(int(os.getenv('CITY_INDEX_REFRESH_INTERVAL', 6 * 3600)))
+
+# WSGI servers import app:app without running an entry point; CITY_INDEX_SWEEP=1
+# opts such a process in (enable it for one process, not every worker)
+if os.getenv('CITY_INDEX_SWEEP') == '1':
+    start_city_index_sweep()
+
 if __name__ == '__main__':
+    # With debug=True the reloader re-runs this file in a child process that
+    # does the serving; only that one sweeps
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_city_index_sweep()
     app.run(debug=True)
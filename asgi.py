@@ -0,0 +1,396 @@
+"""
+ASGI entry point with an asyncio-native path for the I/O-bound endpoints
+
+    pip install httpx asgiref uvicorn
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+/get_recommendations, /search_city_attractions, /get_route_attractions and
+/get_travel_time run here as coroutines on one event loop, so a single
+process can keep hundreds of upstream Maps requests in flight instead of
+parking a worker thread on each. Parsing, ranking and caching are shared
+with app.py; only the waiting is done differently. Every other route (the
+page, static files, photos, streaming, batch endpoints) is handed to the
+Flask app through asgiref's WSGI adapter.
+"""
+import asyncio
+import json
+
+import app as web
+import deadline
+import rate_limit
+import tracing
+from maps_cache import AsyncSingleFlight, FlightWaitTimeout
+from maps_client import AsyncMapsClient
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+
+async def run_blocking(blocking, fn, *args):
+    """``fn(*args)``, on a worker thread when ``blocking`` says it may wait on disk or the network"""
+    if blocking:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+class AsyncMapsService:
+    """The four I/O-bound endpoints, written against AsyncMapsClient"""
+
+    def __init__(self, client):
+        self.client = client
+        self.single_flight = AsyncSingleFlight()
+
+    async def nearby_search(self, lat, lng, place_type, radius):
+        """Async search_places_by_type: tile cache first, then one nearbysearch"""
+        # With a shared backend the tile cache reads and writes the store; keep that off the event loop
+        shared_tiles = web.places_tiles.backend is not None
+        cached = await run_blocking(shared_tiles, web.places_tiles.get,
+                                    place_type, lat, lng, min(radius, web.PLACES_MAX_RADIUS))
+        if cached is not None:
+            return cached
+        data = await self.client.get_json('places', web.PLACES_NEARBY_URL,
+                                          web.nearby_params(lat, lng, place_type, radius),
+                                          fields=web.PLACES_FIELDS)
+        return await run_blocking(shared_tiles, web.store_nearby_results, lat, lng, place_type, radius, data)
+
+    async def coalesced(self, key, coroutine_fn, *args):
+        """Share one run of a deadline-bound search per key, like app.coalesced"""
+        try:
+            result, skipped = await self.single_flight.do_within(deadline.remaining(), web.flight_key(key),
+                                                                 deadline.capture_async, coroutine_fn, *args)
+        except FlightWaitTimeout:
+            deadline.skip('shared_wait')
+            return await coroutine_fn(*args)
+        deadline.skip_all(skipped)
+        return result
+
+    async def gather_bounded(self, coroutines, limit, timeout):
+        """Run coroutines with at most ``limit`` at once; failures and timeouts come back as exceptions
+
+        Coroutines start in list order; once the request deadline leaves too
+        little time to start one, the rest fail with DeadlineExceeded.
+        """
+        semaphore = asyncio.Semaphore(limit)
+
+        async def run(coroutine):
+            async with semaphore:
+                if not deadline.allows(web.UPSTREAM_CALL_BUDGET):
+                    coroutine.close()
+                    raise deadline.DeadlineExceeded('skipped to meet the request deadline')
+                return await asyncio.wait_for(coroutine, deadline.wait_time(timeout))
+
+        return await asyncio.gather(*(run(c) for c in coroutines), return_exceptions=True)
+
+    async def get_nearby_places(self, lat, lng, radius=500000):
+        try:
+            key = ('nearby', round(float(lat), 5), round(float(lng), 5), radius)
+        except (TypeError, ValueError):
+            # Not coordinates: the search fails on its own and the caller falls back, as in app.coalesced
+            return await self._get_nearby_places(lat, lng, radius)
+        return await self.single_flight.do(key, self._get_nearby_places, lat, lng, radius)
+
+    async def _get_nearby_places(self, lat, lng, radius):
+        try:
+            results = await self.nearby_search(lat, lng, web.NEARBY_PLACE_TYPES, radius)
+            return web.rank_nearby_places(results) if results else None
+        except Exception as e:
+            print(f"Error fetching nearby places: {e}")
+            return None
+
+    async def get_city_attractions(self, city_name):
+        key = ('city', web.normalize_place_name(city_name), False)
+        return await self.coalesced(key, self._get_city_attractions, city_name)
+
+    async def _get_city_attractions(self, city_name):
+        try:
+            place = web.city_resolver.lookup(city_name)
+            if place is None:
+                geocode_data = await self.client.get_json('geocode', web.GEOCODE_URL,
+                                                          {'address': city_name, 'key': web.GOOGLE_MAPS_API_KEY},
+                                                          fields=web.GEOCODE_FIELDS)
+                place = web.city_resolver.remember(city_name, geocode_data)
+                if place is None:
+                    return None
+            lat, lng = place['lat'], place['lng']
+
+            # Paging (with its token waits) and the per-type searches overlap on the loop
+            pages = asyncio.ensure_future(self._tourist_attraction_pages(lat, lng))
+            additional_types = web.affordable_types(web.CITY_ADDITIONAL_TYPES)
+            type_results = await self.gather_bounded(
+                [self.nearby_search(lat, lng, place_type, web.CITY_SEARCH_RADIUS)
+                 for place_type in additional_types],
+                web.PLACES_MAX_WORKERS, web.PLACES_REQUEST_TIMEOUT
+            )
+
+            # Pages first, then types in request order, so dedup matches the sync path
+            attractions = list(await pages)
+            for place_type, results in zip(additional_types, type_results):
+                if isinstance(results, BaseException):
+                    print(f"Places search for {place_type} failed: {results!r}")
+                    if isinstance(results, TimeoutError):
+                        deadline.skip('additional_types')
+                    continue
+                attractions.extend(results)
+
+            return web.rank_city_attractions(attractions, city_name)
+        except Exception as e:
+            print(f"Error fetching city attractions for {city_name}: {e}")
+            return None
+
+    async def _tourist_attraction_pages(self, lat, lng, max_pages=3):
+        params = web.nearby_params(lat, lng, 'tourist_attraction', web.CITY_SEARCH_RADIUS)
+        results = []
+        for page in range(max_pages):
+            try:
+                data = await asyncio.wait_for(
+                    self.client.get_json('places', web.PLACES_NEARBY_URL, params, fields=web.PLACES_FIELDS),
+                    deadline.wait_time(web.PLACES_REQUEST_TIMEOUT)
+                )
+            except Exception as e:
+                print(f"Places page {page + 1} for tourist_attraction failed: {e!r}")
+                if isinstance(e, TimeoutError):
+                    deadline.skip('extra_pages')
+                break
+            if data['status'] != 'OK':
+                break
+            results.extend(data['results'])
+
+            next_page_token = data.get('next_page_token')
+            if not next_page_token:
+                break
+            params = dict(params, pagetoken=next_page_token)
+            # Wait for next page token to become valid; only this coroutine waits
+            delay = 0 if self.client.sync_client.is_cached('places', params, web.PLACES_FIELDS) \
+                else web.NEXT_PAGE_TOKEN_DELAY
+            if not deadline.allows(delay + web.UPSTREAM_CALL_BUDGET):
+                # Not worth the token wait this close to the deadline
+                deadline.skip('extra_pages')
+                break
+            if delay:
+                await asyncio.sleep(delay)
+        return results
+
+    async def get_attractions_along_route(self, origin, destination, distance_km):
+        key = ('route', web.normalize_place_name(origin), web.normalize_place_name(destination), distance_km)
+        return await self.coalesced(key, self._get_attractions_along_route, origin, destination, distance_km)
+
+    async def _get_attractions_along_route(self, origin, destination, distance_km):
+        try:
+            directions_data = await self.client.get_json('directions', web.DIRECTIONS_URL,
+                                                         web.route_directions_params(origin, destination),
+                                                         fields=web.ROUTE_GEOMETRY_FIELDS)
+            plan = web.route_search_points(directions_data, distance_km)
+            if plan is None:
+                return None
+            search_points, search_radius, corridor = plan
+
+            # Started from the middle outwards, like the sync path, then merged in route order
+            order = web.route_search_order(len(search_points))
+            ordered_results = await self.gather_bounded(
+                [self.nearby_search(*search_points[i], 'tourist_attraction', search_radius) for i in order],
+                web.ROUTE_SEARCH_CONCURRENCY, web.PLACES_REQUEST_TIMEOUT
+            )
+            results_by_point = [None] * len(search_points)
+            for i, results in zip(order, ordered_results):
+                results_by_point[i] = results
+
+            seen_place_ids = set()
+            filtered_attractions = []
+            for point, results in zip(search_points, results_by_point):
+                if isinstance(results, BaseException):
+                    print(f"Route search at {point} failed: {results!r}")
+                    if isinstance(results, TimeoutError):
+                        deadline.skip('route_points')
+                    continue
+                filtered_attractions.extend(web.filter_route_places(results, seen_place_ids, corridor))
+
+            return web.rank_route_attractions(filtered_attractions)
+        except Exception as e:
+            print(f"Error fetching route attractions: {e}")
+            return None
+
+    async def get_directions(self, origin, destination, mode):
+        key = ('directions', web.normalize_place_name(origin), web.normalize_place_name(destination), mode)
+        return await self.single_flight.do(key, self._get_directions, origin, destination, mode)
+
+    async def _get_directions(self, origin, destination, mode):
+        try:
+            data = await self.client.get_json('directions', web.DIRECTIONS_URL,
+                                              web.directions_params(origin, destination, mode),
+                                              fields=web.DIRECTIONS_FIELDS)
+            return web.format_directions(data, mode)
+        except Exception as e:
+            return {'status': 'error', 'message': str(e) or repr(e)}
+
+    async def get_directions_for_modes(self, origin, destination, modes):
+        modes = list(dict.fromkeys(modes))
+
+        async def lookup(mode):
+            try:
+                return await asyncio.wait_for(self.get_directions(origin, destination, mode),
+                                              web.TRAVEL_MODE_TIMEOUTS[mode])
+            except asyncio.TimeoutError:
+                return {'status': 'error', 'message': f'Timed out looking up {mode} directions'}
+
+        results = await asyncio.gather(*(lookup(mode) for mode in modes))
+        return dict(zip(modes, results))
+
+
+class Application:
+    """Minimal ASGI router: async handlers for the hot endpoints, Flask for the rest"""
+
+    def __init__(self, flask_app):
+        self.fallback = WsgiToAsgi(flask_app) if WsgiToAsgi is not None else None
+        self.service = None
+        self.routes = {
+            ('POST', '/get_recommendations'): self.get_recommendations,
+            ('POST', '/search_city_attractions'): self.search_city_attractions,
+            ('POST', '/get_route_attractions'): self.get_route_attractions,
+            ('POST', '/get_travel_time'): self.get_travel_time,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        if self.service is None:
+            # Servers that skip the lifespan protocol still get a client
+            self.service = AsyncMapsService(AsyncMapsClient(web.maps_client))
+
+        handler = self.routes.get((scope.get('method'), scope.get('path')))
+        if scope['type'] == 'http' and handler is not None:
+            token = tracing.start_trace(scope['path'])
+            try:
+                try:
+                    data = json.loads(await read_body(receive) or b'null')
+                    # Like a Flask view, a handler may add a dict of extra headers
+                    status, body, *extra = await handler(data if isinstance(data, dict) else {})
+                except Exception as e:
+                    status, body, extra = 500, {'error': str(e)}, []
+                trace = tracing.current_trace()
+                tracing.record_request(trace, scope['method'], status)
+                headers = [(b'server-timing', trace.server_timing().encode())] if web.SERVER_TIMING else []
+                for extra_headers in extra:
+                    headers += [(name.lower().encode(), value.encode()) for name, value in extra_headers.items()]
+                if trace.elapsed() >= web.SLOW_REQUEST_SECONDS:
+                    print(f"Slow request {scope['method']} {scope['path']}: {trace.elapsed():.2f}s, "
+                          f"{trace.upstream_calls()} Maps calls ({trace.describe()})")
+                await send_json(send, status, body, headers)
+            finally:
+                tracing.end_trace(token)
+        elif self.fallback is not None:
+            await self.fallback(scope, receive, send)
+        else:
+            await send_json(send, 404, {'error': 'Not found (install asgiref to serve the full app over ASGI)'})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.service = AsyncMapsService(AsyncMapsClient(web.maps_client))
+                web.start_city_index_sweep()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.service is not None:
+                    await self.service.client.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # Endpoint glue mirrors the Flask views in app.py
+
+    async def get_recommendations(self, data):
+        lat = data.get('lat')
+        lng = data.get('lng')
+        if lat is None or lng is None:
+            return 200, {'recommendations': web.FAMOUS_LOCATIONS[:10], 'source': 'famous'}
+
+        with deadline.budget(web.REQUEST_DEADLINE):
+            nearby_places = await self.service.get_nearby_places(lat, lng)
+        if nearby_places:
+            return 200, {'recommendations': web.serialize_places(nearby_places), 'source': 'nearby'}
+        return 200, {'recommendations': web.FAMOUS_LOCATIONS[:10], 'source': 'famous'}
+
+    async def search_city_attractions(self, data):
+        city_name = data.get('city_name')
+        if not city_name:
+            return 400, {'error': 'City name is required'}
+
+        indexed = web.indexed_attractions(city_name)
+        if indexed:
+            return 200, {'attractions': indexed, 'city': city_name, 'count': len(indexed), 'partial': False}
+
+        with deadline.budget(web.REQUEST_DEADLINE) as budget:
+            attractions = await self.service.get_city_attractions(city_name)
+        if attractions:
+            return 200, {'attractions': web.serialize_places(attractions), 'city': city_name,
+                         'count': len(attractions), 'partial': bool(budget and budget.partial)}
+        if web.ran_out_of_time(budget):
+            return 503, {'error': web.OUT_OF_TIME_MESSAGE, 'attractions': [], 'city': city_name, 'count': 0,
+                         'partial': True}, {'Retry-After': '1'}
+        return 404, {
+            'error': f'No attractions found for "{city_name}". Please check the spelling or try a different city.',
+            'attractions': [],
+            'city': city_name,
+            'count': 0
+        }
+
+    async def get_route_attractions(self, data):
+        origin = data.get('origin')
+        destination = data.get('destination')
+        distance_km = web.route_distance_km(data)
+        if not origin or not destination:
+            return 400, {'error': 'Origin and destination are required'}
+        if distance_km is None:
+            return 400, {'error': web.INVALID_DISTANCE_MESSAGE}
+
+        with deadline.budget(web.REQUEST_DEADLINE) as budget:
+            attractions = await self.service.get_attractions_along_route(origin, destination, distance_km)
+        if attractions:
+            return 200, {'attractions': web.serialize_places(attractions), 'count': len(attractions),
+                         'distance_filter': distance_km, 'partial': bool(budget and budget.partial)}
+        out_of_time = web.ran_out_of_time(budget)
+        message = web.OUT_OF_TIME_MESSAGE if out_of_time else 'No popular attractions found along this route'
+        return 200, {'attractions': [], 'count': 0, 'distance_filter': distance_km, 'partial': out_of_time,
+                     'message': message}
+
+    async def get_travel_time(self, data):
+        origin = data.get('origin')
+        destination = data.get('destination')
+        if not origin or not destination:
+            return 400, {'error': 'Origin and destination are required'}
+
+        modes = web.travel_modes(data)
+        if modes is None:
+            return 400, {'error': web.INVALID_MODES_MESSAGE}
+        invalid_modes = [mode for mode in modes if mode not in web.TRAVEL_MODE_TIMEOUTS]
+        if invalid_modes:
+            return 400, {'error': f'Unsupported travel modes: {", ".join(map(str, invalid_modes))}'}
+
+        with rate_limit.priority(rate_limit.INTERACTIVE):
+            return 200, await self.service.get_directions_for_modes(origin, destination, modes)
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_json(send, status, body, headers=()):
+    payload = json.dumps(body).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode()),
+                    *headers],
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+application = Application(web.app)
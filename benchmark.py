@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Latency benchmark for the main endpoints against the offline fake Maps backend
+
+Each scenario drives one endpoint through Flask's test client at each
+concurrency level and reports latency percentiles, throughput and how many
+upstream Maps calls were made per request. No network access or API key is
+needed:
+
+    python benchmark.py
+    python benchmark.py --scenario city --concurrency 1,16,64 --requests 200
+    python benchmark.py --latency 0.05 --error-rate 0.02 --warm --json results.json
+    MAPS_QPS=20 python benchmark.py --scenario city --quota-qps 20
+
+Caches are cleared before every run unless ``--warm`` is given, so by default
+the numbers describe cold requests; ``--distinct`` controls how many different
+inputs each scenario cycles through (and so how often requests repeat).
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Keep the benchmark self-contained: no live key, no disk caches from a real
+# deployment, no background index sweep competing for the fake backend
+os.environ['GOOGLE_MAPS_API_KEY'] = 'benchmark'
+os.environ.pop('MAPS_CACHE_PATH', None)
+os.environ.pop('SHARED_STATE_URL', None)
+os.environ['CITY_INDEX_CITIES'] = ''
+os.environ['CITY_INDEX_PATH'] = os.path.join(tempfile.gettempdir(), 'benchmark_city_index.json')
+os.environ['CITY_INDEX_REFRESH_INTERVAL'] = '0'
+os.environ['CITY_RESOLVER_PATH'] = ''  # remembered city names stay in memory
+os.environ.setdefault('PHOTO_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'benchmark_photo_cache'))
+
+import app as web  # noqa: E402
+import fake_maps  # noqa: E402
+
+CITIES = ['Paris', 'Rome', 'Vienna', 'Prague', 'Lisbon', 'Berlin', 'Madrid', 'Amsterdam',
+          'Budapest', 'Munich', 'Florence', 'Venice', 'Zurich', 'Krakow', 'Seville', 'Porto']
+LOCATIONS = [(48.8566, 2.3522), (41.9028, 12.4964), (48.2082, 16.3738), (50.0755, 14.4378),
+             (38.7223, -9.1393), (52.52, 13.405), (40.4168, -3.7038), (52.3676, 4.9041)]
+
+
+def recommendations_payloads():
+    for lat, lng in itertools.cycle(LOCATIONS):
+        yield {'lat': lat, 'lng': lng}
+
+
+def city_payloads():
+    for city in itertools.cycle(CITIES):
+        yield {'city_name': city}
+
+
+def route_payloads():
+    for origin, destination in itertools.cycle(zip(CITIES, CITIES[1:] + CITIES[:1])):
+        yield {'origin': origin, 'destination': destination, 'distance_km': 50}
+
+
+def travel_time_payloads():
+    for origin, destination in itertools.cycle(zip(CITIES, CITIES[3:] + CITIES[:3])):
+        yield {'origin': origin, 'destination': destination}
+
+
+# name -> (path, payload generator)
+SCENARIOS = {
+    'recommendations': ('/get_recommendations', recommendations_payloads),
+    'city': ('/search_city_attractions', city_payloads),
+    'route': ('/get_route_attractions', route_payloads),
+    'travel_time': ('/get_travel_time', travel_time_payloads),
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def cache_hits():
+    return sum(counts['hits'] for counts in web.maps_cache.stats()['apis'].values())
+
+
+def reset_state():
+    """Forget everything the app has cached so each run starts cold"""
+    web.maps_cache.clear()
+    web.places_tiles.clear()
+    web.city_resolver.clear()
+
+
+def run_scenario(name, concurrency, total_requests, distinct, fake, warm=False):
+    path, make_payloads = SCENARIOS[name]
+    payloads = list(itertools.islice(make_payloads(), distinct))
+    if not warm:
+        reset_state()
+    fake.reset_counts()
+    hits_before = cache_hits()
+
+    def one_request(i):
+        client = web.app.test_client()
+        started = time.perf_counter()
+        response = client.post(path, json=payloads[i % len(payloads)])
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one_request, range(total_requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    upstream = fake.call_counts()
+    upstream_calls = sum(upstream.values())
+    return {
+        'scenario': name,
+        'path': path,
+        'concurrency': concurrency,
+        'requests': total_requests,
+        'distinct_inputs': len(payloads),
+        'errors': sum(1 for _, status in results if status >= 500),
+        'throughput_rps': round(total_requests / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'max_ms': round(latencies[-1] * 1000, 1),
+        'upstream_calls': upstream_calls,
+        'upstream_per_request': round(upstream_calls / total_requests, 2),
+        'upstream_by_api': upstream,
+        'over_query_limit': sum(fake.throttled_counts().values()),
+        'cache_hits': cache_hits() - hits_before,
+    }
+
+
+def print_table(rows):
+    columns = ['scenario', 'concurrency', 'requests', 'errors', 'throughput_rps',
+               'p50_ms', 'p95_ms', 'p99_ms', 'upstream_per_request', 'cache_hits', 'over_query_limit']
+    headers = ['scenario', 'conc', 'reqs', 'errs', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'upstream/req', 'cache hits',
+               'over quota']
+    table = [headers] + [[str(row[column]) for column in columns] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(headers))]
+    for n, line in enumerate(table):
+        print('  '.join(cell.rjust(width) for cell, width in zip(line, widths)))
+        if n == 0:
+            print('  '.join('-' * width for width in widths))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the app against a fake Maps backend')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run (repeatable; default: all)')
+    parser.add_argument('--concurrency', default='1,8,32', help='comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=64, help='requests per scenario and level')
+    parser.add_argument('--distinct', type=int, default=8, help='distinct inputs cycled through per scenario')
+    parser.add_argument('--warm', action='store_true', help="don't clear caches between runs")
+    parser.add_argument('--latency', type=float, help='fake upstream latency in seconds (default: per-API)')
+    parser.add_argument('--jitter', type=float, default=0.25, help='+/- fraction of latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls answered with HTTP 500')
+    parser.add_argument('--quota-rate', type=float, default=0.0, help='fraction answered OVER_QUERY_LIMIT')
+    parser.add_argument('--quota-qps', type=float,
+                        help='per-API calls per second the fake accepts before answering OVER_QUERY_LIMIT')
+    parser.add_argument('--page-token-delay', type=float, default=web.NEXT_PAGE_TOKEN_DELAY,
+                        help='seconds to wait before using a next_page_token')
+    parser.add_argument('--fixtures', help='recorded fixtures file (see fake_maps.py record)')
+    parser.add_argument('--seed', type=int, default=1, help='seed for injected latency and failures')
+    parser.add_argument('--json', dest='json_path', help='also write results to this file')
+    args = parser.parse_args(argv)
+
+    fake = fake_maps.install(web.maps_client, fixtures_path=args.fixtures, latency=args.latency,
+                             jitter=args.jitter, error_rate=args.error_rate, quota_rate=args.quota_rate,
+                             seed=args.seed, qps=args.quota_qps)
+    web.NEXT_PAGE_TOKEN_DELAY = args.page_token_delay
+    # Keep the client's own retry backoff short so injected failures don't dominate
+    web.maps_client.backoff = min(web.maps_client.backoff, 0.05)
+
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    rows = []
+    for name in args.scenario or list(SCENARIOS):
+        for concurrency in levels:
+            row = run_scenario(name, concurrency, args.requests, args.distinct, fake, warm=args.warm)
+            rows.append(row)
+            print(f"{name} @ {concurrency}: p50 {row['p50_ms']} ms, p95 {row['p95_ms']} ms, "
+                  f"{row['throughput_rps']} req/s, {row['upstream_per_request']} upstream calls/req",
+                  file=sys.stderr)
+
+    print()
+    print_table(rows)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'options': vars(args), 'results': rows}, f, indent=2)
+        print(f"\nWrote {args.json_path}")
+
+
+if __name__ == '__main__':
+    main()
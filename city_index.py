@@ -0,0 +1,187 @@
+"""
+Precomputed top-attraction lists for the most requested cities
+
+Entries are built ahead of time (``python city_index.py``) and by a
+background sweep, and kept in a JSON file so every worker starts warm.
+Lookups never call Google: a fresh entry is served as-is, a stale one is
+served while a rebuild runs in the background (stale-while-revalidate), and
+one past ``max_stale`` is ignored so the caller falls back to a live search.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from city_resolver import normalize_place_name
+
+
+def load_city_list(path):
+    """City names from a text file, one per line; blank lines and # comments are skipped"""
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        lines = (line.split('#', 1)[0].strip() for line in f)
+        return list(dict.fromkeys(line for line in lines if line))
+
+
+class CityIndex:
+    """JSON-file backed index of ranked attractions per city
+
+    ``build(city_name)`` must return a list of JSON-ready attraction dicts, or
+    None when the city can't be resolved right now (the old entry is kept).
+    """
+
+    def __init__(self, path, build, cities=(), fresh_for=24 * 3600, max_stale=7 * 24 * 3600):
+        self.path = path
+        self.build = build
+        self.cities = list(cities)
+        self.fresh_for = fresh_for
+        self.max_stale = max_stale
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_failures': 0}
+        # Rebuilds run one at a time so a cold sweep can't flood the Maps quota
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='city-index')
+        self._sweeper = None
+        self.load()
+
+    def load(self):
+        """Merge entries from the index file, keeping whichever copy is newer"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable city index {self.path}: {e}")
+            return
+        with self._lock:
+            for entry in entries.values():
+                # Keyed afresh so files written under an older key format still match
+                key = normalize_place_name(entry['city'])
+                current = self._entries.get(key)
+                if current is None or entry['built_at'] > current['built_at']:
+                    self._entries[key] = entry
+
+    def save(self):
+        # Other workers may have written since we loaded; don't drop their entries
+        self.load()
+        with self._lock:
+            payload = json.dumps(self._entries, separators=(',', ':'))
+        # Write to a temporary name first so other workers never read a partial file
+        tmp_path = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(tmp_path, self.path)
+
+    def get(self, city_name):
+        """Indexed attractions for a city, or None if it isn't indexed (or is too old)"""
+        key = normalize_place_name(city_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            age = time.time() - entry['built_at'] if entry else None
+            if entry is None or age > self.max_stale:
+                self._counts['misses'] += 1
+                return None
+            if age <= self.fresh_for:
+                self._counts['hits'] += 1
+                return entry['attractions']
+            self._counts['stale_hits'] += 1
+
+        # Stale: answer now, rebuild behind the request
+        self.refresh_async(entry['city'])
+        return entry['attractions']
+
+    def refresh(self, city_name):
+        """Rebuild one city's entry synchronously; returns True if it was stored"""
+        key = normalize_place_name(city_name)
+        try:
+            attractions = self.build(city_name)
+        except Exception as e:
+            attractions = None
+            print(f"City index rebuild for {city_name} failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+        with self._lock:
+            if not attractions:
+                self._counts['refresh_failures'] += 1
+                return False
+            self._entries[key] = {'city': city_name, 'built_at': time.time(), 'attractions': attractions}
+            self._counts['refreshes'] += 1
+        return True
+
+    def refresh_async(self, city_name):
+        """Queue a background rebuild unless one is already pending for this city"""
+        key = normalize_place_name(city_name)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._executor.submit(self._refresh_and_save, city_name)
+
+    def _refresh_and_save(self, city_name):
+        # Another worker may already have rebuilt it
+        self.load()
+        if self.is_fresh(city_name):
+            with self._lock:
+                self._refreshing.discard(normalize_place_name(city_name))
+            return
+        if self.refresh(city_name):
+            self.save()
+
+    def is_fresh(self, city_name):
+        with self._lock:
+            entry = self._entries.get(normalize_place_name(city_name))
+        return entry is not None and time.time() - entry['built_at'] <= self.fresh_for
+
+    def refresh_all(self, force=False):
+        """Rebuild every configured city that is missing or no longer fresh"""
+        self.load()
+        rebuilt = 0
+        for city_name in self.cities:
+            if not force and self.is_fresh(city_name):
+                continue
+            if self.refresh(city_name):
+                rebuilt += 1
+                self.save()
+        return rebuilt
+
+    def start_background_refresh(self, interval):
+        """Sweep the city list every ``interval`` seconds on a daemon thread"""
+        if self._sweeper is not None or not self.cities or interval <= 0:
+            return
+
+        def sweep():
+            while True:
+                try:
+                    self.refresh_all()
+                except Exception as e:
+                    print(f"City index sweep failed: {e}")
+                time.sleep(interval)
+
+        self._sweeper = threading.Thread(target=sweep, name='city-index-sweep', daemon=True)
+        self._sweeper.start()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+            stats['entries'] = len(self._entries)
+            stats['cities'] = len(self.cities)
+        return stats
+
+
+if __name__ == '__main__':
+    # Offline build: python city_index.py [--force]
+    import sys
+
+    import app
+
+    index = app.city_index
+    print(f"Building city index for {len(index.cities)} cities into {index.path}")
+    started = time.time()
+    rebuilt = index.refresh_all(force='--force' in sys.argv[1:])
+    print(f"Rebuilt {rebuilt} entries in {time.time() - started:.1f}s ({index.stats()['entries']} indexed)")
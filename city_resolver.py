@@ -0,0 +1,278 @@
+"""
+Local resolution of free-text city names to coordinates
+
+Every name that has been geocoded once is remembered under a canonical
+place (Google's place_id) together with the spellings that led to it: the
+text the user typed and the formatted address Google returned ("Paris,
+France"). Its first component ("Paris") is not an alias of its own: once
+"Paris, TX, USA" is known, a bare "Paris" still goes to Google unless it was
+typed before, and "Paris, France" resolves locally only while exactly one
+remembered Paris has "France" in its address. Names
+are compared after folding case, accents, punctuation and spacing, so
+"paris", "PARIS " and "Paris, France" all resolve locally and only genuinely
+new places reach the Geocoding API.
+
+The alias keys are kept sorted, which makes the table a prefix index:
+``suggest()`` answers city-name autocomplete with a binary search instead of
+a Places Autocomplete call. Entries are kept in a JSON file shared by the
+workers, like the city index.
+"""
+import bisect
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+
+# Suggestions are drawn from at most this many matching aliases per prefix
+MAX_PREFIX_SCAN = 500
+
+# Punctuation folded to spaces: everything but commas, and the sign and decimal
+# point of a number, so '-33.86,151.2' never collides with '33.86,151.2'
+_PUNCTUATION = re.compile(r'[^\w\s,.-]|(?<!\d)\.|\.(?!\d)|-(?![\d.])')
+
+
+def normalize_place_name(text):
+    """Comparison key for a place name or free-text location: accents, case, punctuation and spacing folded
+
+    Commas are kept as component separators, e.g. 'São Paulo , Brazil' -> 'sao paulo, brazil'.
+    The city index, the resolver and request coalescing all key on this.
+    """
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    parts = (' '.join(_PUNCTUATION.sub(' ', part).split()).casefold() for part in text.split(','))
+    return ', '.join(part for part in parts if part)
+
+
+class CityResolver:
+    """Remembered geocoding results for city names, with prefix search
+
+    ``geocode(text)`` must return a Geocoding API response (a dict with
+    ``status`` and ``results``). ``path`` may be empty to keep entries in
+    memory only.
+    """
+
+    def __init__(self, path, geocode, max_entries=50000, save_delay=5.0):
+        self.path = path
+        self.geocode = geocode
+        self.max_entries = max_entries
+        self.save_delay = save_delay
+        self._entries = {}  # place_id -> entry
+        self._aliases = {}  # normalized typed name or formatted address -> place_id
+        self._short_names = {}  # normalized short name -> place_ids that have it
+        self._keys = []     # sorted alias keys, the prefix index
+        self._save_timer = None
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'misses': 0, 'geocode_failures': 0, 'suggestions': 0}
+        self.load()
+
+    def load(self):
+        """Merge entries and aliases from the file; newer entries and existing aliases win"""
+        if not self.path:
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable city name table {self.path}: {e}")
+            return
+        with self._lock:
+            for place_id, entry in data.get('entries', {}).items():
+                current = self._entries.get(place_id)
+                if current is None or entry['resolved_at'] > current['resolved_at']:
+                    if current is not None:
+                        entry['hits'] = max(entry.get('hits', 0), current['hits'])
+                    self._entries[place_id] = entry
+                    self._add_short_name(entry)
+            for key, place_id in data.get('aliases', {}).items():
+                if place_id in self._entries:
+                    self._add_alias(key, place_id)
+
+    def save(self):
+        if not self.path:
+            return
+        # Other workers may have resolved names since we loaded; keep theirs too
+        self.load()
+        with self._lock:
+            self._save_timer = None
+            payload = json.dumps({'entries': self._entries, 'aliases': self._aliases}, separators=(',', ':'))
+        # Write to a temporary name first so other workers never read a partial file
+        tmp_path = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(tmp_path, self.path)
+
+    def lookup(self, text):
+        """The remembered place for ``text``, or None; never calls Google"""
+        key = normalize_place_name(text)
+        if not key:
+            return None
+        with self._lock:
+            entry = self._match(key)
+            if entry is None:
+                self._counts['misses'] += 1
+                return None
+            entry['hits'] += 1
+            self._counts['hits'] += 1
+            return dict(entry)
+
+    def resolve(self, text):
+        """The place for ``text``, geocoding it only if it hasn't been seen before"""
+        return self.lookup(text) or self.remember(text, self.geocode(text))
+
+    def remember(self, text, geocode_data):
+        """Store a Geocoding API response for ``text``; returns the place, or None if geocoding failed"""
+        if geocode_data.get('status') != 'OK' or not geocode_data.get('results'):
+            print(f"Geocoding failed for {text}: {geocode_data.get('status')}")
+            with self._lock:
+                self._counts['geocode_failures'] += 1
+            return None
+
+        result = geocode_data['results'][0]
+        location = result['geometry']['location']
+        formatted_address = result.get('formatted_address') or str(text).strip()
+        place_id = result.get('place_id') or normalize_place_name(formatted_address)
+        with self._lock:
+            entry = self._entries.get(place_id)
+            if entry is None:
+                if len(self._entries) >= self.max_entries:
+                    self._evict()
+                entry = self._entries[place_id] = {
+                    'place_id': place_id,
+                    'name': formatted_address.split(',')[0].strip(),
+                    'formatted_address': formatted_address,
+                    'lat': location['lat'],
+                    'lng': location['lng'],
+                    'resolved_at': time.time(),
+                    'hits': 0,
+                }
+                self._add_short_name(entry)
+            entry['hits'] += 1
+            # The typed name maps to this place even if another place already uses it
+            self._add_alias(normalize_place_name(text), place_id, replace=True)
+            self._add_alias(normalize_place_name(formatted_address), place_id)
+            self._schedule_save()
+            return dict(entry)
+
+    def suggest(self, prefix, limit=8):
+        """Remembered places whose names start with ``prefix``, most requested first"""
+        key = normalize_place_name(prefix)
+        if not key:
+            return []
+        with self._lock:
+            self._counts['suggestions'] += 1
+            place_ids = {}
+            start = bisect.bisect_left(self._keys, key)
+            for alias in self._keys[start:start + MAX_PREFIX_SCAN]:
+                if not alias.startswith(key):
+                    break
+                place_ids.setdefault(self._aliases[alias], None)
+            entries = sorted((self._entries[place_id] for place_id in place_ids),
+                             key=lambda entry: (-entry['hits'], entry['formatted_address']))
+            return [{field: entry[field] for field in ('place_id', 'name', 'formatted_address', 'lat', 'lng')}
+                    for entry in entries[:limit]]
+
+    def clear(self):
+        """Forget every remembered name (in memory only)"""
+        with self._lock:
+            self._entries.clear()
+            self._aliases.clear()
+            self._short_names.clear()
+            self._keys.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+            stats['entries'] = len(self._entries)
+            stats['aliases'] = len(self._aliases)
+        return stats
+
+    def _match(self, key):
+        """Entry for a normalized name; caller holds the lock"""
+        place_id = self._aliases.get(key)
+        if place_id is not None:
+            return self._entries[place_id]
+
+        # A bare short name is only trusted once it has been typed itself: that
+        # 'Paris, TX' is remembered says nothing about what 'Paris' means
+        head, _, rest = key.partition(', ')
+        if not rest:
+            return None
+
+        # 'paris, france' matches the remembered 'Paris' when the rest of the
+        # name ('france') is part of its formatted address, and of no other
+        # remembered Paris's
+        words = set(rest.replace(',', ' ').split())
+        candidates = set(self._short_names.get(head, ()))
+        if head in self._aliases:
+            candidates.add(self._aliases[head])
+        matches = [place_id for place_id in candidates
+                   if words <= set(normalize_place_name(self._entries[place_id]['formatted_address'])
+                                   .replace(',', ' ').split())]
+        if len(matches) != 1:
+            return None
+        self._add_alias(key, matches[0])
+        return self._entries[matches[0]]
+
+    def _add_alias(self, key, place_id, replace=False):
+        """Caller holds the lock"""
+        if not key:
+            return
+        if key not in self._aliases:
+            bisect.insort(self._keys, key)
+        elif not replace:
+            return
+        self._aliases[key] = place_id
+
+    def _add_short_name(self, entry):
+        """Caller holds the lock"""
+        self._short_names.setdefault(normalize_place_name(entry['name']), set()).add(entry['place_id'])
+
+    def _evict(self):
+        """Drop the least requested entry and its aliases; caller holds the lock"""
+        place_id = min(self._entries, key=lambda place_id: self._entries[place_id]['hits'])
+        entry = self._entries.pop(place_id)
+        name_key = normalize_place_name(entry['name'])
+        self._short_names[name_key].discard(place_id)
+        if not self._short_names[name_key]:
+            del self._short_names[name_key]
+        stale = [key for key, target in self._aliases.items() if target == place_id]
+        for key in stale:
+            del self._aliases[key]
+        self._keys = sorted(self._aliases)
+
+    def _schedule_save(self):
+        """Write new names out shortly, batching bursts into one write; caller holds the lock"""
+        if not self.path or self._save_timer is not None:
+            return
+        self._save_timer = threading.Timer(self.save_delay, self._save_quietly)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def _save_quietly(self):
+        try:
+            self.save()
+        except OSError as e:
+            with self._lock:
+                self._save_timer = None
+            print(f"Could not save city name table {self.path}: {e}")
+
+
+if __name__ == '__main__':
+    # Seed the table with the popular city list: python city_resolver.py
+    import app
+
+    resolver = app.city_resolver
+    cities = app.city_index.cities
+    print(f"Resolving {len(cities)} cities into {resolver.path}")
+    for city_name in cities:
+        try:
+            if resolver.lookup(city_name) is None:
+                resolver.resolve(city_name)
+        except Exception as e:
+            print(f"Could not resolve {city_name}: {e}")
+    resolver.save()
+    print(f"{resolver.stats()['entries']} places, {resolver.stats()['aliases']} names")
@@ -0,0 +1,140 @@
+"""
+Per-request time budgets for upstream fan-out
+
+A request that fans out to many Maps calls (city search pages and types,
+route search points) runs inside ``budget(seconds)``. The deadline lives in a
+context variable, so like the trace and the quota priority it follows the
+request onto pool threads and page timers, and every helper can ask how much
+time is left:
+
+- upstream calls cap their socket timeout at the remaining budget and skip
+  retries that wouldn't fit (``call_timeout``, ``allows``)
+- waits on pools and queues stop at the deadline (``wait_time``)
+- optional work is dropped when the budget runs low, and ``skip()`` records
+  what was left out so the response can be flagged ``partial``
+
+Code running without a budget (background index rebuilds, the CLI) is
+never limited.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+import tracing
+
+_current_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+skipped_work = tracing.metrics.counter(
+    'deadline_skipped_work_total', 'Requests that left out optional upstream work to meet their deadline',
+    ('reason',))
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's budget was spent before an upstream call could start"""
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+        self.skipped = set()
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def partial(self):
+        """Whether any work was left out to meet the deadline"""
+        return bool(self.skipped)
+
+    def skip(self, reason):
+        with self._lock:
+            if reason in self.skipped:
+                return
+            self.skipped.add(reason)
+        skipped_work.inc(reason=reason)
+
+
+@contextmanager
+def budget(seconds):
+    """Run a block with ``seconds`` to spend; a nested budget can only shorten it
+
+    Yields the Deadline (None when ``seconds`` is 0 or None and no outer budget applies).
+    """
+    outer = _current_deadline.get()
+    if not seconds or (outer is not None and outer.remaining() <= seconds):
+        yield outer
+        return
+    deadline = Deadline(seconds)
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def current():
+    return _current_deadline.get()
+
+
+def remaining(default=None):
+    """Seconds left in the current budget, or ``default`` without one"""
+    deadline = _current_deadline.get()
+    return default if deadline is None else deadline.remaining()
+
+
+def allows(seconds):
+    """Whether ``seconds`` of work still fits in the current budget"""
+    deadline = _current_deadline.get()
+    return deadline is None or deadline.remaining() >= seconds
+
+
+def wait_time(limit):
+    """``limit`` seconds of waiting, cut short at the deadline"""
+    deadline = _current_deadline.get()
+    return limit if deadline is None else min(limit, deadline.remaining())
+
+
+def call_timeout(limit):
+    """Timeout for one upstream call; raises DeadlineExceeded once the budget is spent"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return limit
+    left = deadline.remaining()
+    if left <= 0:
+        raise DeadlineExceeded(f'request deadline of {deadline.seconds:g}s reached')
+    return min(limit, left)
+
+
+def skip(reason):
+    """Record that ``reason`` (e.g. 'city_pages') was left out of the current request"""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.skip(reason)
+
+
+def capture(fn, *args, **kwargs):
+    """Run ``fn`` and return (result, reasons skipped while it ran)
+
+    Lets callers that share one computation (see SingleFlight) flag their own
+    responses partial when the shared run was cut short.
+    """
+    deadline = _current_deadline.get()
+    before = set(deadline.skipped) if deadline is not None else set()
+    result = fn(*args, **kwargs)
+    return result, (deadline.skipped - before if deadline is not None else set())
+
+
+async def capture_async(coroutine_fn, *args, **kwargs):
+    """capture() for a coroutine function"""
+    deadline = _current_deadline.get()
+    before = set(deadline.skipped) if deadline is not None else set()
+    result = await coroutine_fn(*args, **kwargs)
+    return result, (deadline.skipped - before if deadline is not None else set())
+
+
+def skip_all(reasons):
+    for reason in reasons:
+        skip(reason)
@@ -0,0 +1,424 @@
+"""
+Offline stand-in for the Google Maps web services used by the app
+
+FakeMapsAdapter is a requests transport adapter: mounted on the shared
+MapsClient session it answers Geocoding, Places (nearbysearch and photo),
+Directions and Distance Matrix calls locally, with configurable latency and
+injected failures, so the real client code (pooling, retries, field
+selection, caching) runs unchanged. Answers come from a fixtures file when
+one has a matching entry, otherwise they are synthesised deterministically
+from the request parameters, so the same query always gets the same answer.
+
+    import app, fake_maps
+    fake = fake_maps.install(app.maps_client, latency=0.1, error_rate=0.02)
+
+RecordingAdapter captures live responses into a fixtures file for later
+replay (see ``python fake_maps.py --help``).
+"""
+import hashlib
+import io
+import json
+import math
+import random
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.response import HTTPResponse
+
+from geo import haversine_m
+
+MAPS_HOST = 'https://maps.googleapis.com/'
+
+# Typical upstream latency per API, in seconds
+DEFAULT_LATENCY = {
+    'geocode': 0.08,
+    'places': 0.15,
+    'directions': 0.2,
+    'distancematrix': 0.15,
+    'photo': 0.1,
+}
+
+RESULTS_PER_PAGE = 20
+PAGES_PER_SEARCH = 3
+
+# Query parameters that never change the answer
+IGNORED_PARAMS = ('key', 'departure_time')
+
+# A 1x1 JPEG is enough for the photo proxy
+PHOTO_BYTES = bytes.fromhex(
+    'ffd8ffe000104a46494600010100000100010000ffdb004300080606070605080707070909080a0c140d0c0b0b0c1912130f'
+    '141d1a1f1e1d1a1c1c20242e2720222c231c1c2837292c30313434341f27393d38323c2e333432ffc0000b080001000101011100'
+    'ffc4001f0000010501010101010100000000000000000102030405060708090a0bffda0008010100003f00d2cf20ffd9'
+)
+
+
+def api_for(url):
+    """Which Maps API a URL belongs to, using the names MapsClient reports stats under"""
+    path = urlsplit(url).path
+    if '/geocode/' in path:
+        return 'geocode'
+    if '/place/photo' in path:
+        return 'photo'
+    if '/place/' in path:
+        return 'places'
+    if '/directions/' in path:
+        return 'directions'
+    if '/distancematrix/' in path:
+        return 'distancematrix'
+    return None
+
+
+def fixture_key(api, params):
+    """Stable key for a request, ignoring the API key and the clock"""
+    items = sorted((k, v) for k, v in params.items() if k not in IGNORED_PARAMS)
+    return f"{api}?{'&'.join(f'{k}={v}' for k, v in items)}"
+
+
+def _seed(*parts):
+    return int(hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()[:12], 16)
+
+
+def _encode_value(value):
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def encode_polyline(points):
+    """Google encoded polyline for a list of (lat, lng) pairs"""
+    encoded = []
+    prev_lat = prev_lng = 0
+    for lat, lng in points:
+        lat, lng = int(round(lat * 1e5)), int(round(lng * 1e5))
+        encoded.append(_encode_value(lat - prev_lat))
+        encoded.append(_encode_value(lng - prev_lng))
+        prev_lat, prev_lng = lat, lng
+    return ''.join(encoded)
+
+
+class SyntheticMaps:
+    """Deterministic, plausible-looking answers for the Maps endpoints the app calls"""
+
+    def geocode(self, params):
+        address = ' '.join(params.get('address', '').split()).casefold()
+        if not address:
+            return {'status': 'INVALID_REQUEST', 'results': []}
+        lat, lng = self.locate(address)
+        return {'status': 'OK', 'results': [{
+            'formatted_address': params['address'],
+            'geometry': {'location': {'lat': lat, 'lng': lng}},
+            'place_id': f'geo-{_seed(address):x}',
+        }]}
+
+    @staticmethod
+    def locate(text):
+        """Coordinates for a free-text place, or the point itself for 'lat,lng'"""
+        try:
+            lat, lng = (float(part) for part in text.split(','))
+            return lat, lng
+        except ValueError:
+            rng = random.Random(_seed('geocode', text))
+            # Synthetic places share one region so routes between them are
+            # hundreds of kilometers, like real road trips
+            return round(rng.uniform(38.0, 55.0), 6), round(rng.uniform(-5.0, 25.0), 6)
+
+    def nearby(self, params):
+        lat, lng = self.locate(params['location'])
+        # Google silently caps nearbysearch at 50km
+        radius = min(float(params.get('radius', 5000)), 50000.0)
+        place_type = params.get('type', 'tourist_attraction')
+        token = params.get('pagetoken')
+        page = int(token.rsplit(':', 1)[1]) if token else 0
+
+        rng = random.Random(_seed('nearby', round(lat, 3), round(lng, 3), place_type, radius, page))
+        results = []
+        # Radius in degrees, to scatter places inside the search circle
+        spread = radius / 111320.0
+        for i in range(RESULTS_PER_PAGE):
+            plat = lat + rng.uniform(-spread, spread) * 0.7
+            plng = lng + rng.uniform(-spread, spread) * 0.7 / max(0.2, math.cos(math.radians(lat)))
+            # Most places are decent; a few are stars with tens of thousands of reviews
+            reviews = int(10 ** rng.uniform(0.5, 4.8))
+            place_id = f'fake-{_seed(place_type, round(plat, 4), round(plng, 4)):x}'
+            results.append({
+                'place_id': place_id,
+                'name': f'{place_type.split("|")[0].replace("_", " ").title()} {page * RESULTS_PER_PAGE + i + 1}',
+                'vicinity': f'{abs(plat):.3f}, {abs(plng):.3f}',
+                'rating': round(min(5.0, max(1.0, rng.gauss(4.2, 0.45))), 1),
+                'user_ratings_total': reviews,
+                'types': [place_type.split('|')[0], 'point_of_interest', 'establishment'],
+                'geometry': {'location': {'lat': round(plat, 7), 'lng': round(plng, 7)}},
+                'photos': [{'photo_reference': f'photo-{place_id}', 'height': 800, 'width': 1200}],
+                'opening_hours': {'open_now': rng.random() < 0.7},
+                'icon': 'https://maps.gstatic.com/mapfiles/place_api/icons/v1/png_71/generic_business-71.png',
+                'reference': place_id,
+                'scope': 'GOOGLE',
+            })
+
+        data = {'status': 'OK', 'html_attributions': [], 'results': results}
+        if page + 1 < PAGES_PER_SEARCH and place_type == 'tourist_attraction':
+            data['next_page_token'] = f'fake-page-token:{page + 1}'
+        return data
+
+    def directions(self, params):
+        origin = self.locate(' '.join(params['origin'].split()).casefold())
+        destination = self.locate(' '.join(params['destination'].split()).casefold())
+        mode = params.get('mode', 'driving')
+        meters = self._distance(origin, destination)
+        seconds = self._duration(meters, mode)
+
+        # A gently curving path with a vertex every few kilometers
+        steps = max(2, min(400, int(meters // 3000)))
+        rng = random.Random(_seed('route', origin, destination))
+        bend = rng.uniform(-0.08, 0.08)
+        points = []
+        for i in range(steps + 1):
+            t = i / steps
+            offset = math.sin(math.pi * t) * bend
+            points.append((origin[0] + (destination[0] - origin[0]) * t - (destination[1] - origin[1]) * offset,
+                           origin[1] + (destination[1] - origin[1]) * t + (destination[0] - origin[0]) * offset))
+
+        leg = {
+            'distance': {'text': f'{meters / 1000:.0f} km', 'value': int(meters)},
+            'duration': {'text': self._duration_text(seconds), 'value': int(seconds)},
+            'start_address': params['origin'],
+            'end_address': params['destination'],
+            'start_location': {'lat': origin[0], 'lng': origin[1]},
+            'end_location': {'lat': destination[0], 'lng': destination[1]},
+            'steps': [{
+                'distance': {'value': int(meters / steps)},
+                'duration': {'value': int(seconds / steps)},
+                'start_location': {'lat': points[i][0], 'lng': points[i][1]},
+                'end_location': {'lat': points[i + 1][0], 'lng': points[i + 1][1]},
+                'travel_mode': mode.upper(),
+                'html_instructions': f'Continue for {meters / steps / 1000:.1f} km',
+            } for i in range(steps)],
+        }
+        if mode == 'transit':
+            now = int(time.time())
+            leg['departure_time'] = {'text': time.strftime('%H:%M', time.localtime(now)), 'value': now}
+            leg['arrival_time'] = {'text': time.strftime('%H:%M', time.localtime(now + seconds)),
+                                   'value': now + int(seconds)}
+        return {'status': 'OK', 'geocoded_waypoints': [], 'routes': [{
+            'summary': 'Fake route',
+            'legs': [leg],
+            'overview_polyline': {'points': encode_polyline(points)},
+            'warnings': [],
+        }]}
+
+    def distance_matrix(self, params):
+        origins = [self.locate(' '.join(o.split()).casefold()) for o in params['origins'].split('|')]
+        destinations = [self.locate(' '.join(d.split()).casefold()) for d in params['destinations'].split('|')]
+        mode = params.get('mode', 'driving')
+        rows = []
+        for origin in origins:
+            elements = []
+            for destination in destinations:
+                meters = self._distance(origin, destination)
+                seconds = self._duration(meters, mode)
+                elements.append({
+                    'status': 'OK',
+                    'distance': {'text': f'{meters / 1000:.0f} km', 'value': int(meters)},
+                    'duration': {'text': self._duration_text(seconds), 'value': int(seconds)},
+                })
+            rows.append({'elements': elements})
+        return {'status': 'OK', 'origin_addresses': params['origins'].split('|'),
+                'destination_addresses': params['destinations'].split('|'), 'rows': rows}
+
+    @staticmethod
+    def _distance(a, b):
+        # Road distance is roughly 1.3x the straight line
+        return max(500.0, haversine_m(a[0], a[1], b[0], b[1]) * 1.3)
+
+    @staticmethod
+    def _duration(meters, mode):
+        speed = {'driving': 22.0, 'walking': 1.4, 'bicycling': 4.5, 'transit': 12.0}.get(mode, 22.0)
+        return meters / speed
+
+    @staticmethod
+    def _duration_text(seconds):
+        hours, minutes = divmod(int(seconds) // 60, 60)
+        return f'{hours} hours {minutes} mins' if hours else f'{minutes} mins'
+
+
+class FakeMapsAdapter(HTTPAdapter):
+    """requests adapter that answers Maps calls offline
+
+    ``latency`` is seconds per call (a number for every API, or a dict per API)
+    with +/- ``jitter`` spread. ``error_rate`` of calls fail with HTTP 500 and
+    ``quota_rate`` answer OVER_QUERY_LIMIT, which exercises the retry path.
+    With ``qps``, calls beyond that many per API in any one second also get
+    OVER_QUERY_LIMIT, like Google's per-second quota.
+    """
+
+    def __init__(self, fixtures=None, latency=None, jitter=0.25, error_rate=0.0, quota_rate=0.0, seed=None,
+                 qps=None):
+        super().__init__()
+        self.fixtures = fixtures or {}
+        if latency is None:
+            latency = DEFAULT_LATENCY
+        self.latency = dict(latency) if isinstance(latency, dict) else dict.fromkeys(DEFAULT_LATENCY, latency)
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quota_rate = quota_rate
+        self.synthetic = SyntheticMaps()
+        self._random = random.Random(seed)
+        self.qps = qps
+        self._recent = {}  # api -> arrival times within the last second
+        self._lock = threading.Lock()
+        self.calls = {}
+        self.throttled = {}
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        api = api_for(request.url)
+        params = dict(parse_qsl(urlsplit(request.url).query, keep_blank_values=True))
+        with self._lock:
+            self.calls[api] = self.calls.get(api, 0) + 1
+            roll = self._random.random()
+            spread = 1 + self._random.uniform(-self.jitter, self.jitter)
+            over_quota = self._over_quota(api)
+
+        delay = self.latency.get(api, 0.1) * spread
+        if isinstance(timeout, (int, float)) and delay > timeout:
+            time.sleep(timeout)
+            raise requests.Timeout(f'Fake {api} call exceeded {timeout}s')
+        time.sleep(delay)
+
+        if roll < self.error_rate:
+            return self._response(request, 500, b'{"error": "injected failure"}')
+        if (over_quota or roll < self.error_rate + self.quota_rate) and api != 'photo':
+            with self._lock:
+                self.throttled[api] = self.throttled.get(api, 0) + 1
+            return self._response(request, 200, b'{"status": "OVER_QUERY_LIMIT", "results": []}')
+        if api == 'photo':
+            return self._response(request, 200, PHOTO_BYTES, 'image/jpeg')
+
+        data = self.fixtures.get(fixture_key(api, params))
+        if data is None:
+            data = self.answer(api, request.url, params)
+        return self._response(request, 200, json.dumps(data).encode())
+
+    def _over_quota(self, api):
+        if not self.qps:
+            return False
+        now = time.monotonic()
+        recent = [t for t in self._recent.get(api, ()) if now - t < 1.0]
+        recent.append(now)
+        self._recent[api] = recent
+        return len(recent) > self.qps
+
+    def answer(self, api, url, params):
+        if api == 'geocode':
+            return self.synthetic.geocode(params)
+        if api == 'places':
+            return self.synthetic.nearby(params)
+        if api == 'directions':
+            return self.synthetic.directions(params)
+        if api == 'distancematrix':
+            return self.synthetic.distance_matrix(params)
+        return {'status': 'INVALID_REQUEST', 'error_message': f'Fake backend does not serve {url}'}
+
+    def _response(self, request, status, body, content_type='application/json; charset=UTF-8'):
+        raw = HTTPResponse(body=io.BytesIO(body), headers={'Content-Type': content_type,
+                                                           'Content-Length': str(len(body))},
+                           status=status, preload_content=False, decode_content=True)
+        return self.build_response(request, raw)
+
+    def call_counts(self):
+        with self._lock:
+            return dict(self.calls)
+
+    def throttled_counts(self):
+        with self._lock:
+            return dict(self.throttled)
+
+    def reset_counts(self):
+        with self._lock:
+            self.calls.clear()
+            self.throttled.clear()
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Pass-through adapter that keeps every live JSON answer as a replay fixture"""
+
+    def __init__(self, pool_maxsize=16):
+        super().__init__(pool_maxsize=pool_maxsize)
+        self.fixtures = {}
+        self._lock = threading.Lock()
+
+    def send(self, request, stream=False, **kwargs):
+        # Buffer the body so it can be both recorded and read by the caller
+        response = super().send(request, stream=False, **kwargs)
+        if stream:
+            # Callers that stream (MapsClient with ijson) read the buffered copy
+            response.raw = io.BytesIO(response.content)
+        api = api_for(request.url)
+        if api not in (None, 'photo') and response.status_code == 200:
+            params = dict(parse_qsl(urlsplit(request.url).query, keep_blank_values=True))
+            try:
+                data = response.json()
+            except ValueError:
+                return response
+            if data.get('status') in ('OK', 'ZERO_RESULTS'):
+                with self._lock:
+                    self.fixtures[fixture_key(api, params)] = data
+        return response
+
+    def save(self, path):
+        with self._lock:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.fixtures, f, indent=1, sort_keys=True)
+        return len(self.fixtures)
+
+
+def load_fixtures(path):
+    if not path:
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def install(maps_client, fixtures_path=None, **options):
+    """Route a MapsClient's traffic to a new FakeMapsAdapter and return the adapter"""
+    adapter = FakeMapsAdapter(fixtures=load_fixtures(fixtures_path), **options)
+    maps_client.session.mount(MAPS_HOST, adapter)
+    return adapter
+
+
+def install_recorder(maps_client):
+    """Route a MapsClient's traffic through a RecordingAdapter and return the adapter"""
+    adapter = RecordingAdapter()
+    maps_client.session.mount(MAPS_HOST, adapter)
+    return adapter
+
+
+if __name__ == '__main__':
+    # Record fixtures from the live API: python fake_maps.py record fixtures.json
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Record live Maps responses for offline replay')
+    parser.add_argument('command', choices=['record'])
+    parser.add_argument('output', help='fixtures file to write')
+    parser.add_argument('--city', action='append', default=[], help='city to search (repeatable)')
+    parser.add_argument('--route', action='append', default=[], help='"origin|destination" (repeatable)')
+    args = parser.parse_args()
+
+    import app
+
+    recorder = install_recorder(app.maps_client)
+    for city in args.city or ['Paris']:
+        print(f"Recording city search for {city}")
+        app.get_city_attractions(city)
+    for route in args.route:
+        origin, destination = route.split('|', 1)
+        print(f"Recording route {origin} -> {destination}")
+        app.get_attractions_along_route(origin, destination, 50)
+        app.get_directions_for_modes(origin, destination, app.DEFAULT_TRAVEL_MODES)
+    print(f"Saved {recorder.save(args.output)} responses to {args.output}")
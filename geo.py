@@ -0,0 +1,320 @@
+"""
+Geometry helpers for routes: polyline decoding, distances and resampling
+
+Coordinates are kept as parallel ``array('d')`` columns (lats, lngs) rather
+than a dict per point, which keeps long cross-country routes compact.
+"""
+import math
+from array import array
+from bisect import bisect_left
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def decode_polyline(encoded):
+    """Decode a Google encoded polyline into (lats, lngs) arrays"""
+    lats = array('d')
+    lngs = array('d')
+    index = 0
+    lat = 0
+    lng = 0
+    length = len(encoded)
+
+    while index < length:
+        # Each point is two zig-zag encoded deltas made of 5-bit chunks
+        for is_lng in (False, True):
+            shift = 0
+            result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            delta = ~(result >> 1) if result & 1 else result >> 1
+            if is_lng:
+                lng += delta
+            else:
+                lat += delta
+        lats.append(lat / 1e5)
+        lngs.append(lng / 1e5)
+
+    return lats, lngs
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in meters"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cumulative_distances(lats, lngs):
+    """Distance along the path (meters) at every vertex, starting at 0"""
+    distances = array('d', [0.0]) if len(lats) else array('d')
+    total = 0.0
+    for i in range(1, len(lats)):
+        total += haversine_m(lats[i - 1], lngs[i - 1], lats[i], lngs[i])
+        distances.append(total)
+    return distances
+
+
+def resample(lats, lngs, spacing_m, start_m=0.0, end_m=None, distances=None):
+    """Evenly spaced points every ``spacing_m`` meters between two path offsets
+
+    Returns (lats, lngs, offsets) arrays. The walk is a single forward pass over
+    the vertices, so it costs O(vertices + samples) however long the route is.
+    """
+    if distances is None:
+        distances = cumulative_distances(lats, lngs)
+    out_lats = array('d')
+    out_lngs = array('d')
+    offsets = array('d')
+    if not len(distances):
+        return out_lats, out_lngs, offsets
+
+    total = distances[-1]
+    end_m = total if end_m is None else min(end_m, total)
+    target = max(0.0, start_m)
+    i = max(1, bisect_left(distances, target))
+
+    while target <= end_m + 1e-6:
+        while i < len(distances) - 1 and distances[i] < target:
+            i += 1
+        if len(distances) == 1:
+            lat, lng = lats[0], lngs[0]
+        else:
+            span = distances[i] - distances[i - 1]
+            ratio = (target - distances[i - 1]) / span if span else 0.0
+            ratio = min(1.0, max(0.0, ratio))
+            lat = lats[i - 1] + (lats[i] - lats[i - 1]) * ratio
+            lng = lngs[i - 1] + (lngs[i] - lngs[i - 1]) * ratio
+        out_lats.append(lat)
+        out_lngs.append(lng)
+        offsets.append(target)
+        if spacing_m <= 0:
+            break
+        target += spacing_m
+
+    return out_lats, out_lngs, offsets
+
+
+
+def plan_search_points(lats, lngs, radius_m, max_points=None):
+    """Pick a small set of sample indices whose ``radius_m`` circles cover the path
+
+    Greedy sweep along the path: from the first uncovered sample, move the
+    centre forward as far as it can go while still covering that sample (and
+    everything between), then skip every sample the new circle already covers.
+    On a path this yields the minimum number of circles for the given samples.
+
+    If more than ``max_points`` circles would be needed, full coverage isn't
+    affordable and the budget is spread evenly along the path instead.
+    """
+    n = len(lats)
+    centers = []
+    uncovered = 0
+
+    while uncovered < n:
+        center = uncovered
+        while center + 1 < n and haversine_m(lats[uncovered], lngs[uncovered],
+                                             lats[center + 1], lngs[center + 1]) <= radius_m:
+            center += 1
+        # A winding path can bend back out of the circle between the two ends
+        while center > uncovered and any(
+                haversine_m(lats[center], lngs[center], lats[i], lngs[i]) > radius_m
+                for i in range(uncovered, center)):
+            center -= 1
+        centers.append(center)
+
+        uncovered = center + 1
+        while uncovered < n and haversine_m(lats[center], lngs[center],
+                                            lats[uncovered], lngs[uncovered]) <= radius_m:
+            uncovered += 1
+
+    if max_points and len(centers) > max_points:
+        step = (n - 1) / max(1, max_points - 1)
+        centers = sorted({int(round(i * step)) for i in range(max_points)})
+
+    return centers
+
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_encode(lat, lng, precision):
+    """Standard base32 geohash of a point"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, longitude first
+        rng, coord = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = 0
+            value = 0
+
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """(height, width) of a geohash cell in degrees"""
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lng_bits)
+
+
+def geohash_neighborhood(lat, lng, precision):
+    """Geohashes of the cell containing a point and its eight neighbours"""
+    height, width = geohash_cell_size(precision)
+    cells = []
+    for dlat in (0, -height, height):
+        for dlng in (0, -width, width):
+            neighbour_lat = max(-90.0, min(90.0, lat + dlat))
+            neighbour_lng = (lng + dlng + 180.0) % 360.0 - 180.0
+            cell = geohash_encode(neighbour_lat, neighbour_lng, precision)
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180.0
+MIN_ROUTE_CELL_M = 1000.0  # smaller cells only add index entries, not precision
+
+
+class RouteIndex:
+    """Grid index over a route's segments for exact distance-to-route queries
+
+    Segments are bucketed into lat/lng cells about ``cell_m`` meters across
+    (at least MIN_ROUTE_CELL_M), so a query within ``cell_m`` of the route only
+    examines the few segments in the cells around the point instead of every
+    segment of a long route. Each segment is filed under the cells it actually
+    crosses, so the index grows with the route's length, not its bounding boxes.
+    """
+
+    def __init__(self, lats, lngs, cell_m, distances=None):
+        self.lats = lats
+        self.lngs = lngs
+        self.distances = cumulative_distances(lats, lngs) if distances is None else distances
+        self.max_m = cell_m
+        self.cell_m = max(MIN_ROUTE_CELL_M, cell_m)
+        # Cells are sized in degrees; use the route's highest latitude so a
+        # cell is at least ``cell_m`` wide everywhere along it
+        max_abs_lat = max((abs(lat) for lat in lats), default=0.0)
+        self.cell_lat = self.cell_m / METERS_PER_DEGREE
+        self.cell_lng = self.cell_m / (METERS_PER_DEGREE * max(0.01, math.cos(math.radians(max_abs_lat))))
+        self._cells = {}
+
+        for i in range(len(lats) - 1):
+            for cell in self._segment_cells(i):
+                self._cells.setdefault(cell, []).append(i)
+
+    def _segment_cells(self, i):
+        """The (row, col) cells segment i passes through, walked from one end to the other"""
+        y0, x0 = self.lats[i] / self.cell_lat, self.lngs[i] / self.cell_lng
+        y1, x1 = self.lats[i + 1] / self.cell_lat, self.lngs[i + 1] / self.cell_lng
+        row, col = math.floor(y0), math.floor(x0)
+        end_row, end_col = math.floor(y1), math.floor(x1)
+        step_row = 1 if y1 > y0 else -1
+        step_col = 1 if x1 > x0 else -1
+        # Fraction of the segment at which it crosses the next row / column line
+        dy, dx = abs(y1 - y0), abs(x1 - x0)
+        t_row = ((row + 1 - y0) if step_row > 0 else (y0 - row)) / dy if dy else math.inf
+        t_col = ((col + 1 - x0) if step_col > 0 else (x0 - col)) / dx if dx else math.inf
+        dt_row = 1 / dy if dy else math.inf
+        dt_col = 1 / dx if dx else math.inf
+
+        cells = [(row, col)]
+        for _ in range(abs(end_row - row) + abs(end_col - col)):
+            if (row, col) == (end_row, end_col):
+                break
+            if t_row < t_col:
+                row += step_row
+                t_row += dt_row
+            elif t_col < t_row:
+                col += step_col
+                t_col += dt_col
+            else:
+                # Straight through a corner: count both cells beside it too
+                cells.append((row + step_row, col))
+                cells.append((row, col + step_col))
+                row += step_row
+                col += step_col
+                t_row += dt_row
+                t_col += dt_col
+            cells.append((row, col))
+        if cells[-1] != (end_row, end_col):
+            cells.append((end_row, end_col))
+        return cells
+
+    def _row(self, lat):
+        return math.floor(lat / self.cell_lat)
+
+    def _col(self, lng):
+        return math.floor(lng / self.cell_lng)
+
+    def nearest(self, lat, lng, max_m=None):
+        """(distance to the route, distance along it) in meters for the closest point of the route
+
+        Returns None when nothing is within ``max_m`` (default: the ``cell_m`` the index was built with).
+        """
+        max_m = self.max_m if max_m is None else max_m
+        if len(self.lats) == 1:
+            distance = haversine_m(lat, lng, self.lats[0], self.lngs[0])
+            return (distance, 0.0) if distance <= max_m else None
+
+        # Every cell the max_m box around the point touches
+        dlat = max_m / METERS_PER_DEGREE
+        dlng = max_m / (METERS_PER_DEGREE * max(0.01, math.cos(math.radians(lat))))
+        segments = set()
+        for row in range(self._row(lat - dlat), self._row(lat + dlat) + 1):
+            for col in range(self._col(lng - dlng), self._col(lng + dlng) + 1):
+                segments.update(self._cells.get((row, col), ()))
+
+        best = None
+        for i in segments:
+            distance, along = self._segment_distance(i, lat, lng)
+            if distance <= max_m and (best is None or distance < best[0]):
+                best = (distance, along)
+        return best
+
+    def nearest_many(self, lats, lngs, max_m=None):
+        """nearest() for a batch of points; one result (or None) per point"""
+        nearest = self.nearest
+        return [nearest(lat, lng, max_m) for lat, lng in zip(lats, lngs)]
+
+    def _segment_distance(self, i, lat, lng):
+        """Distance from a point to segment i, and the distance along the route of the closest point"""
+        lat1, lng1 = self.lats[i], self.lngs[i]
+        lat2, lng2 = self.lats[i + 1], self.lngs[i + 1]
+        # Locally flat (equirectangular) coordinates around the query point are
+        # accurate to well under a percent at corridor scale
+        x_scale = math.cos(math.radians(lat))
+        ax, ay = (lng1 - lng) * x_scale, lat1 - lat
+        bx, by = (lng2 - lng) * x_scale, lat2 - lat
+        dx, dy = bx - ax, by - ay
+        length_sq = dx * dx + dy * dy
+        t = 0.0 if length_sq == 0 else min(1.0, max(0.0, -(ax * dx + ay * dy) / length_sq))
+        foot_lat = lat1 + (lat2 - lat1) * t
+        foot_lng = lng1 + (lng2 - lng1) * t
+        along = self.distances[i] + (self.distances[i + 1] - self.distances[i]) * t
+        return haversine_m(lat, lng, foot_lat, foot_lng), along
@@ -0,0 +1,131 @@
+"""
+Visiting order for a handful of stops, from a travel-time matrix
+
+A small-n heuristic travelling-salesman solver: a nearest-neighbour tour,
+improved by 2-opt (reverse a stretch) and Or-opt (move a run of one to three
+stops elsewhere) until neither finds a shorter route. Costs may be
+asymmetric (one-way streets, transit), so a candidate move is scored by the
+legs it changes (a reversed stretch counts its legs driven backwards) rather
+than by the symmetric 2-opt shortcut or by re-costing the whole route. For
+the at most 25 stops the endpoint accepts this settles in milliseconds and
+is typically within a few percent of optimal.
+"""
+import math
+
+# Stands in for pairs without a route so the heuristics avoid them but still finish
+UNREACHABLE_COST = 1e9
+
+
+def path_cost(order, cost, round_trip=False):
+    """Total cost of visiting ``order``; with ``round_trip`` the return leg counts too"""
+    total = sum(cost[a][b] for a, b in zip(order, order[1:]))
+    if round_trip and len(order) > 1:
+        total += cost[order[-1]][order[0]]
+    return total
+
+
+def nearest_neighbour(cost, start=0):
+    """Greedy tour: always go to the closest stop not yet visited"""
+    remaining = set(range(len(cost))) - {start}
+    order = [start]
+    while remaining:
+        here = order[-1]
+        nearest = min(remaining, key=lambda stop: (cost[here][stop], stop))
+        order.append(nearest)
+        remaining.remove(nearest)
+    return order
+
+
+def _edge(cost, a, b):
+    """Cost of one leg; None stands for the missing leg after the last stop of a one-way route"""
+    return 0.0 if a is None or b is None else cost[a][b]
+
+
+def _after(order, index, round_trip):
+    """The stop visited after ``order[index]``, or None at the end of a one-way route"""
+    if index + 1 < len(order):
+        return order[index + 1]
+    return order[0] if round_trip else None
+
+
+def _leg_sums(order, cost):
+    """Prefix sums of the legs along ``order`` and of the same legs driven backwards"""
+    forward, backward = [0.0], [0.0]
+    for a, b in zip(order, order[1:]):
+        forward.append(forward[-1] + cost[a][b])
+        backward.append(backward[-1] + cost[b][a])
+    return forward, backward
+
+
+def two_opt(order, cost, round_trip=False):
+    """Reverse stretches of the route while that makes it cheaper; the start stays first"""
+    improved = True
+    while improved:
+        improved = False
+        forward, backward = _leg_sums(order, cost)
+        for i in range(1, len(order) - 1):
+            for j in range(i + 1, len(order)):
+                before, after = order[i - 1], _after(order, j, round_trip)
+                # Only the two boundary legs change, plus the stretch now driven backwards
+                delta = (_edge(cost, before, order[j]) + (backward[j] - backward[i]) + _edge(cost, order[i], after)
+                         - _edge(cost, before, order[i]) - (forward[j] - forward[i]) - _edge(cost, order[j], after))
+                if delta < -1e-9:
+                    order = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                    forward, backward = _leg_sums(order, cost)
+                    improved = True
+    return order
+
+
+def or_opt(order, cost, round_trip=False, max_run=3):
+    """Move runs of up to ``max_run`` consecutive stops to a cheaper position; the start stays first"""
+    while True:
+        move = _cheaper_move(order, cost, round_trip, max_run)
+        if move is None:
+            return order
+        order = move
+
+
+def _cheaper_move(order, cost, round_trip, max_run):
+    """The first Or-opt move that shortens ``order``, or None"""
+    for run in range(1, max_run + 1):
+        for i in range(1, len(order) - run + 1):
+            segment = order[i:i + run]
+            rest = order[:i] + order[i + run:]
+            # Taking the run out joins its neighbours directly
+            before, after = order[i - 1], _after(order, i + run - 1, round_trip)
+            saved = (_edge(cost, before, segment[0]) + _edge(cost, segment[-1], after)
+                     - _edge(cost, before, after))
+            # The run may go back in either direction; reversed, its own legs change too
+            reversed_extra = sum(cost[b][a] - cost[a][b] for a, b in zip(segment, segment[1:]))
+            pieces = ((segment, 0.0), (segment[::-1], reversed_extra))
+            for k in range(1, len(rest) + 1):
+                if k == i:
+                    continue
+                p, q = rest[k - 1], _after(rest, k - 1, round_trip)
+                for piece, extra in pieces:
+                    added = _edge(cost, p, piece[0]) + _edge(cost, piece[-1], q) - _edge(cost, p, q)
+                    if added + extra - saved < -1e-9:
+                        return rest[:k] + piece + rest[k:]
+    return None
+
+
+def plan_order(cost, start=0, round_trip=False):
+    """Near-optimal visiting order (a list of indices into ``cost``) beginning at ``start``
+
+    ``cost[i][j]`` is the cost of going from stop i to stop j; None or NaN
+    marks a pair with no route.
+    """
+    n = len(cost)
+    if n <= 2:
+        return [start] + [stop for stop in range(n) if stop != start]
+
+    cost = [[UNREACHABLE_COST if value is None or math.isnan(value) else value for value in row]
+            for row in cost]
+
+    order = nearest_neighbour(cost, start)
+    # Alternate the two move types until neither helps
+    while True:
+        before = path_cost(order, cost, round_trip)
+        order = or_opt(two_opt(order, cost, round_trip), cost, round_trip)
+        if path_cost(order, cost, round_trip) >= before - 1e-9:
+            return order
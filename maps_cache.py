@@ -0,0 +1,560 @@
+"""
+Response caching and request coalescing for outbound Google Maps API calls
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from geo import geohash_encode, geohash_neighborhood, haversine_m
+
+# Default time-to-live per API, in seconds. Geocoding results almost never
+# change, place listings drift slowly and live transit schedules go stale fast.
+DEFAULT_TTLS = {
+    'geocode': 30 * 24 * 3600,
+    'places': 24 * 3600,
+    'directions': 6 * 3600,
+    'distancematrix': 6 * 3600,
+    'realtime': 120,  # anything requested with departure_time=now
+}
+# How long a value read from a shared backend stays in process memory; the
+# backend keeps the real expiry
+BACKEND_PROMOTE_TTL = 60
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with a per-entry expiry time"""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteCache:
+    """On-disk cache backend that survives restarts
+
+    The database runs in WAL mode so several worker processes can share one
+    file: readers never block the writer, and a writer waits up to
+    ``busy_timeout`` seconds for another one instead of failing. Expired rows
+    are deleted on open and then at most every ``purge_interval`` seconds.
+    """
+
+    errors = (sqlite3.Error,)  # what get/set may raise when the file is unavailable
+
+    def __init__(self, path, busy_timeout=5.0, purge_interval=3600):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.purge_interval = purge_interval
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._connection()
+        self.purge_expired()
+
+    def _connection(self):
+        """This process's connection; caller holds the lock (or is __init__)
+
+        SQLite connections must not cross a fork (gunicorn --preload), so a
+        child process opens its own.
+        """
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._create_tables(self._conn)
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def _create_tables(self, conn):
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)'
+        )
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, key):
+        """(value, expiry timestamp) for a fresh entry, or None"""
+        with self._lock:
+            row = self._connection().execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires < time.time():
+            return None
+        return json.loads(value), expires
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                (key, json.dumps(value), now + ttl)
+            )
+            # Without this the file only ever grows
+            if now - self._last_purge >= self.purge_interval:
+                conn.execute('DELETE FROM cache WHERE expires < ?', (now,))
+                self._last_purge = now
+            conn.commit()
+
+    def purge_expired(self):
+        """Delete expired rows; returns how many were removed"""
+        with self._lock:
+            conn = self._connection()
+            self._last_purge = time.time()
+            cursor = conn.execute('DELETE FROM cache WHERE expires < ?', (self._last_purge,))
+            conn.commit()
+            return cursor.rowcount
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute('DELETE FROM cache')
+            conn.commit()
+
+
+def _backend_get(backend, key):
+    """Read from a shared backend, treating an unavailable backend as a miss"""
+    entry = _backend_entry(backend, key)
+    return entry[0] if entry is not None else None
+
+
+def _backend_entry(backend, key):
+    """(value, seconds left) from a backend, or None on a miss or an unavailable backend"""
+    try:
+        entry = backend.get_entry(key)
+    except backend.errors as e:
+        print(f"Cache backend read failed: {e}")
+        return None
+    if entry is None:
+        return None
+    value, expires = entry
+    return value, max(0.0, expires - time.time())
+
+
+def _backend_set(backend, key, value, ttl):
+    try:
+        backend.set(key, value, ttl)
+    except backend.errors as e:
+        print(f"Cache backend write failed: {e}")
+
+
+class TieredCache:
+    """LRUCache in front of an optional shared backend (see shared_state.py)
+
+    Keys are JSON-serializable tuples or strings; ``namespace`` keeps them
+    apart from other users of the same backend.
+    """
+
+    def __init__(self, max_entries=2048, backend=None, namespace=''):
+        self.memory = LRUCache(max_entries)
+        self.backend = backend
+        self.namespace = namespace
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.backend is not None:
+            entry = _backend_entry(self.backend, self.namespace + json.dumps(key))
+            if entry is not None:
+                # Another worker fetched it; remember it here for a short while
+                value, ttl_left = entry
+                self.memory.set(key, value, min(ttl_left, BACKEND_PROMOTE_TTL))
+        return value
+
+    def set(self, key, value, ttl):
+        self.memory.set(key, value, ttl)
+        if self.backend is not None:
+            _backend_set(self.backend, self.namespace + json.dumps(key), value, ttl)
+
+    def clear(self):
+        self.memory.clear()
+
+    def __len__(self):
+        return len(self.memory)
+
+
+class ResponseCache:
+    """Two-level cache (memory LRU in front of an optional persistent backend)
+
+    Entries are keyed on the API name plus the request parameters, minus the
+    API key, so identical lookups share one entry regardless of who asked.
+    Only successful responses should be stored; the caller decides that.
+    """
+
+    def __init__(self, max_entries=2048, backend=None, ttls=None):
+        self.memory = LRUCache(max_entries)
+        self.backend = backend
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    @staticmethod
+    def make_key(api, params):
+        cacheable = {k: v for k, v in params.items() if k != 'key'}
+        return api + '?' + json.dumps(cacheable, sort_keys=True, default=str)
+
+    def ttl_for(self, api, params):
+        if params.get('departure_time') == 'now':
+            return self.ttls['realtime']
+        return self.ttls.get(api, self.ttls['places'])
+
+    def get(self, api, params):
+        """Return the cached response or None; values must be treated as read-only"""
+        key = self.make_key(api, params)
+        value = self.memory.get(key)
+        if value is None and self.backend is not None:
+            entry = _backend_entry(self.backend, key)
+            if entry is not None:
+                # Promote disk hits so the next lookup stays in memory, but only
+                # for the rest of the entry's lifetime
+                value, ttl_left = entry
+                self.memory.set(key, value, min(ttl_left, self.ttl_for(api, params)))
+        self._count(api, 'hits' if value is not None else 'misses')
+        return value
+
+    def contains(self, api, params):
+        """Whether a fresh in-memory entry exists; doesn't touch the counters"""
+        return self.memory.get(self.make_key(api, params)) is not None
+
+    def set(self, api, params, value):
+        key = self.make_key(api, params)
+        ttl = self.ttl_for(api, params)
+        self.memory.set(key, value, ttl)
+        if self.backend is not None:
+            _backend_set(self.backend, key, value, ttl)
+
+    def stats(self):
+        """Hit/miss counters per API"""
+        with self._lock:
+            stats = {api: dict(counts) for api, counts in self._counters.items()}
+        for counts in stats.values():
+            total = counts['hits'] + counts['misses']
+            counts['hit_rate'] = round(counts['hits'] / total, 3) if total else 0.0
+        return {'apis': stats, 'memory_entries': len(self.memory)}
+
+    def clear(self):
+        self.memory.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+    def _count(self, api, outcome):
+        with self._lock:
+            counts = self._counters.setdefault(api, {'hits': 0, 'misses': 0})
+            counts[outcome] += 1
+
+
+class TileCache:
+    """Geospatial store of nearbysearch results, bucketed by geohash and place type
+
+    Each fetched search circle is filed under the geohash cell of its centre.
+    A later query is answered locally when an earlier circle of the same type
+    fully contains it: the stored places are filtered down to the query circle.
+    That only holds for circles whose search returned every place in them, so
+    truncated results (a full page, more pages to come) must not be filed.
+    Cells are large enough (precision 3, ~150 km) that every circle able to
+    contain a query of Google's 50 km maximum radius sits in the query cell or
+    one of its neighbours.
+
+    With a shared ``backend`` each cell's circles are also written there, and
+    a query this process can't answer checks the cells other workers filed.
+    """
+
+    def __init__(self, ttl=24 * 3600, precision=3, max_circles_per_cell=64, backend=None):
+        self.ttl = ttl
+        self.precision = precision
+        self.max_circles_per_cell = max_circles_per_cell
+        self.backend = backend
+        self._cells = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, place_type, lat, lng, radius):
+        """Places of ``place_type`` within ``radius`` meters, or None if not covered"""
+        places = self._lookup(place_type, lat, lng, radius)
+        if places is None and self.backend is not None and self._pull(place_type, lat, lng):
+            places = self._lookup(place_type, lat, lng, radius)
+        with self._lock:
+            if places is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return places
+
+    def _lookup(self, place_type, lat, lng, radius):
+        now = time.time()
+        with self._lock:
+            for cell in geohash_neighborhood(lat, lng, self.precision):
+                for circle in self._cells.get((place_type, cell), ()):
+                    circle_lat, circle_lng, circle_radius, places, expires = circle
+                    if expires < now:
+                        continue
+                    if haversine_m(lat, lng, circle_lat, circle_lng) + radius <= circle_radius:
+                        return [place for place in places
+                                if _place_distance(place, lat, lng) <= radius]
+        return None
+
+    def _pull(self, place_type, lat, lng):
+        """Merge circles other workers filed around (lat, lng); True if any were new"""
+        added = False
+        for cell in geohash_neighborhood(lat, lng, self.precision):
+            shared = _backend_get(self.backend, self._backend_key(place_type, cell))
+            if not shared:
+                continue
+            with self._lock:
+                added = self._merge((place_type, cell), [tuple(circle) for circle in shared]) or added
+        return added
+
+    def _merge(self, key, circles):
+        """Add unexpired circles not yet in the cell; caller holds the lock"""
+        now = time.time()
+        current = [circle for circle in self._cells.get(key, []) if circle[4] >= now]
+        known = {circle[:3] + circle[4:] for circle in current}
+        new = [circle for circle in circles if circle[4] >= now and circle[:3] + circle[4:] not in known]
+        # Keep the newest circles when a busy cell fills up
+        self._cells[key] = sorted(current + new, key=lambda circle: circle[4])[-self.max_circles_per_cell:]
+        return bool(new)
+
+    def put(self, place_type, lat, lng, radius, places):
+        """File the results of one complete, untruncated search circle"""
+        cell = geohash_encode(lat, lng, self.precision)
+        circle = (lat, lng, radius, places, time.time() + self.ttl)
+        with self._lock:
+            self._merge((place_type, cell), [circle])
+        if self.backend is not None:
+            backend_key = self._backend_key(place_type, cell)
+            # Read-modify-write: a circle filed concurrently by another worker may be lost, which only costs a search
+            shared = [tuple(c) for c in _backend_get(self.backend, backend_key) or []]
+            shared = [c for c in shared if c[4] >= time.time()] + [circle]
+            _backend_set(self.backend, backend_key, shared[-self.max_circles_per_cell:], self.ttl)
+
+    @staticmethod
+    def _backend_key(place_type, cell):
+        return f'tiles:{place_type}:{cell}'
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+                'cells': len(self._cells),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+
+
+def _place_distance(place, lat, lng):
+    location = place.get('geometry', {}).get('location', {})
+    if 'lat' not in location or 'lng' not in location:
+        return float('inf')
+    return haversine_m(lat, lng, location['lat'], location['lng'])
+
+
+class PhotoCache:
+    """Size-capped on-disk store for place photo thumbnails
+
+    One file per (photo reference, width) variant. The least recently served
+    files are deleted once the directory grows past ``max_bytes``.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._total_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    @staticmethod
+    def variant_name(photo_reference, width):
+        digest = hashlib.sha1(photo_reference.encode()).hexdigest()
+        return f'{digest}-w{width}'
+
+    def get(self, photo_reference, width):
+        """Path of a cached variant, or None; a hit counts as a use for LRU purposes"""
+        path = os.path.join(self.directory, self.variant_name(photo_reference, width))
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, photo_reference, width, content):
+        """Store a variant and return its path"""
+        path = os.path.join(self.directory, self.variant_name(photo_reference, width))
+        # Write to a temporary name first so readers never see a partial image
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        with self._lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            self._total_bytes += len(content) - previous
+            self._evict()
+        return path
+
+    def _evict(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        entries = sorted((entry for entry in os.scandir(self.directory)
+                          if entry.is_file() and not entry.name.endswith('.tmp')),
+                         key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._total_bytes -= size
+            except FileNotFoundError:
+                pass
+
+
+class FlightWaitTimeout(TimeoutError):
+    """A caller gave up waiting for another caller's run of the same key"""
+
+
+class SingleFlight:
+    """Collapse concurrent calls that share a key into one execution
+
+    The first caller for a key runs the function; callers arriving while it
+    is still running wait for it and get the same result (or exception).
+    Nothing is remembered once the call finishes, so this only removes
+    thundering herds; caching is left to the caches.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.shared = 0
+        self.wait_timeouts = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        return self.do_within(None, key, fn, *args, **kwargs)
+
+    def do_within(self, timeout, key, fn, *args, **kwargs):
+        """do(), but a caller waiting on another's run raises FlightWaitTimeout after ``timeout`` seconds
+
+        ``timeout`` None waits as long as the run takes.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _FlightCall()
+                self.executions += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            if not call.done.wait(timeout):
+                with self._lock:
+                    self.wait_timeouts += 1
+                raise FlightWaitTimeout(f'gave up waiting {timeout:g}s for a shared call')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {'executions': self.executions, 'shared': self.shared, 'wait_timeouts': self.wait_timeouts,
+                    'in_flight': len(self._calls)}
+
+
+class _FlightCall:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines running on one event loop"""
+
+    def __init__(self):
+        self._calls = {}
+        self.executions = 0
+        self.shared = 0
+        self.wait_timeouts = 0
+
+    async def do(self, key, coroutine_fn, *args, **kwargs):
+        return await self.do_within(None, key, coroutine_fn, *args, **kwargs)
+
+    async def do_within(self, timeout, key, coroutine_fn, *args, **kwargs):
+        """SingleFlight.do_within for coroutines"""
+        task = self._calls.get(key)
+        if task is not None:
+            self.shared += 1
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), timeout)
+            except asyncio.TimeoutError:
+                self.wait_timeouts += 1
+                raise FlightWaitTimeout(f'gave up waiting {timeout:g}s for a shared call') from None
+        else:
+            # The shared work runs as its own task, so a caller that times out
+            # or is cancelled (even the first one) leaves it running for the rest
+            task = self._calls[key] = asyncio.get_running_loop().create_task(coroutine_fn(*args, **kwargs))
+            task.add_done_callback(lambda done: self._finished(key, done))
+            self.executions += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved when every caller had gone
+
+    def stats(self):
+        return {'executions': self.executions, 'shared': self.shared, 'wait_timeouts': self.wait_timeouts,
+                'in_flight': len(self._calls)}
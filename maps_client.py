@@ -0,0 +1,417 @@
+"""
+Shared HTTP client for Google Maps web service calls
+"""
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import deadline
+import tracing
+
+# Optional: asyncio HTTP client used by the ASGI serving mode (asgi.py)
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Optional: event-based parsing straight off the socket. Without it responses
+# are parsed whole and then trimmed, which gives the same result.
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Google reports throttling and its own hiccups in the JSON body with HTTP 200,
+# so retries key on the `status` field as well as on HTTP 5xx
+RETRYABLE_STATUSES = ('OVER_QUERY_LIMIT', 'UNKNOWN_ERROR')
+
+# A retry isn't started unless the request deadline leaves at least this long
+# for the call itself after the backoff (see deadline.py)
+MIN_RETRY_BUDGET = 0.5
+
+
+def select_fields(data, shape):
+    """Keep only the parts of a parsed JSON document described by ``shape``
+
+    ``shape`` mirrors the document: ``True`` keeps a value whole, a dict keeps
+    just the listed keys (each with its own sub-shape), and a one-element list
+    applies its sub-shape to every item of an array.
+    """
+    if shape is True:
+        return data
+    if isinstance(shape, dict):
+        if not isinstance(data, dict):
+            return data
+        return {key: select_fields(data[key], sub_shape)
+                for key, sub_shape in shape.items() if key in data}
+    if isinstance(data, list):
+        return [select_fields(item, shape[0]) for item in data]
+    return data
+
+
+def build_selected(events, shape):
+    """Build the parts of a JSON document selected by ``shape`` from parse events
+
+    ``events`` are ijson-style (prefix, event, value) tuples. Anything outside
+    the shape is skipped as it streams past, so unused parts of a large
+    response are never materialised.
+    """
+    stack = []  # [container, shape, key, key_shape] per open map/array
+    skip_depth = 0
+    result = None
+
+    for _, event, value in events:
+        if skip_depth:
+            if event in ('start_map', 'start_array'):
+                skip_depth += 1
+            elif event in ('end_map', 'end_array'):
+                skip_depth -= 1
+            continue
+
+        if event in ('end_map', 'end_array'):
+            container = stack.pop()[0]
+            if not stack:
+                result = container
+            continue
+
+        if event == 'map_key':
+            frame = stack[-1]
+            frame_shape = frame[1]
+            if frame_shape is True:
+                frame[2], frame[3] = value, True
+            elif isinstance(frame_shape, dict) and value in frame_shape:
+                frame[2], frame[3] = value, frame_shape[value]
+            else:
+                frame[2], frame[3] = None, None  # skip this key's value
+            continue
+
+        # Anything else starts a value: find where it goes and its sub-shape
+        if stack:
+            frame = stack[-1]
+            if isinstance(frame[0], dict):
+                if frame[2] is None:
+                    if event in ('start_map', 'start_array'):
+                        skip_depth = 1
+                    continue
+                value_shape = frame[3]
+            else:
+                value_shape = True if frame[1] is True else frame[1][0]
+        else:
+            value_shape = shape
+
+        if event in ('start_map', 'start_array'):
+            new_value = {} if event == 'start_map' else []
+        else:
+            new_value = value
+
+        if stack:
+            frame = stack[-1]
+            if isinstance(frame[0], dict):
+                frame[0][frame[2]] = new_value
+            else:
+                frame[0].append(new_value)
+
+        if event in ('start_map', 'start_array'):
+            if not isinstance(value_shape, dict if event == 'start_map' else list):
+                # A shape that doesn't fit the document keeps the value whole, like select_fields
+                value_shape = True
+            stack.append([new_value, value_shape, None, None])
+        elif not stack:
+            result = new_value
+
+    return result
+
+
+def shape_id(shape):
+    """Short stable identifier for a field selection, used in cache keys"""
+    return hashlib.sha1(json.dumps(shape, sort_keys=True).encode()).hexdigest()[:12]
+
+
+class LatencyStats:
+    """Per-endpoint call counts and latency percentiles over a sliding window"""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._samples = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, api, seconds, outcome):
+        with self._lock:
+            self._samples.setdefault(api, deque(maxlen=self.window)).append(seconds)
+            counts = self._counts.setdefault(api, {'calls': 0, 'errors': 0, 'retries': 0})
+            counts['calls'] += 1
+            if outcome == 'error':
+                counts['errors'] += 1
+
+    def record_retry(self, api):
+        with self._lock:
+            counts = self._counts.setdefault(api, {'calls': 0, 'errors': 0, 'retries': 0})
+            counts['retries'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            samples = {api: sorted(values) for api, values in self._samples.items()}
+            counts = {api: dict(values) for api, values in self._counts.items()}
+        stats = {}
+        for api, values in counts.items():
+            latencies = samples.get(api, [])
+            values.update({
+                'p50_ms': _percentile_ms(latencies, 0.50),
+                'p95_ms': _percentile_ms(latencies, 0.95),
+                'p99_ms': _percentile_ms(latencies, 0.99),
+                'max_ms': _percentile_ms(latencies, 1.0),
+            })
+            stats[api] = values
+        return stats
+
+
+def _error_status(error):
+    """Metric label for a failed call: the HTTP status if there was one, else the exception type"""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return f'HTTP_{response.status_code}'
+    return type(error).__name__
+
+
+def _backoff_delay(backoff, attempt):
+    # Exponential backoff with jitter so retrying workers don't resynchronise
+    return backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+
+
+def _percentile_ms(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return round(sorted_values[index] * 1000, 1)
+
+
+class MapsClient:
+    """Keep-alive session to maps.googleapis.com with timeouts, retries and stats
+
+    One instance is shared by every helper so TCP/TLS connections are reused
+    across requests. Responses pass through the optional cache first, and
+    calls that do go upstream are paced by the optional rate limiter.
+    """
+
+    def __init__(self, cache=None, pool_size=16, timeout=10, max_retries=3, backoff=0.5, limiter=None):
+        self.cache = cache
+        self.limiter = limiter
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.stats = LatencyStats()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get_json(self, api, url, params, timeout=None, fields=None):
+        """GET a Maps endpoint and return its parsed JSON body
+
+        With ``fields`` (see select_fields) only those parts of the body are
+        returned; when ijson is installed they are picked out while the body
+        streams in, so the rest is never built in memory.
+
+        Cacheable answers (OK / ZERO_RESULTS) are stored in the cache. Throttling,
+        transient Google errors, HTTP 5xx and network failures are retried with
+        exponential backoff; after the last attempt the final response (or
+        exception) is returned to the caller as-is.
+        """
+        # Trimmed and full bodies of the same request are different cache entries
+        cache_params = dict(params, _fields=shape_id(fields)) if fields else params
+        if self.cache is not None:
+            data = self.cache.get(api, cache_params)
+            if data is not None:
+                tracing.record_cache_hit(api)
+                return data
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            if self.limiter is not None:
+                self.limiter.acquire(api)
+            started = time.perf_counter()
+            try:
+                data, nbytes = self._fetch(url, params, deadline.call_timeout(timeout or self.timeout), fields,
+                                           last_attempt)
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                self.stats.record(api, time.perf_counter() - started, 'error')
+                tracing.record_upstream(api, _error_status(e), time.perf_counter() - started)
+                if last_attempt or not self._sleep_before_retry(api, attempt):
+                    raise
+                print(f"Maps {api} request failed ({e}), retrying")
+                continue
+
+            status = data.get('status')
+            self.stats.record(api, time.perf_counter() - started, 'error' if status in RETRYABLE_STATUSES else 'ok')
+            tracing.record_upstream(api, status or 'UNKNOWN', time.perf_counter() - started, nbytes)
+            if status == 'OVER_QUERY_LIMIT' and self.limiter is not None:
+                self.limiter.penalize(api)
+            if status in RETRYABLE_STATUSES and not last_attempt and self._sleep_before_retry(api, attempt):
+                continue
+
+            if self.cache is not None and status in ('OK', 'ZERO_RESULTS'):
+                self.cache.set(api, cache_params, data)
+            return data
+
+    def get_content(self, api, url, params, timeout=None):
+        """GET a binary resource (e.g. a place photo) on the shared session
+
+        Returns (content, content_type). Network errors and HTTP 5xx are retried
+        like get_json; any other non-200 answer returns (None, None).
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.limiter is not None:
+                self.limiter.acquire(api)
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params,
+                                            timeout=deadline.call_timeout(timeout or self.timeout))
+                if response.status_code >= 500:
+                    raise requests.HTTPError(f'HTTP {response.status_code}', response=response)
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                self.stats.record(api, time.perf_counter() - started, 'error')
+                tracing.record_upstream(api, _error_status(e), time.perf_counter() - started)
+                if attempt == self.max_retries or not self._sleep_before_retry(api, attempt):
+                    raise
+                print(f"Maps {api} request failed ({e}), retrying")
+                continue
+
+            ok = response.status_code == 200
+            self.stats.record(api, time.perf_counter() - started, 'ok' if ok else 'error')
+            tracing.record_upstream(api, f'HTTP_{response.status_code}', time.perf_counter() - started,
+                                    len(response.content))
+            if not ok:
+                return None, None
+            return response.content, response.headers.get('Content-Type')
+
+    def is_cached(self, api, params, fields=None):
+        """Whether get_json would be answered from memory without a network call"""
+        if self.cache is None:
+            return False
+        return self.cache.contains(api, dict(params, _fields=shape_id(fields)) if fields else params)
+
+    def _fetch(self, url, params, timeout, fields, last_attempt):
+        """One GET; returns (parsed body, response size in bytes)"""
+        streaming = fields is not None and ijson is not None
+        response = self.session.get(url, params=params, timeout=timeout, stream=streaming)
+        try:
+            if response.status_code >= 500 and not last_attempt:
+                raise requests.HTTPError(f'HTTP {response.status_code}', response=response)
+            if streaming:
+                response.raw.decode_content = True
+                data = build_selected(ijson.parse(response.raw, use_float=True), fields)
+                # Declared size if given, else what was read off the wire
+                return data, int(response.headers.get('Content-Length') or response.raw.tell())
+            data = response.json()
+            nbytes = len(response.content)
+            return (select_fields(data, fields) if fields is not None else data), nbytes
+        finally:
+            # Hands a streamed connection back to the pool
+            response.close()
+
+    def _sleep_before_retry(self, api, attempt):
+        """Back off before the next attempt; False, without sleeping, if the request deadline has no room for it"""
+        delay = _backoff_delay(self.backoff, attempt)
+        if not deadline.allows(delay + MIN_RETRY_BUDGET):
+            return False
+        self.stats.record_retry(api)
+        time.sleep(delay)
+        return True
+
+
+class AsyncMapsClient:
+    """asyncio counterpart of MapsClient for the ASGI serving mode
+
+    Shares the synchronous client's cache and latency stats, so both serving
+    modes see the same warm cache and report into one set of counters. One
+    httpx.AsyncClient connection pool carries every in-flight request.
+    """
+
+    def __init__(self, sync_client, max_connections=200):
+        if httpx is None:
+            raise RuntimeError('The async serving mode needs httpx: pip install httpx')
+        self.sync_client = sync_client
+        self.cache = sync_client.cache
+        self.stats = sync_client.stats
+        self.timeout = sync_client.timeout
+        self.max_retries = sync_client.max_retries
+        self.backoff = sync_client.backoff
+        self.limiter = sync_client.limiter
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=self.timeout
+        )
+
+    async def get_json(self, api, url, params, timeout=None, fields=None):
+        """Same contract as MapsClient.get_json, without blocking the event loop"""
+        cache_params = dict(params, _fields=shape_id(fields)) if fields else params
+        # A shared or on-disk cache backend does blocking I/O; that runs on a worker thread
+        shared_cache = self.cache is not None and self.cache.backend is not None
+        if self.cache is not None:
+            if shared_cache and not self.cache.contains(api, cache_params):
+                data = await asyncio.to_thread(self.cache.get, api, cache_params)
+            else:
+                data = self.cache.get(api, cache_params)
+            if data is not None:
+                tracing.record_cache_hit(api)
+                return data
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            if self.limiter is not None:
+                await self.limiter.acquire_async(api)
+            started = time.perf_counter()
+            try:
+                response = await self.http.get(url, params=params,
+                                               timeout=deadline.call_timeout(timeout or self.timeout))
+                if response.status_code >= 500 and not last_attempt:
+                    raise httpx.HTTPStatusError(f'HTTP {response.status_code}', request=response.request,
+                                                response=response)
+                data = response.json()
+                if fields is not None:
+                    data = select_fields(data, fields)
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                self.stats.record(api, time.perf_counter() - started, 'error')
+                tracing.record_upstream(api, _error_status(e), time.perf_counter() - started)
+                if last_attempt or not await self._sleep_before_retry(api, attempt):
+                    raise
+                print(f"Maps {api} request failed ({e!r}), retrying")
+                continue
+
+            status = data.get('status')
+            self.stats.record(api, time.perf_counter() - started, 'error' if status in RETRYABLE_STATUSES else 'ok')
+            tracing.record_upstream(api, status or 'UNKNOWN', time.perf_counter() - started, len(response.content))
+            if status == 'OVER_QUERY_LIMIT' and self.limiter is not None:
+                if self.limiter.store is not None:
+                    await asyncio.to_thread(self.limiter.penalize, api)
+                else:
+                    self.limiter.penalize(api)
+            if status in RETRYABLE_STATUSES and not last_attempt and await self._sleep_before_retry(api, attempt):
+                continue
+
+            if self.cache is not None and status in ('OK', 'ZERO_RESULTS'):
+                if shared_cache:
+                    await asyncio.to_thread(self.cache.set, api, cache_params, data)
+                else:
+                    self.cache.set(api, cache_params, data)
+            return data
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    async def _sleep_before_retry(self, api, attempt):
+        delay = _backoff_delay(self.backoff, attempt)
+        if not deadline.allows(delay + MIN_RETRY_BUDGET):
+            return False
+        self.stats.record_retry(api)
+        await asyncio.sleep(delay)
+        return True
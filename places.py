@@ -0,0 +1,117 @@
+"""
+Compact record for a candidate place, built once while parsing Places results
+"""
+from ranking import passes_filter
+
+
+class Place:
+    """One Places result reduced to the fields the app actually uses
+
+    Slotted so the many short-lived candidates of a city or route search don't
+    each carry a per-instance dict; the raw Places payload is not kept.
+    """
+    __slots__ = ('name', 'location', 'rating', 'user_ratings_total', 'types',
+                 'photo_reference', 'place_id', 'lat', 'lng', 'route_distance', 'route_offset')
+
+    def __init__(self, name, location, rating, user_ratings_total, types,
+                 photo_reference=None, place_id=None, lat=None, lng=None):
+        self.name = name
+        self.location = location
+        self.rating = rating
+        self.user_ratings_total = user_ratings_total
+        self.types = types
+        self.photo_reference = photo_reference
+        self.place_id = place_id
+        self.lat = lat
+        self.lng = lng
+        # Route searches only: meters from the route, and how far along it
+        self.route_distance = None
+        self.route_offset = None
+
+    @classmethod
+    def from_result(cls, result, default_location=None):
+        """Build a Place from one raw Places API result"""
+        photos = result.get('photos')
+        location = result.get('geometry', {}).get('location', {})
+        return cls(
+            name=result['name'],
+            location=result.get('vicinity', default_location),
+            rating=result.get('rating', 0),
+            user_ratings_total=result.get('user_ratings_total', 0),
+            types=result.get('types', []),
+            photo_reference=photos[0].get('photo_reference') if photos else None,
+            place_id=result.get('place_id'),
+            lat=location.get('lat'),
+            lng=location.get('lng'),
+        )
+
+    def to_dict(self):
+        data = {
+            'name': self.name,
+            'location': self.location,
+            'rating': self.rating,
+            'user_ratings_total': self.user_ratings_total,
+            'types': self.types,
+            'photo_reference': self.photo_reference,
+            'place_id': self.place_id,
+            'lat': self.lat,
+            'lng': self.lng,
+        }
+        if self.route_distance is not None:
+            data['distance_from_route_km'] = round(self.route_distance / 1000, 1)
+            data['distance_along_route_km'] = round(self.route_offset / 1000, 1)
+        return data
+
+    def __repr__(self):
+        return f'Place({self.name!r}, rating={self.rating}, reviews={self.user_ratings_total})'
+
+
+def parse_places(results, profile, default_location=None, seen_place_ids=None, require_coords=False):
+    """Turn raw Places results into Place records that pass ``profile``'s filter
+
+    Only the handful of fields needed are read from each result, and only for
+    results that survive deduplication and the rating filter. When
+    ``seen_place_ids`` is given, results whose place_id is missing or already
+    in it are skipped, and new ids are added to it.
+    """
+    places = []
+    for result in results:
+        # Remove duplicates based on place_id
+        if seen_place_ids is not None:
+            place_id = result.get('place_id')
+            if not place_id or place_id in seen_place_ids:
+                continue
+            seen_place_ids.add(place_id)
+
+        if not passes_filter(result.get('rating', 0), result.get('user_ratings_total', 0), profile):
+            continue
+
+        place = Place.from_result(result, default_location)
+
+        # Only include if we have valid coordinates
+        if require_coords and not (place.lat and place.lng):
+            continue
+        places.append(place)
+
+    return places
+
+
+def filter_corridor(places, route_index, max_distance_m=None):
+    """Keep places within ``max_distance_m`` of the route, recording where along it they are
+
+    ``max_distance_m`` defaults to the corridor width the RouteIndex was built for.
+    """
+    kept = []
+    hits = route_index.nearest_many([place.lat for place in places], [place.lng for place in places],
+                                    max_distance_m)
+    for place, hit in zip(places, hits):
+        if hit is None:
+            continue
+        place.route_distance, place.route_offset = hit
+        kept.append(place)
+    return kept
+
+
+def serialize_places(places):
+    """JSON-ready dicts for a list of Place records"""
+    return [place.to_dict() for place in places]
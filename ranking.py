@@ -0,0 +1,101 @@
+"""
+Ranking of candidate places by star rating and review volume
+
+One scoring formula with named weight profiles replaces the per-endpoint
+copies, so nearby, city and route rankings can't drift apart.
+"""
+import heapq
+import math
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class RankingProfile:
+    """Weights, bonuses and quality filters for one kind of search"""
+    name: str
+    rating_weight: float
+    review_weight: float
+    review_log_scale: float         # log10(reviews + 1) / scale, capped at 1.0
+    bonuses: tuple = ()             # (min_rating, min_reviews, bonus); first match wins
+    type_bonuses: tuple = ()        # (place_type, bonus); every match adds up
+    min_rating: float = 4.0
+    min_reviews: int = 5
+    limit: int = 10
+
+
+PROFILES = {
+    # Nearby places: 70% rating, 30% reviews
+    'nearby': RankingProfile(
+        name='nearby', rating_weight=0.7, review_weight=0.3, review_log_scale=4,
+        bonuses=((4.5, 100, 0.1),),
+        min_rating=4.0, min_reviews=5, limit=10,
+    ),
+    # City search: 65% rating, 35% reviews, bigger bonuses for very popular places
+    'city': RankingProfile(
+        name='city', rating_weight=0.65, review_weight=0.35, review_log_scale=4.5,
+        bonuses=((4.5, 500, 0.15), (4.3, 1000, 0.1)),
+        type_bonuses=(('tourist_attraction', 0.05),),
+        min_rating=4.0, min_reviews=10, limit=20,
+    ),
+    # Route attractions: 60% rating, 40% reviews, slightly more lenient filter
+    'route': RankingProfile(
+        name='route', rating_weight=0.6, review_weight=0.4, review_log_scale=4,
+        bonuses=((4.5, 100, 0.1),),
+        min_rating=3.8, min_reviews=10, limit=15,
+    ),
+}
+
+
+def passes_filter(rating, review_count, profile):
+    """Whether a place is good enough to be ranked at all under ``profile``"""
+    return rating >= profile.min_rating and review_count >= profile.min_reviews
+
+
+def score_places(places, profile):
+    """Scores for a batch of places, in the same order
+
+    Everything the formula needs is hoisted out of the loop, so the per-place
+    work is a few arithmetic operations and one log10.
+    """
+    rating_weight = profile.rating_weight
+    review_weight = profile.review_weight
+    log_scale = profile.review_log_scale
+    bonuses = profile.bonuses
+    type_bonuses = profile.type_bonuses
+    log10 = math.log10
+
+    scores = []
+    for place in places:
+        rating = place.rating
+        review_count = place.user_ratings_total
+
+        # Rating normalised 1-5 -> 0-1; reviews on a capped log scale so
+        # places with 10k reviews don't always win
+        score = ((rating - 1) / 4) * rating_weight + min(log10(review_count + 1) / log_scale, 1.0) * review_weight
+
+        # Bonus for very high ratings with substantial reviews
+        for min_rating, min_reviews, bonus in bonuses:
+            if rating >= min_rating and review_count >= min_reviews:
+                score += bonus
+                break
+
+        if type_bonuses:
+            types = place.types or ()
+            for place_type, bonus in type_bonuses:
+                if place_type in types:
+                    score += bonus
+
+        scores.append(score)
+    return scores
+
+
+def top_places(places, profile, k=None):
+    """Best ``k`` places (default: the profile's limit), highest score first
+
+    Uses a partial heap selection instead of sorting every candidate. Ties keep
+    their input order, exactly like a stable ``sorted(..., reverse=True)``.
+    """
+    k = profile.limit if k is None else k
+    scores = score_places(places, profile)
+    best = heapq.nlargest(k, range(len(places)), key=scores.__getitem__)
+    return [places[i] for i in best]
@@ -0,0 +1,218 @@
+"""
+Client-side pacing of outbound Maps calls below Google's per-API QPS quotas
+
+Each API gets a token bucket refilled at its quota rate. Callers take one
+token per upstream call and wait when the bucket is empty, so a burst of
+searches is smoothed out instead of being answered with OVER_QUERY_LIMIT.
+
+Callers carry a priority (set with ``priority()``; it follows the request
+onto pool threads like the trace does). A caller only gets a token when no
+higher-priority caller is waiting for the same API, and background work
+(index rebuilds, prefetch) leaves part of the burst for interactive requests.
+
+With a shared ``store`` (see shared_state.py) the buckets themselves live
+there, so every worker process draws from one quota budget; queue priority
+still applies among the callers within each process. Store calls are made
+without holding the limiter's lock, and off the event loop in the asyncio path.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+import deadline
+import tracing
+
+INTERACTIVE = 0  # a user is waiting on this exact answer (travel times)
+NORMAL = 1       # ordinary page requests
+BACKGROUND = 2   # index rebuilds and prefetch; may wait as long as needed
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', NORMAL: 'normal', BACKGROUND: 'background'}
+
+_current_priority = contextvars.ContextVar('maps_priority', default=NORMAL)
+
+
+@contextmanager
+def priority(level):
+    """Run a block (and the pool tasks it submits) at ``level``"""
+    token = _current_priority.set(level)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority():
+    return _current_priority.get()
+
+
+class QuotaWaitTimeout(TimeoutError):
+    """A call waited longer than ``max_wait`` for its API's quota"""
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimiter:
+    """Per-API token buckets shared by every outbound Maps call in the process
+
+    ``rates`` maps API name to calls per second; APIs without a positive rate
+    aren't limited. ``burst_seconds`` of calls may go out back to back. If the
+    shared ``store`` can't be reached, the process falls back to its own buckets.
+    """
+
+    def __init__(self, rates, burst_seconds=1.0, background_reserve=0.25, max_wait=30.0, store=None):
+        self.background_reserve = background_reserve
+        self.max_wait = max_wait
+        self.store = store
+        self._buckets = {api: TokenBucket(rate, max(1.0, rate * burst_seconds))
+                         for api, rate in rates.items() if rate and rate > 0}
+        self._waiting = {api: dict.fromkeys(PRIORITY_NAMES, 0) for api in self._buckets}
+        self._counts = {api: {'granted': 0, 'delayed': 0, 'timeouts': 0, 'penalties': 0, 'store_errors': 0}
+                        for api in self._buckets}
+        self._lock = threading.Lock()
+
+        self._wait_seconds = tracing.metrics.histogram(
+            'maps_rate_limit_wait_seconds', 'Time outbound Maps calls waited for quota', ('api', 'priority'))
+        self._timeouts = tracing.metrics.counter(
+            'maps_rate_limit_timeouts_total', 'Calls that gave up waiting for quota', ('api',))
+        tracing.metrics.gauge(
+            'maps_rate_limit_waiting', 'Calls currently queued for quota', ('api', 'priority'), self._queue_depths)
+
+    def acquire(self, api, level=None):
+        """Block until a call to ``api`` may go out; returns seconds waited"""
+        level = current_priority() if level is None else level
+        started = time.monotonic()
+        delay = self._take(api, level)
+        if not delay:
+            return 0.0
+        self._enter(api, level)
+        try:
+            while delay:
+                self._check_deadline(api, started, delay)
+                time.sleep(delay)
+                delay = self._take(api, level)
+        finally:
+            self._leave(api, level)
+        return self._record_wait(api, level, started)
+
+    async def acquire_async(self, api, level=None):
+        """asyncio version of acquire; waits without blocking the event loop"""
+        level = current_priority() if level is None else level
+        started = time.monotonic()
+        delay = await self._take_async(api, level)
+        if not delay:
+            return 0.0
+        self._enter(api, level)
+        try:
+            while delay:
+                self._check_deadline(api, started, delay)
+                await asyncio.sleep(delay)
+                delay = await self._take_async(api, level)
+        finally:
+            self._leave(api, level)
+        return self._record_wait(api, level, started)
+
+    def penalize(self, api):
+        """Google said OVER_QUERY_LIMIT anyway: empty the bucket so every caller pauses"""
+        with self._lock:
+            bucket = self._buckets.get(api)
+            if bucket is not None:
+                bucket.refill(time.monotonic())
+                bucket.tokens = min(bucket.tokens, 0.0)
+                self._counts[api]['penalties'] += 1
+        if bucket is not None and self.store is not None:
+            try:
+                self.store.drain(api)
+            except self.store.errors as e:
+                print(f"Shared quota bucket for {api} unavailable: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {api: dict(self._counts[api], qps=bucket.rate, shared=self.store is not None,
+                              tokens=round(bucket.tokens, 2) if self.store is None else None,
+                              waiting={PRIORITY_NAMES[level]: n for level, n in self._waiting[api].items()})
+                    for api, bucket in self._buckets.items()}
+
+    def _enter(self, api, level):
+        """Count a caller whose first attempt has to wait in the queue"""
+        with self._lock:
+            self._waiting[api][level] += 1
+            self._counts[api]['delayed'] += 1
+
+    def _leave(self, api, level):
+        with self._lock:
+            self._waiting[api][level] -= 1
+
+    def _take(self, api, level):
+        """Take a token if ``level`` may have one now, else return seconds to wait before retrying"""
+        bucket = self._buckets.get(api)
+        if bucket is None:
+            return 0.0
+        with self._lock:
+            # Higher-priority callers queued on this API go first
+            waiting = self._waiting[api]
+            if any(waiting[higher] for higher in range(level)):
+                return 1.0 / bucket.rate
+            floor = 1.0
+            if level >= BACKGROUND:
+                floor += bucket.burst * self.background_reserve
+            if self.store is None:
+                return self._take_local(api, bucket, floor)
+
+        # The store may be slow (disk, network); don't hold up the other callers meanwhile
+        try:
+            delay = self.store.take_token(api, bucket.rate, bucket.burst, floor)
+        except self.store.errors:
+            # Keep pacing with this process's own bucket until the store is back
+            with self._lock:
+                self._counts[api]['store_errors'] += 1
+                return self._take_local(api, bucket, floor)
+        if not delay:
+            with self._lock:
+                self._counts[api]['granted'] += 1
+        return delay
+
+    async def _take_async(self, api, level):
+        """_take, with store calls run on a worker thread"""
+        if self.store is None:
+            return self._take(api, level)
+        return await asyncio.to_thread(self._take, api, level)
+
+    def _take_local(self, api, bucket, floor):
+        """Take from this process's own bucket; caller holds the lock"""
+        bucket.refill(time.monotonic())
+        if bucket.tokens >= floor:
+            bucket.tokens -= 1.0
+            self._counts[api]['granted'] += 1
+            return 0.0
+        return (floor - bucket.tokens) / bucket.rate
+
+    def _check_deadline(self, api, started, delay):
+        # Never wait past the request's own deadline either (see deadline.py)
+        waited = time.monotonic() - started
+        if waited + delay > self.max_wait or not deadline.allows(delay):
+            with self._lock:
+                self._counts[api]['timeouts'] += 1
+            self._timeouts.inc(api=api)
+            raise QuotaWaitTimeout(f'Gave up waiting for {api} quota after {waited:.1f}s')
+
+    def _record_wait(self, api, level, started):
+        waited = time.monotonic() - started
+        self._wait_seconds.observe(waited, api=api, priority=PRIORITY_NAMES[level])
+        tracing.record_stage('quota_wait', waited)
+        return waited
+
+    def _queue_depths(self):
+        with self._lock:
+            return {(api, PRIORITY_NAMES[level]): n
+                    for api, levels in self._waiting.items() for level, n in levels.items()}
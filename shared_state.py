@@ -0,0 +1,161 @@
+"""
+State shared by every worker process: cached Maps responses and quota buckets
+
+Under several gunicorn workers each process would otherwise keep its own
+cold copy of the response cache and its own idea of how much Maps quota is
+left, so N workers could send N times the configured QPS. Pointing
+SHARED_STATE_URL at one store gives all of them a single warm cache and a
+single quota budget, and a restart keeps both:
+
+    SHARED_STATE_URL=/var/lib/maps/state.db         # SQLite in WAL mode, one host
+    SHARED_STATE_URL=redis://localhost:6379/0        # Redis or anything that speaks its protocol
+
+Both stores offer the cache backend interface (get, get_entry, set,
+purge_expired, clear) and an atomic token bucket (take_token, drain) used by RateLimiter.
+"""
+import json
+import time
+
+from maps_cache import SqliteCache
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class SqliteStore(SqliteCache):
+    """SqliteCache plus token buckets, for workers on one host"""
+
+    def _create_tables(self, conn):
+        super()._create_tables(conn)
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS buckets (api TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+        )
+
+    def take_token(self, api, rate, burst, floor=1.0):
+        """Take a token from ``api``'s bucket if at least ``floor`` are left; else seconds to wait"""
+        with self._lock:
+            conn = self._connection()
+            # IMMEDIATE takes the write lock up front, so the read-refill-write is atomic across processes
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                row = conn.execute('SELECT tokens, updated FROM buckets WHERE api = ?', (api,)).fetchone()
+                tokens, delay = _take(row, now, rate, burst, floor)
+                conn.execute('INSERT OR REPLACE INTO buckets (api, tokens, updated) VALUES (?, ?, ?)',
+                             (api, tokens, now))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return delay
+
+    def drain(self, api):
+        """Empty ``api``'s bucket for every worker (after an OVER_QUERY_LIMIT)"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute('UPDATE buckets SET tokens = 0, updated = ? WHERE api = ?', (time.time(), api))
+            conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._connection().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        return {'backend': 'sqlite', 'path': self.path, 'entries': entries}
+
+
+class RedisStore:
+    """Cache backend and token buckets on a Redis-compatible server, for workers on any host
+
+    ``client`` is a redis-py style client; any stand-in that supports GET,
+    SET with PX, SCAN, DELETE and WATCH/MULTI transactions will do.
+    """
+
+    def __init__(self, client, prefix='maps:'):
+        self.client = client
+        self.prefix = prefix
+        self.errors = (redis.RedisError,) if redis is not None else (OSError,)
+        # A stand-in client without redis-py installed never raises WatchError
+        self._watch_error = redis.WatchError if redis is not None else ()
+
+    @classmethod
+    def from_url(cls, url, prefix='maps:'):
+        if redis is None:
+            raise RuntimeError('A redis:// SHARED_STATE_URL needs the redis package: pip install redis')
+        return cls(redis.Redis.from_url(url, socket_timeout=2.0), prefix)
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, key):
+        """(value, expiry timestamp), or None"""
+        with self.client.pipeline(transaction=False) as pipe:
+            raw, ttl_ms = pipe.get(self.prefix + 'cache:' + key).pttl(self.prefix + 'cache:' + key).execute()
+        if raw is None:
+            return None
+        return json.loads(raw), time.time() + max(0, ttl_ms) / 1000
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + 'cache:' + key, json.dumps(value), px=max(1, int(ttl * 1000)))
+
+    def purge_expired(self):
+        """Redis expires keys by itself"""
+        return 0
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + 'cache:*', count=500))
+        if keys:
+            self.client.delete(*keys)
+
+    def take_token(self, api, rate, burst, floor=1.0):
+        """Take a token from ``api``'s bucket if at least ``floor`` are left; else seconds to wait"""
+        key = self.prefix + 'bucket:' + api
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    # Optimistic transaction: retried if another worker touched the bucket meanwhile
+                    pipe.watch(key)
+                    state = pipe.hmget(key, 'tokens', 'updated')
+                    row = (float(state[0]), float(state[1])) if state[0] is not None else None
+                    now = time.time()
+                    tokens, delay = _take(row, now, rate, burst, floor)
+                    pipe.multi()
+                    pipe.hset(key, mapping={'tokens': tokens, 'updated': now})
+                    pipe.expire(key, 3600)
+                    pipe.execute()
+                    return delay
+                except self._watch_error:
+                    continue
+
+    def drain(self, api):
+        """Empty ``api``'s bucket for every worker (after an OVER_QUERY_LIMIT)"""
+        key = self.prefix + 'bucket:' + api
+        if self.client.exists(key):
+            self.client.hset(key, mapping={'tokens': 0.0, 'updated': time.time()})
+
+    def stats(self):
+        return {'backend': 'redis', 'prefix': self.prefix}
+
+
+def _take(row, now, rate, burst, floor):
+    """Refill a (tokens, updated) bucket row to ``now`` and try to take one token
+
+    Returns (tokens left, seconds to wait or 0.0). A new bucket starts full.
+    """
+    tokens, updated = row if row is not None else (burst, now)
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= floor:
+        return tokens - 1.0, 0.0
+    return tokens, (floor - tokens) / rate
+
+
+def open_store(url):
+    """The shared store for SHARED_STATE_URL (a SQLite path or a redis:// URL), or None"""
+    if not url:
+        return None
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStore.from_url(url)
+    if url.startswith('sqlite:///'):
+        url = url[len('sqlite:///'):]
+    return SqliteStore(url)
@@ -53,6 +53,7 @@ function initMap() {
     document.getElementById('city-search-input').addEventListener('keypress', function (e) {
         if (e.key === 'Enter') searchCityAttractions();
     });
+    document.getElementById('city-search-input').addEventListener('input', suggestCities);
 
     // Try to get user's current location and load recommendations
     if (navigator.geolocation) {
@@ -369,6 +370,11 @@ function displayRecommendations(recommendations, source) {
     });
 }
 
+// Place photos are served (and cached) by our own /photo route
+function photoUrl(photoReference, maxWidth) {
+    return `/photo/${encodeURIComponent(photoReference)}?maxwidth=${maxWidth}`;
+}
+
 // Create recommendation card
 function createRecommendationCard(place, index) {
     const card = document.createElement('div');
@@ -387,7 +393,7 @@ function createRecommendationCard(place, index) {
 
     card.innerHTML = `
         <div class="recommendation-image ${place.photo_reference ? 'has-photo' : ''}" 
-             ${place.photo_reference ? `style="background-image: url('https://maps.googleapis.com/maps/api/place/photo?maxwidth=400&photo_reference=${place.photo_reference}&key=${GOOGLE_MAPS_API_KEY}')"` : ''}>
+             ${place.photo_reference ? `style="background-image: url('${photoUrl(place.photo_reference, 400)}')"` : ''}>
             ${!place.photo_reference ? `<i class="fas ${imageIcon}"></i>` : ''}
         </div>
         <div class="recommendation-content">
@@ -508,6 +514,30 @@ function showRecommendationError(message) {
     `;
 }
 
+// City name suggestions from names the server has already resolved
+let citySuggestTimer;
+function suggestCities() {
+    clearTimeout(citySuggestTimer);
+    const query = document.getElementById('city-search-input').value.trim();
+    if (query.length < 2) return;
+
+    citySuggestTimer = setTimeout(async () => {
+        try {
+            const response = await fetch(`/autocomplete_city?q=${encodeURIComponent(query)}`);
+            const data = await response.json();
+            const datalist = document.getElementById('city-suggestions');
+            datalist.innerHTML = '';
+            (data.suggestions || []).forEach(suggestion => {
+                const option = document.createElement('option');
+                option.value = suggestion.formatted_address;
+                datalist.appendChild(option);
+            });
+        } catch (error) {
+            console.error('City suggestions failed:', error);
+        }
+    }, 150);
+}
+
 // City search functionality
 async function searchCityAttractions() {
     const cityInput = document.getElementById('city-search-input');
@@ -578,7 +608,7 @@ function createAttractionCard(attraction, index) {
     return `
         <div class="recommendation-card" style="animation-delay: ${index * 0.1}s;">
             <div class="recommendation-image ${attraction.photo_reference ? 'has-photo' : ''}" 
-                 ${attraction.photo_reference ? `style="background-image: url('https://maps.googleapis.com/maps/api/place/photo?maxwidth=400&photo_reference=${attraction.photo_reference}&key=${GOOGLE_MAPS_API_KEY}')"` : ''}>
+                 ${attraction.photo_reference ? `style="background-image: url('${photoUrl(attraction.photo_reference, 400)}')"` : ''}>
                 ${!attraction.photo_reference ? `<i class="fas ${imageIcon}"></i>` : ''}
             </div>
             <div class="recommendation-content">
@@ -677,7 +707,8 @@ async function loadRouteAttractionsOnMap(origin, destination) {
     findBtn.disabled = true;
 
     try {
-        const response = await fetch('/get_route_attractions', {
+        // Stream results so markers appear as each section of the route is searched
+        const response = await fetch('/get_route_attractions/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -689,13 +720,30 @@ async function loadRouteAttractionsOnMap(origin, destination) {
             })
         });
 
-        const data = await response.json();
+        if (!response.ok) {
+            const data = await response.json();
+            showError(data.error || 'No attractions found along this route');
+            return;
+        }
 
-        if (response.ok && data.attractions && data.attractions.length > 0) {
-            displayRouteAttractionsOnMap(data.attractions);
-            showSuccess(`Found ${data.attractions.length} attractions in the middle section of your route`);
+        let finalEvent = null;
+        await readNdjsonStream(response, event => {
+            if (event.event === 'attractions') {
+                displayRouteAttractionsOnMap(event.attractions);
+                findBtn.innerHTML = `<i class="fas fa-spinner fa-spin"></i> Searching route (${event.completed}/${event.total})...`;
+            } else if (event.event === 'done' || event.event === 'error') {
+                finalEvent = event;
+            }
+        });
+
+        if (finalEvent && finalEvent.attractions && finalEvent.attractions.length > 0) {
+            // Replace the provisional markers with the final top ranking
+            clearRouteAttractionMarkers();
+            displayRouteAttractionsOnMap(finalEvent.attractions);
+            showSuccess(`Found ${finalEvent.attractions.length} attractions in the middle section of your route`);
         } else {
-            showError(data.message || 'No attractions found along this route');
+            clearRouteAttractionMarkers();
+            showError((finalEvent && (finalEvent.message || finalEvent.error)) || 'No attractions found along this route');
         }
     } catch (error) {
         showError('Error loading route attractions: ' + error.message);
@@ -706,6 +754,27 @@ async function loadRouteAttractionsOnMap(origin, destination) {
     }
 }
 
+// Read a newline-delimited JSON response, calling onEvent for each line as it arrives
+async function readNdjsonStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.filter(line => line.trim()).forEach(line => onEvent(JSON.parse(line)));
+    }
+
+    if (buffer.trim()) {
+        onEvent(JSON.parse(buffer));
+    }
+}
+
 // Display route attractions on map as markers
 function displayRouteAttractionsOnMap(attractions) {
     attractions.forEach((attraction, index) => {
@@ -738,6 +807,12 @@ function addAttractionMarker(attraction, index) {
     const stars = generateStars(attraction.rating);
     const reviewCount = formatReviewCount(attraction.user_ratings_total);
 
+    // How far off the road the place is, and how far into the trip
+    const routeOffsetHtml = attraction.distance_from_route_km !== undefined ? `
+            <div class="info-location">
+                <i class="fas fa-road"></i> ${attraction.distance_from_route_km} km off route, ${attraction.distance_along_route_km} km into the trip
+            </div>` : '';
+
     const infoContent = `
         <div class="map-info-window">
             <div class="info-header">
@@ -750,6 +825,7 @@ function addAttractionMarker(attraction, index) {
             <div class="info-location">
                 <i class="fas fa-map-marker-alt"></i> ${attraction.location}
             </div>
+            ${routeOffsetHtml}
             <div class="info-actions">
                 <button onclick="calculateTravelToPlace('${attraction.location.replace(/'/g, "\\'")}'); google.maps.event.trigger(map, 'click');" class="info-directions-btn">
                     <i class="fas fa-route"></i> Get Directions
@@ -891,8 +967,8 @@ function createHoverContent(attraction) {
 
     // Create image element if photo reference exists
     let imageHtml = '';
-    if (attraction.photo_reference && GOOGLE_MAPS_API_KEY) {
-        const imageUrl = `https://maps.googleapis.com/maps/api/place/photo?maxwidth=200&photo_reference=${attraction.photo_reference}&key=${GOOGLE_MAPS_API_KEY}`;
+    if (attraction.photo_reference) {
+        const imageUrl = photoUrl(attraction.photo_reference, 200);
         imageHtml = `
             <div class="hover-image">
                 <img src="${imageUrl}" alt="${attraction.name}" loading="lazy">
@@ -0,0 +1,48 @@
+"""
+Shared setup for the test suite
+
+app.py reads its configuration at import time, so the environment is pinned
+here first: no live key, no disk caches or state files from a real
+deployment, no quota pacing, and the fake Maps backend from fake_maps.py in
+place of Google.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_state_dir = tempfile.mkdtemp(prefix='maps-tests-')
+os.environ['GOOGLE_MAPS_API_KEY'] = 'test'
+os.environ.pop('MAPS_CACHE_PATH', None)
+os.environ.pop('SHARED_STATE_URL', None)
+os.environ['CITY_INDEX_CITIES'] = ''
+os.environ['CITY_INDEX_PATH'] = os.path.join(_state_dir, 'city_index.json')
+os.environ['CITY_INDEX_REFRESH_INTERVAL'] = '0'
+os.environ['CITY_RESOLVER_PATH'] = ''
+os.environ['PHOTO_CACHE_DIR'] = os.path.join(_state_dir, 'photos')
+os.environ['MAPS_QPS'] = '0'
+
+
+@pytest.fixture(scope='session')
+def web():
+    """The app module, talking to the fake Maps backend"""
+    import app
+    import fake_maps
+
+    app.fake = fake_maps.install(app.maps_client, latency=0.001, jitter=0.0, seed=1)
+    app.NEXT_PAGE_TOKEN_DELAY = 0.01
+    return app
+
+
+@pytest.fixture
+def client(web):
+    """A Flask test client that starts from cold caches"""
+    web.maps_cache.clear()
+    web.places_tiles.clear()
+    web.city_resolver.clear()
+    web.fake.reset_counts()
+    return web.app.test_client()
@@ -0,0 +1,45 @@
+import threading
+
+import deadline
+from city_index import CityIndex
+
+
+def test_failed_rebuild_keeps_the_old_entry(tmp_path):
+    answers = iter([[{'name': 'Louvre'}], None])
+    index = CityIndex(str(tmp_path / 'index.json'), build=lambda city: next(answers))
+
+    assert index.refresh('Paris') and index.get('paris') == [{'name': 'Louvre'}]
+    assert not index.refresh('Paris')
+    assert index.get('Paris') == [{'name': 'Louvre'}]
+
+
+def test_partial_search_is_not_indexed(client, web):
+    # Too little budget for the extra pages and types: the ranking is partial
+    with deadline.budget(0.5):
+        assert web.build_city_index_entry('Oslo') is None
+    assert len(web.build_city_index_entry('Oslo')) == 20
+
+
+def test_background_caller_does_not_join_a_deadline_bound_run(web):
+    started, release = threading.Event(), threading.Event()
+    deadlines = []
+
+    @web.coalesced(lambda city_name: ('test', city_name))
+    def search(city_name):
+        deadlines.append(deadline.current())
+        started.set()
+        release.wait(2)
+        return city_name
+
+    def request():
+        with deadline.budget(5):
+            search('Oslo')
+
+    user = threading.Thread(target=request)
+    user.start()
+    started.wait(2)
+    threading.Timer(0.1, release.set).start()
+
+    assert search('Oslo') == 'Oslo'
+    user.join()
+    assert len(deadlines) == 2 and deadlines[1] is None
@@ -0,0 +1,54 @@
+from city_resolver import CityResolver, normalize_place_name
+
+PLACES = {
+    'Paris': ('paris-fr', 'Paris, France', 48.857, 2.352),
+    'Paris, TX': ('paris-tx', 'Paris, TX, USA', 33.661, -95.556),
+    'Lyon': ('lyon', 'Lyon, France', 45.764, 4.836),
+}
+
+
+def make_resolver():
+    calls = []
+
+    def geocode(text):
+        calls.append(text)
+        place_id, address, lat, lng = PLACES[text]
+        return {'status': 'OK', 'results': [{'place_id': place_id, 'formatted_address': address,
+                                             'geometry': {'location': {'lat': lat, 'lng': lng}}}]}
+
+    return CityResolver('', geocode), calls
+
+
+def test_normalize_place_name_folds_spelling_but_keeps_coordinates_apart():
+    assert normalize_place_name('  São  Paulo , Brazil ') == 'sao paulo, brazil'
+    assert normalize_place_name('Saint-Étienne') == 'saint etienne'
+    assert normalize_place_name('-33.86,151.2') != normalize_place_name('33.86,151.2')
+
+
+def test_spellings_of_a_resolved_name_stay_local():
+    resolver, calls = make_resolver()
+    resolver.resolve('Lyon')
+    for spelling in ('lyon', ' LYON ', 'Lyon, France', 'lyon,  france'):
+        assert resolver.resolve(spelling)['place_id'] == 'lyon'
+    assert calls == ['Lyon']
+
+
+def test_a_qualified_place_does_not_claim_its_short_name():
+    resolver, calls = make_resolver()
+    assert resolver.resolve('Paris, TX')['place_id'] == 'paris-tx'
+    assert resolver.lookup('Paris') is None
+    assert resolver.resolve('Paris')['place_id'] == 'paris-fr'
+    assert calls == ['Paris, TX', 'Paris']
+
+    # Each typed name keeps its own answer, and qualifiers pick between them
+    assert resolver.lookup('paris')['place_id'] == 'paris-fr'
+    assert resolver.lookup('Paris, TX, USA')['place_id'] == 'paris-tx'
+    assert resolver.lookup('Paris, France')['place_id'] == 'paris-fr'
+
+
+def test_suggest_finds_remembered_places_by_prefix():
+    resolver, _ = make_resolver()
+    for name in ('Paris', 'Paris, TX', 'Lyon'):
+        resolver.resolve(name)
+    assert {place['place_id'] for place in resolver.suggest('par')} == {'paris-fr', 'paris-tx'}
+    assert resolver.suggest('zzz') == []
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import pytest
+
+import deadline
+
+
+def test_no_budget_means_no_limits():
+    assert deadline.current() is None
+    assert deadline.remaining() is None
+    assert deadline.remaining(5) == 5
+    assert deadline.allows(1e9)
+    assert deadline.wait_time(3) == 3
+    assert deadline.call_timeout(10) == 10
+    deadline.skip('route_points')  # nowhere to record it; must not fail
+
+
+def test_budget_caps_waits_and_call_timeouts():
+    with deadline.budget(0.5) as budget:
+        assert deadline.current() is budget
+        assert 0.4 < deadline.remaining() <= 0.5
+        assert deadline.wait_time(10) <= 0.5
+        assert deadline.call_timeout(10) <= 0.5
+        assert deadline.call_timeout(0.1) == 0.1
+        assert not deadline.allows(1.0)
+    assert deadline.current() is None
+
+
+def test_spent_budget_refuses_new_calls():
+    with deadline.budget(0.01):
+        time.sleep(0.02)
+        assert deadline.remaining() == 0.0
+        with pytest.raises(deadline.DeadlineExceeded):
+            deadline.call_timeout(10)
+
+
+def test_nested_budget_can_only_shorten():
+    with deadline.budget(5) as outer:
+        with deadline.budget(10) as inner:
+            assert inner is outer
+        with deadline.budget(1) as inner:
+            assert inner is not outer and deadline.remaining() <= 1
+        assert deadline.current() is outer
+
+
+@pytest.mark.parametrize('seconds', [0, None])
+def test_zero_budget_is_unlimited(seconds):
+    with deadline.budget(seconds) as budget:
+        assert budget is None and deadline.remaining() is None
+
+
+def test_skipped_work_marks_the_request_partial():
+    with deadline.budget(5) as budget:
+        assert not budget.partial
+        deadline.skip('extra_pages')
+        deadline.skip('extra_pages')
+        assert budget.partial and budget.skipped == {'extra_pages'}
+
+
+def test_capture_reports_what_a_shared_run_skipped():
+    def search():
+        deadline.skip('additional_types')
+        return 'ranked'
+
+    with deadline.budget(5) as budget:
+        deadline.skip('extra_pages')
+        result, skipped = deadline.capture(search)
+    assert result == 'ranked' and skipped == {'additional_types'}
+
+    with deadline.budget(5) as other:
+        deadline.skip_all(skipped)
+    assert other.skipped == {'additional_types'} and budget.skipped == {'extra_pages', 'additional_types'}
+
+
+def test_capture_async():
+    async def search():
+        deadline.skip('route_points')
+        return 'ranked'
+
+    async def main():
+        with deadline.budget(5):
+            return await deadline.capture_async(search)
+
+    assert asyncio.run(main()) == ('ranked', {'route_points'})
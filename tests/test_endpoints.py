@@ -0,0 +1,106 @@
+"""
+Recommendations, city and route searches end to end, against the fake Maps backend (see conftest.py)
+"""
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize('lat', ['north', [48.85], {'lat': 48.85}])
+def test_recommendations_fall_back_to_famous_places_for_bad_coordinates(client, lat):
+    response = client.post('/get_recommendations', json={'lat': lat, 'lng': 2.35})
+
+    assert response.status_code == 200
+    assert response.get_json()['source'] == 'famous'
+
+
+def test_city_search_returns_ranked_attractions(client, web):
+    response = client.post('/search_city_attractions', json={'city_name': 'Paris'})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['city'] == 'Paris' and body['partial'] is False
+    assert 0 < body['count'] == len(body['attractions']) <= 20
+    ratings = [attraction['rating'] for attraction in body['attractions']]
+    assert all(rating >= 4.0 for rating in ratings)
+    assert len({attraction['place_id'] for attraction in body['attractions']}) == body['count']
+    assert web.fake.call_counts()['geocode'] == 1
+
+
+def test_repeated_city_search_is_served_from_cache(client, web):
+    first = client.post('/search_city_attractions', json={'city_name': 'Vienna'}).get_json()
+    calls = sum(web.fake.call_counts().values())
+
+    second = client.post('/search_city_attractions', json={'city_name': '  vienna '}).get_json()
+    assert second['attractions'] == first['attractions']
+    assert sum(web.fake.call_counts().values()) == calls
+
+
+def test_city_search_requires_a_name(client):
+    assert client.post('/search_city_attractions', json={}).status_code == 400
+
+
+def test_city_search_out_of_time_is_not_a_missing_city(client, web, monkeypatch):
+    monkeypatch.setattr(web, 'REQUEST_DEADLINE', 0.001)
+    response = client.post('/search_city_attractions', json={'city_name': 'Lisbon'})
+
+    assert response.status_code == 503
+    assert response.get_json()['partial'] is True
+
+
+def test_route_search_returns_attractions_near_the_route(client, web):
+    payload = {'origin': 'Paris', 'destination': 'Lyon', 'distance_km': 20}
+    response = client.post('/get_route_attractions', json=payload)
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['distance_filter'] == 20 and body['partial'] is False
+    assert 0 < body['count'] == len(body['attractions']) <= 15
+    assert web.fake.call_counts()['directions'] == 1
+
+
+def test_streamed_route_search_ends_with_the_same_ranking(client):
+    payload = {'origin': 'Rome', 'destination': 'Florence', 'distance_km': 10}
+    expected = client.post('/get_route_attractions', json=payload).get_json()
+
+    response = client.post('/get_route_attractions/stream', json=payload)
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines() if line]
+    done = events[-1]
+
+    assert done['event'] == 'done'
+    assert done['attractions'] == expected['attractions']
+    streamed = {attraction['place_id'] for event in events[:-1] for attraction in event.get('attractions', [])}
+    assert {attraction['place_id'] for attraction in done['attractions']} <= streamed
+
+
+def test_route_search_requires_both_ends(client):
+    assert client.post('/get_route_attractions', json={'origin': 'Paris'}).status_code == 400
+
+
+@pytest.mark.parametrize('distance_km', [-5, 0, 0.0, 201, '20', None, True, [20]])
+@pytest.mark.parametrize('path', ['/get_route_attractions', '/get_route_attractions/stream'])
+def test_route_search_rejects_unusable_distances(client, web, path, distance_km):
+    payload = {'origin': 'Paris', 'destination': 'Lyon', 'distance_km': distance_km}
+    response = client.post(path, json=payload)
+
+    assert response.status_code == 400
+    assert 'distance_km' in response.get_json()['error']
+    assert web.fake.call_counts().get('directions', 0) == 0
+
+
+def test_travel_time_accepts_a_single_mode_name(client):
+    response = client.post('/get_travel_time', json={'origin': 'Paris', 'destination': 'Lyon',
+                                                     'modes': 'walking'})
+
+    assert response.status_code == 200
+    assert list(response.get_json()) == ['walking']
+
+
+@pytest.mark.parametrize('modes', [['driving', 3], {'mode': 'driving'}, [['walking']], 7])
+def test_travel_time_rejects_modes_that_are_not_names(client, web, modes):
+    response = client.post('/get_travel_time', json={'origin': 'Paris', 'destination': 'Lyon',
+                                                     'modes': modes})
+
+    assert response.status_code == 400
+    assert response.get_json()['error'] == web.INVALID_MODES_MESSAGE
+    assert web.fake.call_counts().get('directions', 0) == 0
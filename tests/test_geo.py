@@ -0,0 +1,108 @@
+import random
+
+import pytest
+
+from fake_maps import encode_polyline
+from geo import (MIN_ROUTE_CELL_M, RouteIndex, cumulative_distances, decode_polyline, haversine_m,
+                 plan_search_points, resample)
+
+
+def test_decode_polyline_matches_the_documented_example():
+    # From Google's encoded polyline algorithm format documentation
+    lats, lngs = decode_polyline('_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+    assert list(zip(lats, lngs)) == [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+
+
+def test_decode_polyline_round_trips_encoded_points():
+    rng = random.Random(7)
+    points = [(round(rng.uniform(-80, 80), 5), round(rng.uniform(-179, 179), 5)) for _ in range(200)]
+    lats, lngs = decode_polyline(encode_polyline(points))
+    assert [(round(lat, 5), round(lng, 5)) for lat, lng in zip(lats, lngs)] == points
+
+
+def test_decode_polyline_of_nothing_is_empty():
+    lats, lngs = decode_polyline('')
+    assert len(lats) == len(lngs) == 0
+
+
+def winding_route(rng, vertices=300):
+    lat, lng = 48.0, 2.0
+    lats, lngs = [lat], [lng]
+    heading = 0.0
+    for _ in range(vertices - 1):
+        heading += rng.uniform(-0.6, 0.6)
+        lat += 0.01 * rng.uniform(0.2, 1.0) * (1 if heading > 0 else -1) * abs(heading) ** 0.5
+        lng += 0.01 * rng.uniform(0.2, 1.0)
+        lats.append(lat)
+        lngs.append(lng)
+    return lats, lngs
+
+
+def brute_force_nearest(index, lat, lng, max_m):
+    best = None
+    for i in range(len(index.lats) - 1):
+        distance, along = index._segment_distance(i, lat, lng)
+        if distance <= max_m and (best is None or distance < best[0]):
+            best = (distance, along)
+    return best
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_route_index_nearest_matches_brute_force(seed):
+    rng = random.Random(seed)
+    lats, lngs = winding_route(rng)
+    index = RouteIndex(lats, lngs, cell_m=5000)
+    for _ in range(300):
+        lat = rng.uniform(min(lats) - 0.1, max(lats) + 0.1)
+        lng = rng.uniform(min(lngs) - 0.1, max(lngs) + 0.1)
+        expected = brute_force_nearest(index, lat, lng, 5000)
+        found = index.nearest(lat, lng)
+        if expected is None:
+            assert found is None
+        else:
+            assert found == pytest.approx(expected)
+
+
+def test_narrow_corridor_index_stays_small_and_exact():
+    rng = random.Random(11)
+    lats, lngs = winding_route(rng, vertices=401)
+    index = RouteIndex(lats, lngs, cell_m=10)
+
+    # Cells don't shrink with the corridor, and each segment is filed only
+    # under the cells it crosses
+    assert index.cell_m == MIN_ROUTE_CELL_M
+    assert sum(len(segments) for segments in index._cells.values()) < 4 * len(lats)
+    for i in range(0, len(lats) - 1, 7):
+        lat = (lats[i] + lats[i + 1]) / 2 + rng.uniform(-1e-4, 1e-4)
+        lng = (lngs[i] + lngs[i + 1]) / 2 + rng.uniform(-1e-4, 1e-4)
+        expected = brute_force_nearest(index, lat, lng, 10)
+        found = index.nearest(lat, lng)
+        assert found == (pytest.approx(expected) if expected else None)
+
+
+def test_route_index_handles_a_single_point_route():
+    index = RouteIndex([48.0], [2.0], cell_m=1000)
+    distance, along = index.nearest(48.001, 2.0)
+    assert distance == pytest.approx(haversine_m(48.001, 2.0, 48.0, 2.0))
+    assert along == 0.0
+    assert index.nearest(49.0, 2.0) is None
+
+
+@pytest.mark.parametrize('radius_m', [2000, 7500, 25000])
+def test_plan_search_points_covers_every_sample(radius_m):
+    lats, lngs = winding_route(random.Random(radius_m))
+    samples_lat, samples_lng, _ = resample(lats, lngs, 1000, distances=cumulative_distances(lats, lngs))
+    centers = plan_search_points(samples_lat, samples_lng, radius_m)
+
+    assert centers == sorted(set(centers))
+    for lat, lng in zip(samples_lat, samples_lng):
+        assert any(haversine_m(samples_lat[c], samples_lng[c], lat, lng) <= radius_m for c in centers)
+
+
+def test_plan_search_points_spreads_a_capped_budget_along_the_route():
+    lats, lngs = winding_route(random.Random(4))
+    samples_lat, samples_lng, _ = resample(lats, lngs, 1000)
+    centers = plan_search_points(samples_lat, samples_lng, 2000, max_points=8)
+
+    assert len(centers) == 8
+    assert centers[0] == 0 and centers[-1] == len(samples_lat) - 1
@@ -0,0 +1,73 @@
+import itertools
+import math
+import random
+
+import pytest
+
+from itinerary import UNREACHABLE_COST, nearest_neighbour, path_cost, plan_order
+
+
+def random_matrix(rng, n, asymmetric=True):
+    points = [(rng.uniform(0, 100), rng.uniform(0, 100)) for _ in range(n)]
+    cost = []
+    for i, a in enumerate(points):
+        row = []
+        for j, b in enumerate(points):
+            distance = math.dist(a, b)
+            # One-way streets: some legs cost more in one direction
+            row.append(0.0 if i == j else distance * (rng.uniform(1.0, 1.5) if asymmetric else 1.0))
+        cost.append(row)
+    return cost
+
+
+def best_cost(cost, start, round_trip):
+    others = [stop for stop in range(len(cost)) if stop != start]
+    return min(path_cost([start, *rest], cost, round_trip) for rest in itertools.permutations(others))
+
+
+@pytest.mark.parametrize('round_trip', [False, True])
+def test_plan_order_is_close_to_optimal_on_small_instances(round_trip):
+    rng = random.Random(3)
+    for _ in range(20):
+        n = rng.randint(4, 8)
+        cost = random_matrix(rng, n)
+        order = plan_order(cost, start=0, round_trip=round_trip)
+
+        assert order[0] == 0 and sorted(order) == list(range(n))
+        assert path_cost(order, cost, round_trip) <= best_cost(cost, 0, round_trip) * 1.1
+
+
+def test_plan_order_never_loses_to_nearest_neighbour():
+    rng = random.Random(5)
+    for _ in range(10):
+        cost = random_matrix(rng, 25)
+        order = plan_order(cost)
+        assert path_cost(order, cost) <= path_cost(nearest_neighbour(cost), cost) + 1e-9
+
+
+def test_plan_order_visits_collinear_stops_in_line():
+    positions = [0, 7, 3, 9, 1, 5]
+    cost = [[abs(a - b) for b in positions] for a in positions]
+    order = plan_order(cost, start=0)
+    assert [positions[stop] for stop in order] == sorted(positions)
+
+
+def test_plan_order_keeps_the_start_stop_first():
+    cost = random_matrix(random.Random(8), 6)
+    assert plan_order(cost, start=4)[0] == 4
+
+
+def test_plan_order_avoids_pairs_without_a_route():
+    cost = random_matrix(random.Random(9), 6, asymmetric=False)
+    cost[2][1] = cost[3][1] = None
+    cost[4][1] = cost[5][1] = float('nan')
+    order = plan_order(cost, start=0)
+    # Only the start has a route to stop 1, so it has to come straight after
+    assert order[1] == 1
+    known = [[UNREACHABLE_COST if value is None or math.isnan(value) else value for value in row] for row in cost]
+    assert path_cost(order, known) < UNREACHABLE_COST
+
+
+def test_plan_order_handles_one_or_two_stops():
+    assert plan_order([[0.0]]) == [0]
+    assert plan_order([[0.0, 1.0], [2.0, 0.0]], start=1) == [1, 0]
@@ -0,0 +1,58 @@
+import os
+import time
+
+from maps_cache import ResponseCache, SqliteCache, TileCache
+
+
+def test_memory_cache_expires_entries():
+    cache = ResponseCache(ttls={'geocode': 0.05})
+    cache.set('geocode', {'address': 'Paris', 'key': 'secret'}, {'status': 'OK'})
+    assert cache.get('geocode', {'address': 'Paris', 'key': 'other'}) == {'status': 'OK'}
+    time.sleep(0.06)
+    assert cache.get('geocode', {'address': 'Paris'}) is None
+
+
+def test_backend_hit_keeps_its_remaining_lifetime(tmp_path):
+    backend = SqliteCache(os.path.join(tmp_path, 'cache.db'))
+    writer = ResponseCache(backend=backend, ttls={'geocode': 0.2})
+    writer.set('geocode', {'address': 'Paris'}, {'status': 'OK'})
+    time.sleep(0.15)
+
+    # Another process reads it from disk with 0.05s left; it must not live another 0.2s in memory
+    reader = ResponseCache(backend=backend, ttls={'geocode': 0.2})
+    assert reader.get('geocode', {'address': 'Paris'}) == {'status': 'OK'}
+    time.sleep(0.1)
+    assert reader.get('geocode', {'address': 'Paris'}) is None
+
+
+def test_sqlite_cache_purges_expired_rows(tmp_path):
+    cache = SqliteCache(os.path.join(tmp_path, 'cache.db'), purge_interval=0)
+    cache.set('old', 1, 0.01)
+    time.sleep(0.02)
+    cache.set('new', 2, 60)
+    rows = cache._connection().execute('SELECT key FROM cache').fetchall()
+    assert rows == [('new',)]
+
+
+def place_at(name, lat, lng):
+    return {'name': name, 'geometry': {'location': {'lat': lat, 'lng': lng}}}
+
+
+def test_tile_cache_answers_circles_inside_a_stored_one():
+    tiles = TileCache()
+    near, far = place_at('near', 48.857, 2.352), place_at('far', 48.95, 2.45)
+    tiles.put('museum', 48.857, 2.352, 20000, [near, far])
+
+    assert tiles.get('museum', 48.858, 2.353, 2000) == [near]
+    assert tiles.get('park', 48.858, 2.353, 2000) is None
+    assert tiles.get('museum', 48.858, 2.353, 30000) is None
+    assert tiles.stats()['hits'] == 1 and tiles.stats()['misses'] == 2
+
+
+def test_truncated_search_is_not_filed_as_a_tile(client, web):
+    wide = web.search_places_by_type(48.857, 2.352, 'museum', 50000)
+    narrow = web.search_places_by_type(48.857, 2.352, 'museum', 5000)
+
+    assert len(wide) == web.PLACES_PAGE_SIZE
+    assert narrow and web.fake.call_counts()['places'] == 2
+    assert web.places_tiles.get('museum', 48.857, 2.352, 1000) is None
@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+import fake_maps
+from maps_client import build_selected, select_fields, shape_id
+
+ijson = pytest.importorskip('ijson')
+
+SYNTHETIC = fake_maps.SyntheticMaps()
+
+
+def documents():
+    yield SYNTHETIC.nearby({'location': '48.85,2.35', 'radius': '5000', 'type': 'tourist_attraction'})
+    yield SYNTHETIC.geocode({'address': 'Paris'})
+    yield SYNTHETIC.directions({'origin': 'Paris', 'destination': 'Lyon', 'mode': 'transit'})
+    yield SYNTHETIC.distance_matrix({'origins': 'Paris|Lyon', 'destinations': 'Rome|Vienna|Prague'})
+    # Odd corners: nulls, empty containers, nested arrays, a shape key the document lacks
+    yield {'status': 'OK', 'results': [], 'rows': [[1, [2, {}]], None], 'extra': {'deep': [{'x': None}]}}
+
+
+def shapes():
+    from app import DIRECTIONS_FIELDS, GEOCODE_FIELDS, PLACES_FIELDS, ROUTE_GEOMETRY_FIELDS
+    yield PLACES_FIELDS
+    yield GEOCODE_FIELDS
+    yield ROUTE_GEOMETRY_FIELDS
+    yield DIRECTIONS_FIELDS
+    yield True
+    yield {'status': True, 'rows': [True], 'missing': {'a': True}}
+    yield {'rows': [{'elements': [{'duration': {'value': True}}]}]}
+
+
+@pytest.mark.parametrize('shape', list(shapes()), ids=shape_id)
+def test_build_selected_matches_select_fields(shape):
+    for document in documents():
+        events = ijson.parse(json.dumps(document).encode(), use_float=True)
+        assert build_selected(events, shape) == select_fields(document, shape)
+
+
+def test_select_fields_keeps_only_the_shape():
+    document = {'status': 'OK', 'results': [{'name': 'A', 'rating': 4.5, 'icon': 'x'}], 'html_attributions': []}
+    shape = {'status': True, 'results': [{'name': True, 'rating': True}]}
+    assert select_fields(document, shape) == {'status': 'OK', 'results': [{'name': 'A', 'rating': 4.5}]}
@@ -0,0 +1,72 @@
+import math
+import random
+
+import pytest
+
+from places import Place
+from ranking import PROFILES, passes_filter, top_places
+
+
+# The per-endpoint scoring closures ranking.py replaced, kept as the reference
+
+def old_nearby_score(place):
+    score = ((place.rating - 1) / 4) * 0.7 + min(math.log10(place.user_ratings_total + 1) / 4, 1.0) * 0.3
+    if place.rating >= 4.5 and place.user_ratings_total >= 100:
+        score += 0.1
+    return score
+
+
+def old_city_score(place):
+    rating, review_count = place.rating, place.user_ratings_total
+    score = ((rating - 1) / 4) * 0.65 + min(math.log10(review_count + 1) / 4.5, 1.0) * 0.35
+    if rating >= 4.5 and review_count >= 500:
+        score += 0.15
+    elif rating >= 4.3 and review_count >= 1000:
+        score += 0.1
+    if 'tourist_attraction' in (place.types or []):
+        score += 0.05
+    return score
+
+
+def old_route_score(place):
+    score = ((place.rating - 1) / 4) * 0.6 + min(math.log10(place.user_ratings_total + 1) / 4, 1.0) * 0.4
+    if place.rating >= 4.5 and place.user_ratings_total >= 100:
+        score += 0.1
+    return score
+
+
+OLD_SCORES = {'nearby': old_nearby_score, 'city': old_city_score, 'route': old_route_score}
+
+
+def candidates(seed, count=300):
+    rng = random.Random(seed)
+    places = []
+    for i in range(count):
+        # Coarse values so ties are common and their order is checked too
+        rating = rng.choice([3.8, 4.0, 4.2, 4.3, 4.5, 4.7, 5.0])
+        reviews = rng.choice([10, 99, 100, 500, 999, 1000, 5000, 40000])
+        types = rng.choice([['tourist_attraction', 'museum'], ['park'], None])
+        places.append(Place(f'Place {i}', 'Somewhere', rating, reviews, types))
+    return places
+
+
+@pytest.mark.parametrize('profile_name', sorted(PROFILES))
+@pytest.mark.parametrize('seed', [1, 2])
+def test_top_places_matches_the_old_closures(profile_name, seed):
+    places = candidates(seed)
+    profile = PROFILES[profile_name]
+    expected = sorted(places, key=OLD_SCORES[profile_name], reverse=True)
+
+    assert top_places(places, profile) == expected[:profile.limit]
+    assert top_places(places, profile, k=len(places)) == expected
+
+
+def test_top_places_of_nothing_is_empty():
+    assert top_places([], PROFILES['city']) == []
+
+
+def test_passes_filter_uses_the_profile_thresholds():
+    route = PROFILES['route']
+    assert passes_filter(3.8, 10, route)
+    assert not passes_filter(3.7, 1000, route)
+    assert not passes_filter(5.0, 9, route)
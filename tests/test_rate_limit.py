@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+import pytest
+
+import deadline
+import rate_limit
+import shared_state
+from rate_limit import QuotaWaitTimeout, RateLimiter, TokenBucket
+
+
+def test_token_bucket_refills_at_its_rate_up_to_the_burst():
+    bucket = TokenBucket(rate=10, burst=5)
+    bucket.tokens = 0
+    bucket.refill(bucket.updated + 0.2)
+    assert bucket.tokens == pytest.approx(2)
+    bucket.refill(bucket.updated + 60)
+    assert bucket.tokens == 5
+
+
+def test_limiter_lets_the_burst_through_then_paces():
+    limiter = RateLimiter({'places': 50}, burst_seconds=0.1)
+    started = time.monotonic()
+    for _ in range(5 + 10):
+        limiter.acquire('places')
+    # 5 tokens of burst, then 10 more at 50 per second
+    assert 0.15 <= time.monotonic() - started < 1.0
+    assert limiter.stats()['places']['granted'] == 15
+
+
+def test_unlimited_apis_never_wait():
+    limiter = RateLimiter({'places': 0})
+    assert all(limiter.acquire('places') == 0.0 for _ in range(1000))
+
+
+def test_background_work_leaves_part_of_the_burst():
+    limiter = RateLimiter({'places': 1}, burst_seconds=8, background_reserve=0.25, max_wait=0.05)
+    with rate_limit.priority(rate_limit.BACKGROUND):
+        granted = 0
+        with pytest.raises(QuotaWaitTimeout):
+            while True:
+                limiter.acquire('places')
+                granted += 1
+    # 8 tokens, 2 held back for interactive and normal requests
+    assert granted == 6
+    limiter.acquire('places', level=rate_limit.INTERACTIVE)
+
+
+def test_wait_stops_at_the_request_deadline():
+    limiter = RateLimiter({'places': 1}, burst_seconds=1, max_wait=30)
+    limiter.acquire('places')
+    started = time.monotonic()
+    with deadline.budget(0.3), pytest.raises(QuotaWaitTimeout):
+        limiter.acquire('places')
+    assert time.monotonic() - started < 0.3
+
+
+def test_penalize_empties_the_bucket():
+    limiter = RateLimiter({'places': 100}, max_wait=0.001)
+    limiter.penalize('places')
+    with pytest.raises(QuotaWaitTimeout):
+        limiter.acquire('places')
+
+
+class BrokenStore:
+    errors = (OSError,)
+
+    def take_token(self, api, rate, burst, floor=1.0):
+        raise OSError('store unavailable')
+
+    def drain(self, api):
+        raise OSError('store unavailable')
+
+
+def test_unreachable_store_falls_back_to_local_buckets():
+    limiter = RateLimiter({'places': 100}, store=BrokenStore())
+    for _ in range(3):
+        limiter.acquire('places')
+    limiter.penalize('places')
+    stats = limiter.stats()['places']
+    assert stats['store_errors'] == 3 and stats['granted'] == 3
+
+
+class DownPipeline:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def watch(self, *keys):
+        raise ConnectionError('connection refused')
+
+
+class DownRedis:
+    """A redis-py stand-in for a server that can't be reached"""
+
+    def pipeline(self, transaction=True):
+        return DownPipeline()
+
+    def exists(self, key):
+        raise ConnectionError('connection refused')
+
+
+def test_unreachable_redis_stand_in_falls_back_without_redis_installed(monkeypatch):
+    monkeypatch.setattr(shared_state, 'redis', None)
+    limiter = RateLimiter({'places': 100}, store=shared_state.RedisStore(DownRedis()))
+    for _ in range(3):
+        limiter.acquire('places')
+    limiter.penalize('places')
+    stats = limiter.stats()['places']
+    assert stats['store_errors'] == 3 and stats['granted'] == 3
+
+
+def test_acquire_async_paces_without_blocking_the_loop():
+    limiter = RateLimiter({'places': 100}, burst_seconds=0.05)
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        tick_task = asyncio.create_task(ticker())
+        await asyncio.gather(*(limiter.acquire_async('places') for _ in range(25)))
+        tick_task.cancel()
+        return ticks
+
+    assert asyncio.run(main()) >= 5
+    assert limiter.stats()['places']['granted'] == 25
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from maps_cache import AsyncSingleFlight, FlightWaitTimeout, SingleFlight
+
+
+def run_concurrently(count, target):
+    results = [None] * count
+    errors = [None] * count
+
+    def run(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_callers_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def work():
+        calls.append(1)
+        release.wait(2)
+        return 'result'
+
+    threading.Timer(0.2, release.set).start()
+    results, errors = run_concurrently(8, lambda: flight.do('key', work))
+
+    assert results == ['result'] * 8 and errors == [None] * 8
+    assert len(calls) == 1
+    assert flight.stats() == {'executions': 1, 'shared': 7, 'wait_timeouts': 0, 'in_flight': 0}
+
+
+def test_waiters_get_the_leaders_exception():
+    flight = SingleFlight()
+
+    def work():
+        time.sleep(0.2)
+        raise ValueError('upstream failed')
+
+    _, errors = run_concurrently(4, lambda: flight.do('key', work))
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert flight.stats()['executions'] == 1
+
+
+def test_nothing_is_remembered_after_a_call():
+    flight = SingleFlight()
+    assert flight.do('key', lambda: 1) == 1
+    assert flight.do('key', lambda: 2) == 2
+
+
+def test_waiter_gives_up_after_its_timeout():
+    flight = SingleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=('key', release.wait, 5))
+    leader.start()
+    time.sleep(0.05)
+
+    started = time.monotonic()
+    with pytest.raises(FlightWaitTimeout):
+        flight.do_within(0.1, 'key', lambda: 'never')
+    assert time.monotonic() - started < 1
+    release.set()
+    leader.join()
+    assert flight.stats()['wait_timeouts'] == 1
+
+
+def test_async_callers_share_one_execution():
+    async def main():
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'result'
+
+        results = await asyncio.gather(*(flight.do('key', work) for _ in range(5)))
+        return results, calls, flight.stats()
+
+    results, calls, stats = asyncio.run(main())
+    assert results == ['result'] * 5 and len(calls) == 1
+    assert stats['shared'] == 4 and stats['in_flight'] == 0
+
+
+def test_async_work_survives_the_first_caller_being_cancelled():
+    async def main():
+        flight = AsyncSingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.2)
+            return 'result'
+
+        first = asyncio.create_task(asyncio.wait_for(flight.do('key', work), 0.05))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(flight.do('key', work))
+        with pytest.raises(asyncio.TimeoutError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == 'result'
@@ -0,0 +1,323 @@
+"""
+Per-request tracing of outbound Maps calls and in-process stages, with Prometheus metrics
+
+Every outbound Maps call (including ones answered from the cache) and every
+timed stage (ranking, dedup, route planning) is recorded twice: as a span on
+the current request's Trace, which feeds the Server-Timing header and the
+slow-request log, and in the process-wide metrics rendered at /metrics.
+
+The current trace lives in a context variable. ContextThreadPoolExecutor and
+bind() carry it onto pool threads and timers, so calls made on behalf of a
+request are attributed to it wherever they run.
+"""
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Upper bounds in seconds; upstream calls run from a few ms (cache) to ~10s (timeouts)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_current_trace = contextvars.ContextVar('maps_trace', default=None)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                     for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a fixed set of label names"""
+
+    def __init__(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += 1
+            state[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in items:
+            for bound, count in zip(self.buckets + ('+Inf',), state[:len(self.buckets)] + [state[-2]]):
+                le = bound if bound == '+Inf' else _format_value(float(bound))
+                labels = _format_labels(self.labels + ('le',), key + (le,))
+                lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_count{labels} {state[-2]}')
+            lines.append(f'{self.name}_sum{labels} {_format_value(state[-1])}')
+        return lines
+
+
+class Gauge:
+    """Point-in-time values read from ``collect()`` at scrape time
+
+    ``collect`` returns a dict of label-value tuples to numbers.
+    """
+
+    def __init__(self, name, help_text, labels, collect):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge']
+        for key, value in sorted(self.collect().items()):
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+        return lines
+
+
+class MetricsRegistry:
+    """The process's metrics, rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, labels, collect):
+        metric = Gauge(name, help_text, labels, collect)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+upstream_requests = metrics.counter(
+    'maps_upstream_requests_total', 'Maps web service calls sent upstream, by API and response status',
+    ('api', 'status'))
+upstream_seconds = metrics.histogram(
+    'maps_upstream_request_seconds', 'Latency of Maps web service calls sent upstream', ('api',))
+upstream_bytes = metrics.counter(
+    'maps_upstream_response_bytes_total', 'Response bytes received from Maps web services', ('api',))
+cache_hits = metrics.counter(
+    'maps_cache_hits_total', 'Maps calls answered from the response cache', ('api',))
+stage_seconds = metrics.histogram(
+    'app_stage_seconds', 'Time spent in in-process stages such as ranking and dedup', ('stage',))
+http_requests = metrics.counter(
+    'http_requests_total', 'HTTP requests served, by endpoint and status code', ('endpoint', 'method', 'status'))
+http_seconds = metrics.histogram(
+    'http_request_seconds', 'Time to produce an HTTP response', ('endpoint',))
+http_upstream_calls = metrics.histogram(
+    'http_request_upstream_calls', 'Maps calls sent upstream per HTTP request', ('endpoint',), COUNT_BUCKETS)
+
+
+class Span:
+    __slots__ = ('kind', 'name', 'status', 'duration', 'bytes', 'cached')
+
+    def __init__(self, kind, name, status, duration, nbytes=0, cached=False):
+        self.kind = kind
+        self.name = name
+        self.status = status
+        self.duration = duration
+        self.bytes = nbytes
+        self.cached = cached
+
+
+class Trace:
+    """Spans recorded while serving one request"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def upstream_calls(self):
+        with self._lock:
+            return sum(1 for span in self.spans if span.kind == 'maps' and not span.cached)
+
+    def summary(self):
+        """Spans grouped by (kind, name): calls, cache hits, total and max seconds, bytes"""
+        groups = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            group = groups.setdefault((span.kind, span.name),
+                                      {'calls': 0, 'cached': 0, 'total': 0.0, 'max': 0.0, 'bytes': 0})
+            if span.cached:
+                group['cached'] += 1
+                continue
+            group['calls'] += 1
+            group['total'] += span.duration
+            group['max'] = max(group['max'], span.duration)
+            group['bytes'] += span.bytes
+        return groups
+
+    def server_timing(self):
+        """Server-Timing header value; upstream durations are summed, so they can exceed the total"""
+        entries = []
+        for (kind, name), group in self.summary().items():
+            if kind == 'maps':
+                desc = f'{group["calls"]} calls, {group["cached"]} cached, max {group["max"] * 1000:.0f}ms'
+                entries.append(f'maps-{name};dur={group["total"] * 1000:.1f};desc="{desc}"')
+            else:
+                entries.append(f'{name};dur={group["total"] * 1000:.1f}')
+        entries.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(entries)
+
+    def describe(self):
+        """One-line breakdown for the slow-request log"""
+        parts = []
+        for (kind, name), group in sorted(self.summary().items(), key=lambda item: -item[1]['total']):
+            if kind == 'maps':
+                parts.append(f'{name}: {group["calls"]} calls ({group["cached"]} cached), '
+                             f'{group["total"]:.2f}s total, {group["max"]:.2f}s max')
+            else:
+                parts.append(f'{name}: {group["total"] * 1000:.1f}ms')
+        return '; '.join(parts) or 'no Maps calls'
+
+
+def start_trace(endpoint):
+    """Begin a trace for the current request; returns a token for end_trace"""
+    return _current_trace.set(Trace(endpoint))
+
+
+def end_trace(token):
+    try:
+        _current_trace.reset(token)
+    except ValueError:
+        # Finished in a different context (e.g. after a streamed response)
+        _current_trace.set(None)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def record_upstream(api, status, seconds, nbytes=0):
+    """Record one Maps call that went to Google"""
+    upstream_requests.inc(api=api, status=status)
+    upstream_seconds.observe(seconds, api=api)
+    if nbytes:
+        upstream_bytes.inc(nbytes, api=api)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(Span('maps', api, status, seconds, nbytes))
+
+
+def record_cache_hit(api):
+    """Record one Maps call answered from the response cache"""
+    cache_hits.inc(api=api)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(Span('maps', api, 'CACHED', 0.0, cached=True))
+
+
+def record_stage(name, seconds):
+    """Record time spent in a named stage of the current request"""
+    stage_seconds.observe(seconds, stage=name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(Span('stage', name, 'OK', seconds))
+
+
+@contextmanager
+def stage(name):
+    """Time a block of in-process work (ranking, dedup, ...)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def timed(name):
+    """Decorator form of stage()"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_request(trace, method, status):
+    """Record a finished HTTP request's metrics"""
+    http_requests.inc(endpoint=trace.endpoint, method=method, status=status)
+    http_seconds.observe(trace.elapsed(), endpoint=trace.endpoint)
+    http_upstream_calls.observe(trace.upstream_calls(), endpoint=trace.endpoint)
+
+
+def bind(fn):
+    """Wrap ``fn`` to run with the caller's trace, e.g. as a threading.Timer target"""
+    context = contextvars.copy_context()
+    return functools.partial(context.run, fn)
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor whose tasks run with the submitter's trace"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)